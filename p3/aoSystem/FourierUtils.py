@@ -14,7 +14,7 @@ if not gpuEnabled:
     import scipy.interpolate as interp        
     import scipy.ndimage as scnd
     import scipy.special as ssp
-    import numpy.fft as fft
+    from p3.aoSystem.fftBackend import fft
 else:
     import cupy as cp
     import scipy.interpolate as interp        
@@ -38,6 +38,15 @@ def cpuArray(v):
 
 #%%  FOURIER TOOLS
 
+def fftOptions(x):
+    '''
+        Options of the FFT backend (see fftBackend) that keep single-precision arrays in single precision.
+        cupy.fft always does.
+    '''
+    if gpuEnabled or x.dtype not in [np.float32,np.complex64]:
+        return {}
+    return {'single':True}
+
 def cov2sf(cov):
     return 2*cov.max() - cov - np.conjugate(cov)
 
@@ -70,6 +79,46 @@ def fftsym(x):
     elif x.ndim ==1:
         return fft.fftshift(x)
 
+def fullToHalfPlane(x):
+    '''
+        Half-plane representation of a centered array x of size nX x nX x ... : the Hermitian part
+        (x(k) + conj(x(-k)))/2 of x, in the FFT (unshifted) order, of which only the nX//2+1 first
+        columns are kept. This is the layout of numpy.fft.rfftn/irfftn over the axes (0,1), and the
+        real part of the inverse FFT of x is the inverse real FFT of its half-plane representation.
+    '''
+    nX   = x.shape[0]
+    xu   = fft.ifftshift(x,axes=(0,1))
+    idx  = (-nnp.arange(nX)) % nX
+    return 0.5*(xu[:,:nX//2+1] + np.conj(xu[idx][:,idx[:nX//2+1]]))
+
+def halfToFullPlane(xh,nX):
+    '''
+        Centered nX x nX array rebuilt from its half-plane representation (see fullToHalfPlane)
+        using x(-k) = conj(x(k)).
+    '''
+    idx  = (-nnp.arange(nX)) % nX
+    cols = nX - nnp.arange(nX//2+1,nX)
+    full = np.concatenate((xh,np.conj(xh[idx][:,cols])),axis=1)
+    return fft.fftshift(full,axes=(0,1))
+
+def halfPlaneWeights(nX):
+    '''
+        Multiplicity of each column of the half-plane representation in the full plane.
+    '''
+    w     = 2*np.ones(nX//2+1)
+    w[0]  = 1
+    if nX % 2 == 0:
+        w[-1] = 1
+    return w
+
+def halfPlanePsd2sf(psdHalf,nX):
+    '''
+        Phase structure function 2*(cov(0) - cov) of a PSD, both in the half-plane representation.
+        Unlike the cov.max() normalization, it is linear in the PSD.
+    '''
+    cov = nX**2 * fft.irfftn(psdHalf,s=(nX,nX),axes=(0,1),**fftOptions(psdHalf))
+    return 2*(cov[:1,:1] - cov[:,:nX//2+1])
+
 def freq_array(nX, L=1, offset=1e-10):
     k2D = np.mgrid[0:nX, 0:nX].astype(float)
     k2D[0] -= nX//2
@@ -86,9 +135,11 @@ def getStaticOTF(tel,nOtf,samp,wvl,xStat=[],theta_ext=0,spatialFilter=1):
         # ADDING STATIC MAP
         phaseStat = np.zeros((nPup,nPup))
         if not tel.opdMap_on is None and np.any(tel.opdMap_on):
+            opdMap = tel.opdMap_on
             if theta_ext:
-                tel.opdMap_on = scnd.rotate(tel.opdMap_on,theta_ext,reshape=False)
-            phaseStat = (2*np.pi*1e-9/wvl) * tel.opdMap_on
+                # rotated copy : the telescope map is left untouched
+                opdMap = scnd.rotate(opdMap,theta_ext,reshape=False)
+            phaseStat = (2*np.pi*1e-9/wvl) * opdMap
             
         # ADDING USER-SPECIFIED STATIC MODES
         xStat = np.asarray(xStat)
@@ -127,14 +178,95 @@ def instantiateAngularFrequencies(nOtf,fact=2):
     UV_    = U_*V_
     return U_, V_, U2_, V2_, UV_
           
-def mcDonald(x):
-        out = 3/5 * np.ones_like(x)
-        idx  = x!=0
-        if np.any(idx==False):
-            out[idx] = x[idx] ** (5/6) * ssp.kv(5/6,x[idx])/(2**(5/6) * ssp.gamma(11/6))
-        else:
-            out = x ** (5/6) * ssp.kv(5/6,x)/(2**(5/6) * ssp.gamma(11/6))
-        return out
+def mcDonald(x,exact=False,chunkSize=2**20):
+        '''
+            McDonald function x^(5/6)*K_5/6(x)/(2^(5/6)*Gamma(11/6)), equal to 3/5 at 0. By default, it is
+            interpolated from the tables of mcDonaldTable, with a relative error below 1e-12, by chunks of
+            chunkSize elements; exact=True calls scipy.special.kv on every element.
+        '''
+        if exact:
+            out = 3/5 * np.ones_like(x)
+            idx  = x!=0
+            if np.any(idx==False):
+                out[idx] = x[idx] ** (5/6) * ssp.kv(5/6,x[idx])/(2**(5/6) * ssp.gamma(11/6))
+            else:
+                out = x ** (5/6) * ssp.kv(5/6,x)/(2**(5/6) * ssp.gamma(11/6))
+            return out
+        
+        T   = mcDonaldTable()
+        x   = np.asarray(x,dtype=float)
+        xf  = np.abs(x.reshape(-1))
+        out = np.empty(xf.shape)
+        for k in range(0,xf.size,chunkSize):
+            c  = xf[k:k+chunkSize]
+            o  = np.empty(c.shape)
+            # small arguments : table in x^(1/3)
+            iS = c < T['xA']
+            o[iS] = cubicHermite(np.cbrt(c[iS]),0,T['hA'],T['fA'],T['dA'])
+            # intermediate arguments : table of f(x)*exp(x)
+            iM = (c >= T['xA']) & (c <= T['xB'])
+            cM = c[iM]
+            o[iM] = cubicHermite(cM,T['xA'],T['hB'],T['fB'],T['dB']) * np.exp(-cM)
+            # large arguments : asymptotic expansion
+            iL = c > T['xB']
+            o[iL] = mcDonaldAsymptotic(c[iL])
+            out[k:k+chunkSize] = o
+        return out.reshape(x.shape)
+
+def mcDonaldAsymptotic(x,nTerms=10):
+    '''
+        Asymptotic expansion of the McDonald function at large x, from the one of K_5/6 to the order nTerms.
+    '''
+    mu   = 4*(5/6)**2
+    term = np.ones_like(x)
+    a    = np.ones_like(x)
+    for k in range(1,nTerms+1):
+        term = term*(mu - (2*k-1)**2)/(8*k*x)
+        a    = a + term
+    return x**(1/3)*np.sqrt(np.pi/2)*np.exp(-x)*a/(2**(5/6) * ssp.gamma(11/6))
+
+def cubicHermite(xq,x0,h,y,dy):
+    '''
+        Cubic Hermite interpolation at xq of the values y and derivatives dy given on the regular grid x0 + h*k.
+    '''
+    u  = (xq - x0)/h
+    k  = np.clip(u.astype(int),0,len(y)-2)
+    s  = u - k
+    return (1+2*s)*(1-s)**2*y[k] + s*(1-s)**2*h*dy[k] + s*s*(3-2*s)*y[k+1] + s*s*(s-1)*h*dy[k+1]
+
+mcDonaldTables = {}
+
+def mcDonaldTable(xA=2.0,nA=2000,xB=40.0,nB=8000):
+    '''
+        Tables of the McDonald function f, built once from its exact values and derivatives 
+        d(x^nu*K_nu)/dx = -x^nu*K_(nu-1) :
+            - f as a function of t = x^(1/3) for x < xA. Near 0, f is a series in t^5 and t^6, so it is
+              smooth in t but not in x.
+            - f(x)*exp(x) for xA <= x <= xB, which varies slowly, so the relative error stays bounded
+              where f decays exponentially
+        Beyond xB, the asymptotic expansion is used (see mcDonaldAsymptotic). The largest relative error
+        against scipy.special.kv is measured at the quarter points of the table intervals and beyond xB.
+        It is stored in the 'relativeError' entry and is about 1e-13 with the default sizes.
+    '''
+    key = (xA,nA,xB,nB)
+    if key not in mcDonaldTables:
+        import scipy.special as sp
+        C   = 2**(5/6) * sp.gamma(11/6)
+        f   = lambda x: nnp.where(x > 0,x**(5/6)*sp.kv(5/6,nnp.maximum(x,1e-300))/C,3/5)
+        df  = lambda x: nnp.where(x > 0,-x**(5/6)*sp.kv(1/6,nnp.maximum(x,1e-300))/C,0)
+        t   = nnp.linspace(0,xA**(1/3),nA)
+        xb  = nnp.linspace(xA,xB,nB)
+        T   = {'xA':xA,'xB':xB,'hA':t[1]-t[0],'hB':xb[1]-xb[0],
+               'fA':f(t**3),'dA':df(t**3)*3*t**2,'fB':f(xb)*nnp.exp(xb),'dB':(df(xb) + f(xb))*nnp.exp(xb)}
+        T   = {k:(np.asarray(v) if isinstance(v,nnp.ndarray) else v) for k,v in T.items()}
+        mcDonaldTables[key] = T
+        # measured relative error
+        q   = nnp.arange(1,4)/4
+        xq  = nnp.concatenate([((t[:-1,None] + q*T['hA'])**3).ravel(),(xb[:-1,None] + q*T['hB']).ravel(),
+                               nnp.linspace(xB,10*xB,1000)])
+        val = nnp.asarray(cpuArray(mcDonald(np.asarray(xq))))
+        T['relativeError'] = nnp.abs(val/f(xq) - 1).max()
+    return mcDonaldTables[key]
         
 def Ialpha(x,y):
     return mcDonald(np.hypot(x,y))
@@ -271,19 +403,34 @@ def telescopePsf(pupil,samp,kind='spline'):
 
 
 def SF2PSF(sf,freq,ao,jitterX=0,jitterY=0,jitterXY=0,F=[[1.0]],dx=[[0.0]],dy=[[0.]],bkg=0,xStat=[],
-           theta_ext=0,nPix=None,otfPixel=1,spatialFilter=1):
+           theta_ext=0,nPix=None,otfPixel=1,spatialFilter=1,halfPlane=False,nSrc=None,metricsOnly=False):
         """
           Computation of the PSF and the Strehl-ratio (from the OTF integral). The Phase structure function
-          must be expressed in nm^2 and of the size nPx x nPx x nSrc
+          must be expressed in nm^2 and of the size nPx x nPx x nSrc.
+          All sources and wavelengths are processed as a single nOtf x nOtf x nSrc x nWvl stack : one
+          inverse FFT, then one binning/cropping step per group of wavelengths sharing the same binning factor.
+          If halfPlane is True, sf is given in the half-plane representation (see fullToHalfPlane) of size 
+          nPx x (nPx//2+1) x nSrc and the PSF is obtained from the half-plane OTF with a real inverse FFT.
+          If sf is in single precision, the OTFs are stacked and Fourier-transformed in single precision; 
+          the exponential of the structure function and the Strehl-ratios are computed in double precision.
+          nSrc is the number of sources of sf, by default the number of science sources of ao.
+          If metricsOnly is True, the OTFs are neither stacked nor inverse Fourier-transformed : the function
+          returns the 2 x nSrc x nWvl FWHM in mas instead of the PSF, measured on the cuts of the PSF along 
+          the two axes through its center, which only need the 1D inverse FFTs of the OTF summed over the 
+          other axis (see profileFWHM). The FWHM is taken before the binning and the shift of the PSF.
         """
         
         # INSTANTIATING THE OUTPUTS
         if nPix == None:
             nPix = int(freq.nOtf /freq.kRef_)
+        if nSrc is None:
+            nSrc = ao.src.nSrc
+        nWvl = freq.nWvl
+        SR   = np.zeros((nSrc,nWvl))
+        F    = np.asarray(F)
+        dx   = np.asarray(dx)
+        dy   = np.asarray(dy)
         
-        PSF = np.zeros((nPix,nPix,ao.src.nSrc,freq.nWvl))
-        SR  = np.zeros((ao.src.nSrc,freq.nWvl))
-
         # DEFINING THE RESIDUAL JITTER KERNEL
         if jitterX!=0 or jitterY!=0:        
             # Gaussian kernel
@@ -297,79 +444,110 @@ def SF2PSF(sf,freq,ao,jitterX=0,jitterY=0,jitterXY=0,F=[[1.0]],dx=[[0.0]],dy=[[0
         else:
             Kjitter = 1
             
-        # DEFINE THE FFT PHASOR AND MULTIPLY TO THE TELESCOPE OTF
-        if np.any(dx!=0) or np.any(dy!=0):
-            # shift by half a pixel
-            fftPhasor = np.zeros((freq.nOtf,freq.nOtf,ao.src.nSrc,freq.nWvl),dtype=complex)
-            if freq.kRef_ > 2: #[jWvl] >2:
-                fact = freq.kRef_#[jWvl]
+        # DEFINE THE SEPARABLE FFT PHASORS : exp(-i*pi*fact*(dx*U + dy*V)) = exp(-i*pi*fact*dx*u) x exp(-i*pi*fact*dy*v)
+        isShifted = np.any(dx!=0) or np.any(dy!=0)
+        if isShifted:
+            # account for the binning
+            if freq.kRef_ > 2:
+                fact = freq.kRef_
             else:
                 fact = 1
-            for iSrc in range(ao.src.nSrc):
-                for jWvl in range(freq.nWvl):
-                    # account for the binning
-                    fftPhasor[:,:,iSrc,jWvl] = np.exp(-np.pi*complex(0,1)*fact*\
-                             (dx[iSrc,jWvl]*freq.U_ + dy[iSrc,jWvl]*freq.V_))
+            # U_ varies along the first axis only, V_ along the second axis only
+            u = freq.U_[:,0]
+            v = freq.V_[0,:]
+            if halfPlane:
+                u = fft.ifftshift(u)
+                v = fft.ifftshift(v)[:freq.nOtf//2+1]
+            phasorX = np.exp(-np.pi*complex(0,1)*fact*u[:,np.newaxis,np.newaxis]*dx[np.newaxis])
+            phasorY = np.exp(-np.pi*complex(0,1)*fact*v[:,np.newaxis,np.newaxis]*dy[np.newaxis])
+            
+        # BUILDING THE OTF STACK
+        cdtype = np.complex64 if sf.dtype == np.float32 else complex
+        if halfPlane:
+            wHalf  = halfPlaneWeights(freq.nOtf)[np.newaxis,:,np.newaxis]
+        if metricsOnly:
+            FWHM = np.zeros((2,nSrc,nWvl))
+            # pixel scale of the PSF before binning
+            k_   = np.asarray(freq.k_) * np.ones(nWvl,dtype=int)
+        elif halfPlane:
+            otfTot = np.zeros((freq.nOtf,freq.nOtf//2+1,nSrc,nWvl),dtype=cdtype)
         else:
-            fftPhasor = np.ones((freq.nOtf,freq.nOtf,ao.src.nSrc,freq.nWvl),dtype=complex)
-
-        # LOOP ON WAVELENGTHS   
-        for jWvl in range(freq.nWvl):
+            otfTot = np.zeros((freq.nOtf,freq.nOtf,nSrc,nWvl),dtype=cdtype)
+        # the instrumental OTFs are local : freq and ao are not modified
+        otfNCPA, otfDL = freq.otfNCPA, freq.otfDL
+        for jWvl in range(nWvl):
             
             # UPDATE THE INSTRUMENTAL OTF
-            if (not ao.tel.opdMap_on is None and freq.nWvl>1) or len(xStat)>0:
-                freq.otfNCPA, freq.otfDL, freq.phaseMap = \
-                getStaticOTF(ao.tel,int(freq.nOtf),freq.samp[jWvl],freq.wvl[jWvl],
-                             xStat=xStat,theta_ext=theta_ext,spatialFilter=spatialFilter)
+            if (not ao.tel.opdMap_on is None and nWvl>1) or len(xStat)>0:
+                otfNCPA, otfDL, _ = getStaticOTF(ao.tel,int(freq.nOtf),freq.samp[jWvl],freq.wvl[jWvl],
+                                                 xStat=xStat,theta_ext=theta_ext,spatialFilter=spatialFilter)
                 
             # UPDATE THE RESIDUAL JITTER
-            if freq.nyquistSampling == True and freq.nWvl > 1 and (jitterX!=0 or jitterY!=0):
+            if freq.nyquistSampling == True and nWvl > 1 and (jitterX!=0 or jitterY!=0):
                 normFact2    = ff_jitter*(freq.samp[jWvl]*ao.tel.D/freq.wvl[jWvl]/(3600*180*1e3/np.pi))**2  * (2 * np.sqrt(2*np.log(2)))**2
                 Kjitter = np.exp(-0.5 * Djitter * normFact2/normFact)    
                           
             # OTF MULTIPLICATION
-            otfStat = freq.otfNCPA * Kjitter * otfPixel    
-            otfStat = np.repeat(otfStat[:,:,np.newaxis],ao.src.nSrc,axis=2)      
-            otfTurb = np.exp(-0.5*sf*(2*np.pi*1e-9/freq.wvl[jWvl])**2)
-            otfTot  = fft.fftshift(otfTurb * otfStat * fftPhasor[:,:,:,jWvl],axes=(0,1))
-                        
-            # GET THE FINAL PSF - PIXEL SCALE IS NYQUIST - FOV DIFFERENT PER WVL
-            psf_ = np.real(fft.fftshift(fft.ifftn(otfTot,axes=(0,1)),axes = (0,1)))
+            otfStat = otfNCPA * Kjitter * otfPixel    
+            if halfPlane:
+                otfStat = fullToHalfPlane(otfStat)
+            otf     = np.exp(-0.5*np.asarray(sf,dtype=float)*(2*np.pi*1e-9/freq.wvl[jWvl])**2) * otfStat[:,:,np.newaxis]
+            if metricsOnly:
+                # central cuts of the PSF : 1D inverse FFTs of the OTF summed over the other axis
+                if halfPlane:
+                    cutX = fft.ifft((otf*wHalf).sum(axis=1),axis=0)
+                    cutY = fft.irfft(otf.sum(axis=0),n=freq.nOtf,axis=0)
+                else:
+                    cutX = fft.ifft(fft.ifftshift(otf.sum(axis=1),axes=0),axis=0)
+                    cutY = fft.ifft(fft.ifftshift(otf.sum(axis=0),axes=0),axis=0)
+                for k,cut in enumerate([cutX,cutY]):
+                    FWHM[k,:,jWvl] = profileFWHM(fft.fftshift(np.real(cut),axes=0),freq.psInMas[jWvl]/k_[jWvl])
+                SR[:,jWvl] = 1e2*(np.abs(otf)*(wHalf if halfPlane else 1)).sum(axis=(0,1))/np.real(otfDL.sum())
+                continue
+            if isShifted:
+                otf = otf * (phasorX[:,np.newaxis,:,jWvl] * phasorY[np.newaxis,:,:,jWvl])
             
-            # managing the undersampling
-            psf = np.copy(psf_)
-            
-            if freq.k_[jWvl] >= 1: # binning the PSF
-                psf = np.zeros((ao.cam.fovInPix,ao.cam.fovInPix,ao.src.nSrc))
-                nC = freq.k_[jWvl]#psf_.shape[0]/ao.cam.fovInPix
-                for iSrc in range(ao.src.nSrc):
-                    if nC > 1:
-                        tmp = binning(psf_[:,:,iSrc],int(nC))
-                    else:
-                        tmp = psf_[:,:,iSrc]
-                        
-                    psf[:,:,iSrc] = cropSupport(tmp,tmp.shape[0]/ao.cam.fovInPix)
-                psf_ = psf
-             
-            # managing the field of view
+            # STREHL-RATIO COMPUTATION
+            if halfPlane:
+                otfTot[:,:,:,jWvl] = otf
+                SR[:,jWvl] = 1e2*(np.abs(otf)*wHalf).sum(axis=(0,1))/np.real(otfDL.sum())
+            else:
+                otfTot[:,:,:,jWvl] = fft.fftshift(otf,axes=(0,1))
+                SR[:,jWvl] = 1e2*np.abs(otf).sum(axis=(0,1))/np.real(otfDL.sum())
+        
+        if metricsOnly:
+            return FWHM, SR
+        
+        # GET THE FINAL PSF - PIXEL SCALE IS NYQUIST - FOV DIFFERENT PER WVL
+        if halfPlane:
+            psf_ = fft.fftshift(fft.irfftn(otfTot,s=(freq.nOtf,freq.nOtf),axes=(0,1),**fftOptions(otfTot)),axes = (0,1))
+        else:
+            psf_ = np.real(fft.fftshift(fft.ifftn(otfTot,axes=(0,1),**fftOptions(otfTot)),axes = (0,1)))
+        del otfTot
+        
+        # MANAGING THE UNDERSAMPLING AND THE FIELD OF VIEW
+        PSF = np.zeros((nPix,nPix,nSrc,nWvl))
+        k_  = np.asarray(freq.k_) * np.ones(nWvl,dtype=int)
+        for nC in np.unique(k_):
+            idWvl = np.where(k_ == nC)[0]
+            psf   = psf_[:,:,:,idWvl]
+            # binning the PSF
+            if nC > 1:
+                psf = binning(psf,int(nC))
+            psf = cropSupport(psf,psf.shape[0]/ao.cam.fovInPix)
+            # cropping the PSF
             if nPix < ao.cam.fovInPix:
-                psf = np.zeros((nPix,nPix,ao.src.nSrc))
-                nC  = psf_.shape[0]/nPix
-                for iSrc in range(ao.src.nSrc):
-                    psf[:,:,iSrc] = cropSupport(np.squeeze(psf_[:,:,iSrc]),nC)                   
-
+                psf = cropSupport(psf,psf.shape[0]/nPix)
             # SCALING
-            PSF[:,:,:,jWvl] = psf * F[:,jWvl]
-            
-            # STREHL-RATIO COMPUTATION
-            SR[:,jWvl] = 1e2*np.abs(otfTot).sum(axis=(0,1))/np.real(freq.otfDL.sum())
+            PSF[:,:,:,idWvl] = psf * F[:,idWvl]
         
         return PSF + bkg, SR
     
 #%%  IMAGE PROCESSING
         
 def binning(image, k):
-    """Bin an image by a factor `k`
+    """Bin an image by a factor `k` along its two first axes. Any trailing
+    axes (sources, wavelengths) are binned at once.
     
     Example
     -------
@@ -381,14 +559,14 @@ def binning(image, k):
     S = np.shape(image)
     S0 = int(S[0] / k)
     S1 = int(S[1] / k)
-    out = np.zeros((S0, S1))
+    out = np.zeros((S0, S1) + tuple(S[2:]))
     for i in range(k):
         for j in range(k):
             out += image[i:k*S0:k, j:k*S1:k]
     return out
 
 def cropSupport(im,n):    
-    nx,ny = im.shape
+    nx,ny = im.shape[:2]
     
     if np.isscalar(n) == 1:
         n = np.array([n,n])
@@ -396,11 +574,6 @@ def cropSupport(im,n):
     nx2     = int(nx/n[0])
     ny2     = int(ny/n[1])
     
-    if np.any(np.iscomplex(im)):
-        imNew = np.zeros((nx2,ny2)) + complex(0,1)*np.zeros((nx2,ny2))
-    else:
-        imNew = np.zeros((nx2,ny2))
-        
     if nx2%2 ==0:
         xi = int(0.5*(nx-nx2))
         xf = int(0.5*(nx + nx2))
@@ -1040,6 +1213,29 @@ def getFWHM(psf,pixelScale,rebin=1,method='contour',nargout=2,center=None,std_gu
     elif nargout == 4:
         return FWHMx,FWHMy,aRatio,theta
                           
+def profileFWHM(profile,pixelScale):
+    '''
+        FWHM of the maximum of 1D profiles given along the first axis, from the linear interpolation of
+        the half-maximum crossings on both sides. Returns NaN when the profile does not cross its
+        half-maximum.
+    '''
+    profile = nnp.asarray(cpuArray(profile))
+    FWHM    = nnp.zeros(profile.shape[1:])
+    for idx in nnp.ndindex(FWHM.shape):
+        p  = profile[(slice(None),) + idx]
+        i0 = p.argmax()
+        h  = p[i0]/2
+        # first samples below the half-maximum on the right and on the left of the maximum
+        r  = i0 + nnp.argmax(p[i0:] < h)
+        l  = i0 - nnp.argmax(p[i0::-1] < h)
+        if r == i0 or l == i0:
+            FWHM[idx] = nnp.nan
+            continue
+        xr = r - (h - p[r])/(p[r-1] - p[r])
+        xl = l + (h - p[l])/(p[l+1] - p[l])
+        FWHM[idx] = (xr - xl)*pixelScale
+    return FWHM
+
 def getStrehl(psf0,pupil,samp,recentering=False,nR=5,method='otf'):
     if recentering:    
         psf = centerPsf(psf0,2)
@@ -1113,7 +1309,61 @@ def toeplitz(matrix):
     
     return diags
     #print( [j.tolist() for j in diags] )
-            
+
+#%% Batched linear algebra
+def hermitianHalfPlane(nX):
+    '''
+        Splits a nX x nX frequency grid centered on nX//2 (see freq_array) into the points to compute
+        and the points obtained from their mirror at -k. Returns the flat indexes of the
+        points to compute, the flat indexes of the mirrored points and the flat indexes of their sources.
+        Points without a mirror on the grid (first row/column for even nX) are kept in the computed set.
+    '''
+    c      = nX//2
+    ix,iy  = nnp.mgrid[0:nX,0:nX]
+    jx,jy  = 2*c - ix, 2*c - iy
+    valid  = (jx < nX) & (jy < nX)
+    flat   = (ix*nX + iy).ravel()
+    mflat  = (jx*nX + jy).ravel()
+    valid  = valid.ravel()
+    mirror = valid & (flat > mflat)
+    return flat[~mirror], flat[mirror], mflat[mirror]
+
+def pinvHermitian(A,rcond=1e-15):
+    '''
+        Pseudo-inverse of a stack of Hermitian matrices through their eigen-decomposition.
+        Eigenvalues below rcond times the largest one (in absolute value) are discarded,
+        which reproduces np.linalg.pinv for Hermitian inputs.
+    '''
+    lam,V   = np.linalg.eigh(A)
+    lam_abs = abs(lam)
+    cutoff  = rcond*lam_abs.max(axis=-1,keepdims=True)
+    lam_inv = np.zeros_like(lam)
+    idx     = lam_abs > cutoff
+    lam_inv[idx] = 1/lam[idx]
+    return np.matmul(V*lam_inv[...,None,:],np.conj(V.swapaxes(-1,-2)))
+
+def solveHermitian(A,B):
+    '''
+        Solves A X = B for a stack of Hermitian positive definite matrices A by Cholesky factorization
+        and triangular substitutions.
+        Raises numpy.linalg.LinAlgError if one of the matrices is not positive definite.
+    '''
+    L = np.linalg.cholesky(A)
+    n = L.shape[-1]
+    # forward and back substitutions, with the stack along the last and contiguous axis
+    L = np.ascontiguousarray(np.moveaxis(L,(-2,-1),(0,1)))
+    X = np.array(np.moveaxis(B,(-2,-1),(0,1)),dtype=np.result_type(L,B),order='C')
+    for i in range(n):
+        if i > 0:
+            X[i] -= np.einsum('j...,jm...->m...',L[i,:i],X[:i])
+        X[i] /= L[i,i]
+    Lc = np.conj(L)
+    for i in range(n-1,-1,-1):
+        if i < n-1:
+            X[i] -= np.einsum('j...,jm...->m...',Lc[i+1:,i],X[i+1:])
+        X[i] /= L[i,i]
+    return np.moveaxis(X,(0,1),(-2,-1))
+
 #%% Analytical models and fitting facilities
 def gaussian(x,xdata):                     
     # ------- Grabbing parameters ---------%
@@ -1134,4 +1384,45 @@ def gaussian(x,xdata):
     Xr    = X*nnp.cos(th) + Y*nnp.sin(th)
     Yr    = Y*nnp.cos(th) - X*nnp.sin(th)
     # Gaussian expression
-    return I0*nnp.exp(-0.5*((Xr/ax)**2 + (Yr/ay)**2) )
\ No newline at end of file
+    return I0*nnp.exp(-0.5*((Xr/ax)**2 + (Yr/ay)**2) )
+
+def sineFilterBasis(freqs,D,nPoints=1001,nPhase=5):
+    '''
+        Phase-shifted 1D sine waves of spatial frequencies freqs sampled over the pupil diameter D,
+        of size nFreqs x nPhase x nPoints, and the pupil coordinates.
+    '''
+    x     = D*nnp.linspace(-0.5, 0.5, nPoints, endpoint=1)
+    phase = 2*nnp.pi*nnp.arange(nPhase)/nPhase
+    sin_ref = nnp.sin(2*nnp.pi*nnp.asarray(freqs)[:,None,None]*x + phase[:,None])
+    return sin_ref, x
+
+def coneFilterCoefficients(freqs,ratio,D,nPoints=1001,nPhase=5):
+    '''
+        Fraction of a sine wave of frequency f left after subtracting the same wave stretched by the
+        cone compression ratio (h_laser-h)/h_laser, in rms and averaged over nPhase phase shifts.
+        Returns a nFreqs x nRatio array, evaluated for all frequencies in one pass per ratio.
+    '''
+    sin_ref,x = sineFilterBasis(freqs,D,nPoints=nPoints,nPhase=nPhase)
+    std_ref   = sin_ref.std(axis=-1)
+    phase     = 2*nnp.pi*nnp.arange(nPhase)/nPhase
+    ratio     = nnp.atleast_1d(ratio)
+    coeff     = nnp.zeros((len(freqs),len(ratio)))
+    with nnp.errstate(divide='ignore',invalid='ignore'):
+        for j in range(len(ratio)):
+            sin_temp   = nnp.sin(2*nnp.pi*nnp.asarray(freqs)[:,None,None]*ratio[j]*x + phase[:,None])
+            sin_res    = sin_ref - (std_ref/sin_temp.std(axis=-1))[:,:,None]*sin_temp
+            coeff[:,j] = (sin_res.std(axis=-1)/std_ref).sum(axis=1)/nPhase
+    return coeff
+
+def tiltFilterCoefficients(freqs,D,nPoints=1001,nPhase=10):
+    '''
+        Fraction of a sine wave of frequency f left after removing its best linear fit over the pupil,
+        in rms and averaged over nPhase phase shifts. The linear fit of all waves is obtained at once
+        from the normal equations.
+    '''
+    sin_ref,x = sineFilterBasis(freqs,D,nPoints=nPoints,nPhase=nPhase)
+    xc        = x - x.mean()
+    slope     = (sin_ref*xc).sum(axis=-1)/(xc**2).sum()
+    sin_res   = sin_ref - sin_ref.mean(axis=-1,keepdims=True) - slope[:,:,None]*xc
+    with nnp.errstate(divide='ignore',invalid='ignore'):
+        return (sin_res.std(axis=-1)/sin_ref.std(axis=-1)).sum(axis=1)/nPhase
@@ -5,10 +5,33 @@ Created on Mon Apr  5 14:54:57 2021
 
 @author: omartin
 """
+import os
+import copy
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 import p3.aoSystem.FourierUtils as FourierUtils
 
+# default number of threads of the kernels computation, -1 for all the cores
+anisoWorkers = int(os.environ.get('P3_ANISO_WORKERS', 1))
 
+def run_tasks(task,args,nWorkers=None):
+    '''
+        Calls task(*a) for each tuple a of args, serially or in a pool of nWorkers threads (anisoWorkers by
+        default, all the cores for -1). The tasks write their results in distinct parts of shared output
+        arrays; the numpy functions they call release the GIL on large arrays.
+    '''
+    if nWorkers is None:
+        nWorkers = anisoWorkers
+    if nWorkers == -1:
+        nWorkers = os.cpu_count()
+    if nWorkers <= 1 or len(args) <= 1:
+        for a in args:
+            task(*a)
+    else:
+        with ThreadPoolExecutor(max_workers=nWorkers) as pool:
+            # result() re-raises the exceptions of the tasks
+            for future in [pool.submit(task,*a) for a in args]:
+                future.result()
 
 def focal_anisoplanatism_variance(tel,atm,lgs):
     '''
@@ -30,28 +53,29 @@ def focal_anisoplanatism_variance(tel,atm,lgs):
     wfe = np.sqrt(var * (tel.D/atm.r0)**(5/3)) * (atm.wvl*1e9/2/np.pi)
     return wfe
     
-def anisoplanatism_structure_function(tel,atm,src,lgs,ngs,nOtf,samp,nActu,Hfilter=1):
+def anisoplanatism_structure_function(tel,atm,src,lgs,ngs,nOtf,samp,nActu,Hfilter=1,nWorkers=None):
         
     if (lgs==None) or (lgs.height == 0):
         # NGS mode, angular anisoplanatism 
-        dani_ang = angular_focal_anisoplanatism_phase_structure_function(tel,atm,src,ngs,nOtf,samp,nActu,Hfilter=Hfilter)
+        dani_ang = angular_focal_anisoplanatism_phase_structure_function(tel,atm,src,ngs,nOtf,samp,nActu,Hfilter=Hfilter,nWorkers=nWorkers)
         return dani_ang
     else:
         # LGS mode, focal-angular anisoplanatism + anisokinetism
         # angular + focal anisoplanatism
-        H = lgs.height
-        dani_focang = angular_focal_anisoplanatism_phase_structure_function(tel,atm,src,lgs,nOtf,samp,nActu,Hfilter=Hfilter)
-        # angular anisoplanatism only
-        lgs.height = 0
-        dani_ang = angular_focal_anisoplanatism_phase_structure_function(tel,atm,src,lgs,nOtf,samp,nActu,Hfilter=Hfilter)
+        dani_focang = angular_focal_anisoplanatism_phase_structure_function(tel,atm,src,lgs,nOtf,samp,nActu,Hfilter=Hfilter,nWorkers=nWorkers)
+        # angular anisoplanatism only, from a copy of the LGS at infinity : lgs is not modified
+        gs_inf = copy.copy(lgs)
+        gs_inf.height = 0
+        dani_ang = angular_focal_anisoplanatism_phase_structure_function(tel,atm,src,gs_inf,nOtf,samp,nActu,Hfilter=Hfilter,nWorkers=nWorkers)
         #np.zeros((src.nSrc,atm.nL,nOtf,nOtf))#
-        lgs.height = H
         # anisokinetism
-        dani_tt = anisokinetism_phase_structure_function(tel,atm,src,ngs,nOtf,samp)
+        dani_tt = anisokinetism_phase_structure_function(tel,atm,src,ngs,nOtf,samp,nWorkers=nWorkers)
         return dani_focang, dani_ang, dani_tt
 
-def angular_focal_anisoplanatism_phase_structure_function(tel,atm,src,gs,nOtf,samp,nActu,Hfilter=1):
+def angular_focal_anisoplanatism_phase_structure_function(tel,atm,src,gs,nOtf,samp,nActu,Hfilter=1,nWorkers=None):
     """
+    The structure functions of the (source, layer) pairs are independent and are computed by run_tasks
+    with nWorkers threads.
     """
     
     #1\ Defining the spatial filters
@@ -64,13 +88,7 @@ def angular_focal_anisoplanatism_phase_structure_function(tel,atm,src,gs,nOtf,sa
     nSrc    = len(ax)
     
     #2\ SF Calculation
-    
-    nOtf_hr = nOtf
-    if gs.height:
-        # Must reduce nOtf to decrease the computationnal power and memory; causes Python crash otherwise
-        nOtf    = int(nActu * 2+1)#samp/2)
-        
-    Dani_l = np.zeros((nSrc,nLayer,nOtf_hr,nOtf_hr))
+    Dani_l = np.zeros((nSrc,nLayer,nOtf,nOtf))
 
     # Angular frequencies
     if np.mod(nOtf,2):
@@ -78,61 +96,78 @@ def angular_focal_anisoplanatism_phase_structure_function(tel,atm,src,gs,nOtf,sa
     else:
         x = np.linspace(-umax/2,umax/2,num=nOtf)
                 
-    if gs.height:
-        # the matrix is not Toeplitz -> to optimize
-        x1,y1   = np.meshgrid(x,x)
-        X1      = np.ones((nOtf**2,1))*x1.T.reshape(-1)
-        Y1      = np.tile(y1,[nOtf,nOtf])
-        # Samples separation in the pupil
-        rhoX    = np.transpose(X1.T - x1.T.reshape(-1))
-        rhoY    = Y1 - y1.T.reshape(-1)
-    else:
-        # NGS case - we assume the matrix is Toeplitz
-        rhoX, rhoY = np.meshgrid(x,x)
+    # the covariance map is Toeplitz in the separation rho
+    rhoX, rhoY = np.meshgrid(x,x)
         
     # Instantiation
     I0      = 3/5
     I1      = FourierUtils.Ialpha(f0*rhoX,f0*rhoY)
     cte     = 0.12184*0.06*(2*np.pi)**2*atm.L0**(5/3)
+    if gs.height and not np.isscalar(Hfilter):
+        raise ValueError('The focal-angular anisoplanatism is computed as a map and can not be filtered by a matrix')
+
+    # Covariance averaged over the pupil scaled by g, as a function of the separation, for each layer
+    if gs.height:
+        zGs   = float(np.atleast_1d(gs.height)[0])
+        tmax  = umax/np.sqrt(2) + np.max(np.abs(Hs))*np.max(np.hypot(ax,ay))
+        Ibar  = [None]*nLayer
+        def table(l):
+            Ibar[l] = pupil_averaged_covariance(tel,f0,Hs[l]/zGs*tel.D/2,tmax)
+        run_tasks(table,[(l,) for l in range(nLayer) if Hs[l] != 0],nWorkers=nWorkers)
 
     # Anisoplanatism Structure Function      
-    for iSrc in range(nSrc):
+    def kernel(iSrc,l):
         thx = ax[iSrc]
         thy = ay[iSrc]            
-        for l in range(nLayer):
-            zl    = Hs[l]
-            if zl !=0: 
-                if gs.height: # focal-angular case -> computing the covariance matrix
-                    g     = zl/gs.height
-                    I2    = FourierUtils.Ialpha(f0*(rhoX*(1-g)) , f0*(rhoY*(1-g)) )
-                    I3    = FourierUtils.Ialpha(f0*(rhoX -g*X1 + zl*thx) , f0*(rhoY - g*Y1 + zl*thy) )
-                    I4    = FourierUtils.Ialpha(f0*( g*X1 - zl*thx) , f0*(g*Y1 - zl*thy))
-                    I5    = FourierUtils.Ialpha(f0*(g*(rhoX-X1) -zl*thx) , f0*(g*(rhoY-Y1) - zl*thy) )
-                    I6    = FourierUtils.Ialpha(f0*((1-g)*rhoX + g*X1 - zl*thx) , f0*((1-g)*rhoY + g*Y1 - zl*thy))
-                    if np.isscalar(Hfilter):
-                        tmp   = (2*I0 - I1 - I2 + I3 - I4 - I5 + I6)
-                    else:
-                        tmp   = Hfilter*(2*I0 - I1 - I2 + I3 - I4 - I5 + I6)*Hfilter.T
-                    
-                    # need to compute the covariance map !!
-                    
-                    # interpolating
-                    if nOtf != nOtf_hr:
-                        Dani_l[iSrc,l] = FourierUtils.interpolateSupport(tmp,nOtf_hr)
-                    else:
-                        Dani_l[iSrc,l] = tmp
-                        
-                else: #angular case -> computing the covariance map
-                    if thx !=0 or thy !=0:
-                        I2    = FourierUtils.Ialpha( f0*(rhoX+zl*thx) , f0*(rhoY+zl*thy) )
-                        I3    = FourierUtils.Ialpha( f0*(zl*thx) , f0*(zl*thy) )
-                        I4    = FourierUtils.Ialpha( f0*(rhoX-zl*thx) , f0*(rhoY-zl*thy) )
-                        Dani_l[iSrc,l] = (2*I0 - 2*I1 + I2 - 2*I3  + I4)  
+        zl  = Hs[l]
+        if gs.height: # focal-angular case -> computing the pupil-averaged covariance map
+            g     = zl/zGs
+            t,cov = Ibar[l]
+            I2    = FourierUtils.Ialpha(f0*(rhoX*(1-g)) , f0*(rhoY*(1-g)) )
+            # terms depending on the position in the pupil, averaged over the pairs r -/+ rho/2
+            I3    = 0
+            for c in [1-g/2,-(1-g/2)]:
+                I3 = I3 + np.interp(np.hypot(c*rhoX - zl*thx,c*rhoY - zl*thy),t,cov)
+            I4    = 0
+            for c in [g/2,-g/2]:
+                I4 = I4 + np.interp(np.hypot(c*rhoX - zl*thx,c*rhoY - zl*thy),t,cov)
+            Dani_l[iSrc,l] = Hfilter*(2*I0 - I1 - I2 + I3 - I4)
+                
+        elif thx !=0 or thy !=0: #angular case -> computing the covariance map
+            I2    = FourierUtils.Ialpha( f0*(rhoX+zl*thx) , f0*(rhoY+zl*thy) )
+            I3    = FourierUtils.Ialpha( f0*(zl*thx) , f0*(zl*thy) )
+            I4    = FourierUtils.Ialpha( f0*(rhoX-zl*thx) , f0*(rhoY-zl*thy) )
+            Dani_l[iSrc,l] = (2*I0 - 2*I1 + I2 - 2*I3  + I4)  
+    
+    run_tasks(kernel,[(iSrc,l) for iSrc in range(nSrc) for l in range(nLayer) if Hs[l] != 0],nWorkers=nWorkers)
         
     return cte*Dani_l
 
-def anisokinetism_phase_structure_function(tel,atm,src,gs,nOtf,samp):
+def pupil_averaged_covariance(tel,f0,radius,tmax,nRadial=16,nAngle=32):
     """
+    Average of Ialpha(f0*|s + u|) over the points u of the pupil of given radius, with the central
+    obstruction of the telescope. The pupil and the covariance are isotropic, so that the average only
+    depends on |s|; it is tabulated on [0,tmax], finely up to 4 times the radius, and is returned with
+    the grid for linear interpolation. The pupil is integrated with a Gauss-Legendre quadrature along the
+    radius and a trapezoidal one along the angle.
+    """
+    t1    = min(4*radius,tmax/2)
+    t     = np.concatenate((np.linspace(0,t1,128,endpoint=False),np.geomspace(t1,tmax,2048)))
+    # quadrature of the pupil
+    x,w   = np.polynomial.legendre.leggauss(nRadial)
+    rmin  = tel.obsRatio*radius
+    r     = rmin + (radius - rmin)*(x + 1)/2
+    w     = w*r
+    phi   = 2*np.pi*(np.arange(nAngle) + 0.5)/nAngle
+    ux    = t[:,np.newaxis,np.newaxis] + r[:,np.newaxis]*np.cos(phi)
+    uy    = r[:,np.newaxis]*np.sin(phi)*np.ones_like(ux)
+    cov   = FourierUtils.Ialpha(f0*ux,f0*uy).sum(axis=2) @ w/(nAngle*w.sum())
+    return t, cov
+
+def anisokinetism_phase_structure_function(tel,atm,src,gs,nOtf,samp,nWorkers=None):
+    """
+    The covariances of all the sources and layers are computed at once, and the structure functions of
+    the (source, layer) pairs by run_tasks with nWorkers threads.
     """
     
     #1\ Defining the spatial filters
@@ -155,22 +190,17 @@ def anisokinetism_phase_structure_function(tel,atm,src,gs,nOtf,samp):
     # instantiating the phase structure function
     Dani_l = np.zeros((nSrc,nLayer,nOtf,nOtf))
     
+    # 2x2 anisokinetism covariance matrices of all the sources and layers, for a unit r0^(-5/3)
+    covAniso = zern.anisokinetism(tel,atm,src,gs,perLayer=True)
+    
     # computing the phase structure function for each layers and src
-    for iSrc in range(nSrc):
-        thx = ax[iSrc]
-        thy = ay[iSrc]
-        if thx !=0 or thy !=0:
-            for l in range(nLayer):
-                zl = Hs[l]
-                if zl !=0: 
-                    # update the atmosphere
-                    atm_l = atm.slab(l)
-                    fr0   = atm_l.r0**(-5/3)
-                    # get the 2x2 anisokinetism covariance matrix
-                    covAniso = zern.anisokinetism(tel,atm_l,src,gs)
-                    # defining the Gaussian kernel
-                    Dani_l[iSrc,l] = (covAniso[iSrc,0,0]*X2 +
-                                      covAniso[iSrc,1,1]*Y2 +
-                                      covAniso[iSrc,0,1]*XY +
-                                      covAniso[iSrc,1,0]*YX)/fr0
+    def kernel(iSrc,l):
+        # defining the Gaussian kernel
+        Dani_l[iSrc,l] = (covAniso[iSrc,l,0,0]*X2 +
+                          covAniso[iSrc,l,1,1]*Y2 +
+                          covAniso[iSrc,l,0,1]*XY +
+                          covAniso[iSrc,l,1,0]*YX)
+    
+    run_tasks(kernel,[(iSrc,l) for iSrc in range(nSrc) if ax[iSrc] !=0 or ay[iSrc] !=0
+                      for l in range(nLayer) if Hs[l] !=0],nWorkers=nWorkers)
     return Dani_l
@@ -23,6 +23,7 @@ from p3.aoSystem.detector import detector
 from p3.aoSystem.sensor import sensor
 from p3.aoSystem.rtc import rtc
 import p3.aoSystem.anisoplanatismModel as anisoplanatismModel
+import p3.aoSystem.diskCache as diskCache
 
 #%%
 class aoSystem():
@@ -60,9 +61,12 @@ class aoSystem():
         elif self.configType == 'yml':
             return self.my_yaml_dict[primary][secondary]
 
-    def __init__(self,path_config,path_root='',nLayer=None,getPSDatNGSpositions=False,coo_stars=None):
+    def __init__(self,path_config,path_root='',nLayer=None,getPSDatNGSpositions=False,coo_stars=None,cacheDir=None):
                             
         self.error = False
+        # on-disk cache of the telescope maps and numerical tables, disabled by default (see diskCache)
+        if cacheDir is not None:
+            diskCache.setCacheDir(cacheDir)
         # verify if the file exists
         if ospath.isfile(path_config) == False:
             raise ValueError('The parameter file (.ini or .yml) could not be found.')
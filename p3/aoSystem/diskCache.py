@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+On-disk and in-process caches of numerical tables that only depend on a few geometrical parameters.
+
+By default, only the in-process cache of cachedArrays and cachedRows is used. The on-disk cache is enabled by setting
+the P3_CACHE_DIR environment variable to a folder, or by setCacheDir (see the cacheDir argument of
+aoSystem and fourierModel); the tables are then stored there as .npy/.npz files.
+The folder is bounded to P3_CACHE_SIZE_MB megabytes (default : 4096) and the in-process cache to
+P3_CACHE_MEMORY_MB megabytes (default : 256); the least recently used tables are evicted first.
+"""
+
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+
+cacheDir = os.environ.get('P3_CACHE_DIR', '')
+diskCacheSize = float(os.environ.get('P3_CACHE_SIZE_MB', 4096))*2**20
+memoryCacheSize = float(os.environ.get('P3_CACHE_MEMORY_MB', 256))*2**20
+
+memoryCache = OrderedDict()
+memoryLock = threading.Lock()
+fileKeys = {}
+
+def setCacheDir(path):
+    """ Enables the on-disk cache in the folder path for the whole process, or disables it if path is
+    None or an empty string.
+    """
+    global cacheDir
+    cacheDir = path or ''
+
+def cacheKey(*args):
+    """ Hexadecimal key of a set of scalars, tuples and numpy arrays.
+    """
+    h = hashlib.sha1()
+    for a in args:
+        if isinstance(a, np.ndarray):
+            h.update(str(a.dtype).encode() + str(a.shape).encode())
+            h.update(np.ascontiguousarray(a).tobytes())
+        else:
+            h.update(repr(a).encode())
+        h.update(b'|')
+    return h.hexdigest()
+
+def fileKey(path):
+    """ Hexadecimal key of the content of a file, or an empty string if the file does not exist.
+    The keys are memorized as long as the size and the modification time of the file do not change.
+    """
+    if not path or not os.path.isfile(path):
+        return ''
+    stat = os.stat(path)
+    tag  = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    if tag not in fileKeys:
+        h = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(2**20), b''):
+                h.update(block)
+        fileKeys[tag] = h.hexdigest()
+    return fileKeys[tag]
+
+def cachePath(name, key, ext='.npy'):
+    return os.path.join(cacheDir, name + '_' + key + ext)
+
+def loadFromCache(name, key, mmap=False):
+    """ Returns the table stored under name and key, or None if it does not exist. With mmap, the
+    table is memory-mapped in read-only mode instead of being read.
+    """
+    if not cacheDir:
+        return None
+    path = cachePath(name, key)
+    if not os.path.isfile(path):
+        return None
+    try:
+        array = np.load(path, allow_pickle=False, mmap_mode='r' if mmap else None)
+        os.utime(path)
+        return array
+    except (OSError, ValueError):
+        return None
+
+def saveToCache(name, key, array):
+    """ Stores a table under name and key. Failures to write (read-only file system, ...) are ignored.
+    """
+    if not cacheDir:
+        return
+    path = cachePath(name, key)
+    try:
+        os.makedirs(cacheDir, exist_ok=True)
+        # write then rename, so that concurrent processes never read a partial file
+        tmp = path + '.' + str(os.getpid()) + '.tmp'
+        with open(tmp, 'wb') as f:
+            np.save(f, np.asarray(array), allow_pickle=False)
+        os.replace(tmp, path)
+        evictDiskCache()
+    except OSError:
+        pass
+
+def evictDiskCache():
+    """ Removes the least recently used tables until the cache folder fits in diskCacheSize.
+    """
+    files = []
+    for f in os.listdir(cacheDir):
+        path = os.path.join(cacheDir, f)
+        if f.endswith('.npy') or f.endswith('.npz'):
+            stat = os.stat(path)
+            files.append((stat.st_mtime, stat.st_size, path))
+    total = sum(f[1] for f in files)
+    for mtime, size, path in sorted(files):
+        if total <= diskCacheSize:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        total -= size
+
+#%% IN-PROCESS CACHE
+def memorySize(value):
+    if isinstance(value, dict):
+        return sum(memorySize(v) for v in value.values())
+    return value.nbytes if isinstance(value, np.ndarray) else 0
+
+def loadFromMemory(mkey):
+    """ Returns the value stored in the in-process cache under mkey, or None if it does not exist.
+    """
+    with memoryLock:
+        if mkey in memoryCache:
+            memoryCache.move_to_end(mkey)
+            return memoryCache[mkey]
+    return None
+
+def saveToMemory(mkey, value):
+    """ Stores an array or a dictionary of arrays in the in-process cache, with eviction of the least
+    recently used entries.
+    """
+    if memorySize(value) > memoryCacheSize:
+        return
+    with memoryLock:
+        memoryCache[mkey] = value
+        total = sum(memorySize(v) for v in memoryCache.values())
+        while total > memoryCacheSize:
+            total -= memorySize(memoryCache.popitem(last=False)[1])
+
+#%% DICTIONARIES OF ARRAYS
+def copyArrays(arrays):
+    return {k: (v.copy() if isinstance(v, np.ndarray) else v) for k, v in arrays.items()}
+
+def loadArraysFromCache(name, key):
+    """ Returns the dictionary of arrays stored under name and key, or None if it does not exist.
+    """
+    if not cacheDir:
+        return None
+    path = cachePath(name, key, ext='.npz')
+    if not os.path.isfile(path):
+        return None
+    try:
+        with np.load(path, allow_pickle=False) as data:
+            arrays = {k: (data[k] if data[k].ndim else data[k][()]) for k in data.files if k != '_none'}
+            arrays.update({k: None for k in data['_none']})
+        os.utime(path)
+        return arrays
+    except (OSError, ValueError, KeyError):
+        return None
+
+def saveArraysToCache(name, key, arrays):
+    """ Stores a dictionary of arrays, scalars or None values under name and key.
+    """
+    if not cacheDir:
+        return
+    path = cachePath(name, key, ext='.npz')
+    try:
+        os.makedirs(cacheDir, exist_ok=True)
+        tmp = path + '.' + str(os.getpid()) + '.tmp'
+        with open(tmp, 'wb') as f:
+            np.savez(f, _none=np.array([k for k, v in arrays.items() if v is None], dtype=str),
+                     **{k: np.asarray(v) for k, v in arrays.items() if v is not None})
+        os.replace(tmp, path)
+        evictDiskCache()
+    except OSError:
+        pass
+
+def cachedArrays(name, key, compute):
+    """ Dictionary of arrays returned by compute(), looked up first in the in-process cache and then
+    in the on-disk cache under name and key. Copies are returned so that callers may modify them.
+    """
+    mkey = (name, key)
+    arrays = loadFromMemory(mkey)
+    if arrays is not None:
+        return copyArrays(arrays)
+
+    arrays = loadArraysFromCache(name, key)
+    if arrays is None:
+        arrays = compute()
+        saveArraysToCache(name, key, arrays)
+    if memorySize(arrays) <= memoryCacheSize:
+        saveToMemory(mkey, copyArrays(arrays))
+    return arrays
+
+#%% LIBRARIES OF ROWS
+def cachedRows(name, keys, compute):
+    """ Dictionary of the lists of the rows (first axis) of arrays whose rows are cached one by one. keys is
+    a dictionary giving, for each array, the list of the keys of its rows, which are stored under name + '_'
+    + the name of the array. The rows are looked up first in the in-process cache, where they are read-only,
+    and then in the on-disk cache, from which they are returned memory-mapped so that they are only read
+    when indexed; the rows missing from any of the arrays are computed at once by compute(indices), which
+    returns the dictionary of the arrays restricted to these rows.
+    """
+    def loadRow(rowName, key):
+        row = loadFromMemory((rowName, key))
+        return row if row is not None else loadFromCache(rowName, key, mmap=True)
+
+    rows = {k: [loadRow(name + '_' + k, key) for key in keys[k]] for k in keys}
+    missing = [i for i in range(len(next(iter(keys.values())))) if any(rows[k][i] is None for k in keys)]
+    if missing:
+        arrays = compute(np.array(missing))
+        for k in keys:
+            for j, i in enumerate(missing):
+                row = arrays[k][j]
+                row.setflags(write=False)
+                rows[k][i] = row
+                saveToCache(name + '_' + k, keys[k][i], row)
+                saveToMemory((name + '_' + k, keys[k][i]), row)
+    return rows
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+FFT backend shared by the Fourier model, FourierUtils, psfao21 and psfR.
+
+The modules call the numpy.fft-like interface of the fft object defined here, whose engine can be
+switched at runtime with setBackend :
+    - 'scipy' (default) : scipy.fft with a configurable number of workers (threads)
+    - 'numpy' : numpy.fft, single-threaded
+    - 'pyfftw' : pyFFTW through its scipy.fft interface, with the FFTW plans kept in memory and the
+      FFTW wisdom stored in the P3 cache folder when the on-disk cache is enabled (see diskCache)
+The default backend and number of workers are read from the P3_FFT_BACKEND and P3_FFT_WORKERS
+environment variables; P3_FFT_WORKERS=-1 uses all the CPU cores.
+As with numpy.fft, the transforms are computed in double precision; single-precision inputs are kept 
+in single precision only if the transform is called with single=True.
+"""
+
+import os
+import atexit
+import numpy as np
+import p3.aoSystem.diskCache as diskCache
+
+# transforms that accept a number of workers; the other functions (shifts, frequencies) are passed through
+transforms = ['fft','ifft','fft2','ifft2','fftn','ifftn','rfft','irfft','rfft2','irfft2','rfftn','irfftn']
+
+class fftBackend:
+    """ numpy.fft-like interface dispatching to the selected FFT engine.
+    """
+
+    def __init__(self,name='scipy',workers=-1,plannerEffort='FFTW_MEASURE'):
+        self.setBackend(name=name,workers=workers,plannerEffort=plannerEffort)
+
+    def setBackend(self,name='scipy',workers=-1,plannerEffort='FFTW_MEASURE'):
+        """ Selects the FFT engine among 'scipy', 'numpy' and 'pyfftw'. workers is the number of threads
+        of the scipy and pyfftw engines (-1 for all the cores), plannerEffort the FFTW planning flag.
+        """
+        name = name.lower()
+        if name == 'numpy':
+            import numpy.fft as module
+            self.options = {}
+        elif name == 'scipy':
+            import scipy.fft as module
+            self.options = {'workers':workers}
+        elif name == 'pyfftw':
+            try:
+                import pyfftw
+                import pyfftw.interfaces.scipy_fft as module
+            except ImportError:
+                raise ImportError('The pyfftw backend requires the pyFFTW package')
+            # plans are kept alive between calls of the same size, and the wisdom is reused across sessions
+            pyfftw.interfaces.cache.enable()
+            pyfftw.interfaces.cache.set_keepalive_time(60)
+            loadWisdom()
+            atexit.unregister(saveWisdom)
+            atexit.register(saveWisdom)
+            self.options = {'workers':os.cpu_count() if workers == -1 else workers,'planner_effort':plannerEffort}
+        else:
+            raise ValueError('Unknown FFT backend ' + name + ' : must be scipy, numpy or pyfftw')
+
+        self.name    = name
+        self.workers = workers if name != 'numpy' else 1
+        self.module  = module
+
+    def __getattr__(self,attr):
+        if attr in ['module','options']:
+            raise AttributeError(attr)
+        func = getattr(self.module,attr)
+        if attr in transforms:
+            options = self.options
+            def transform(x,*args,single=False,**kwargs):
+                x = np.asarray(x)
+                # numpy.fft always computes in double precision, scipy.fft and pyfftw keep single-precision
+                # inputs in single precision unless they are upcast
+                if not single and x.dtype in [np.float16,np.float32,np.complex64]:
+                    x = x.astype(np.complex128 if x.dtype == np.complex64 else np.float64)
+                return func(x,*args,**options,**kwargs)
+            return transform
+        return func
+
+    def __repr__(self):
+        return 'FFT backend : %s, %s workers'%(self.name,str(self.workers))
+
+#%% FFTW WISDOM
+def loadWisdom():
+    """ Imports the FFTW wisdom stored in the P3 cache folder, if any.
+    """
+    import pyfftw
+    wisdom = diskCache.loadArraysFromCache('fftwWisdom','0')
+    if wisdom is not None:
+        pyfftw.import_wisdom(tuple(wisdom[k].tobytes() for k in sorted(wisdom)))
+
+def saveWisdom():
+    """ Stores the FFTW wisdom accumulated by the session in the P3 cache folder.
+    """
+    import pyfftw
+    wisdom = pyfftw.export_wisdom()
+    diskCache.saveArraysToCache('fftwWisdom','0',{str(k):np.frombuffer(w,dtype=np.uint8) for k,w in enumerate(wisdom)})
+
+#%% SHARED BACKEND
+fft = fftBackend(name=os.environ.get('P3_FFT_BACKEND','scipy'),workers=int(os.environ.get('P3_FFT_WORKERS',-1)))
+
+def setBackend(name='scipy',workers=-1,plannerEffort='FFTW_MEASURE'):
+    """ Switches the FFT engine used by all the P3 modules (see fftBackend.setBackend).
+    """
+    fft.setBackend(name=name,workers=workers,plannerEffort=plannerEffort)
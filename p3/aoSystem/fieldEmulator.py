@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Emulator of the PSFs of the Fourier model over the field of view, for dense science grids.
+
+The exact structure functions are computed at a sparse set of anchor directions. The structure function
+at any other position of the field is interpolated linearly, with the barycentric weights of the Delaunay
+triangulation of the anchors. These weights are positive, so the interpolated function is still a
+structure function. The interpolation error is estimated from the leave-one-out errors of the anchors.
+The positions where this estimate exceeds a tolerance, and the positions outside the convex hull of the
+anchors, are computed exactly by the Fourier model.
+"""
+
+import numpy as nnp
+from . import gpuEnabled
+
+if not gpuEnabled:
+    np = nnp
+else:
+    import cupy as cp
+    np = cp
+
+import time
+from scipy.spatial import Delaunay
+
+import p3.aoSystem.FourierUtils as FourierUtils
+from p3.aoSystem.fourierModel import fourierModel
+
+#%%
+deg2rad = nnp.pi/180
+
+class fieldEmulator:
+    """ PSFs at arbitrary positions of the field, interpolated in the structure function space between
+    anchor directions.
+    """
+
+    # CONSTRUCTOR
+    def __init__(self,path_ini,anchorZenith=None,anchorAzimuth=None,tolerance=1e-2,path_root='',
+                 nSrcPerBlock=None,memoryBudgetMB=1024,**kwargs):
+        """ The anchors are the science sources of the .ini file unless anchorZenith (arcsec) or anchorAzimuth
+        (degrees) are given. They must include at least three non-aligned directions, otherwise a ValueError
+        is raised : the science sources of the .ini file are often aligned and can not always be used.
+        tolerance is the maximal estimated error of an interpolated PSF. The error is measured as the
+        maximal absolute difference between the atmospheric OTFs exp(-0.5*SF) at the shortest wavelength.
+        The OTFs are normalized to 1 at the origin.
+        The other keyword arguments are passed to the fourierModel, which is instantiated in streaming mode.
+        """
+        tstart = time.time()
+
+        # PARSING INPUTS
+        self.tolerance      = tolerance
+        self.memoryBudgetMB = memoryBudgetMB
+        self.nSrcPerBlock   = nSrcPerBlock
+        self.tag            = 'FIELD EMULATOR'
+
+        # INSTANTIATING THE FOURIER MODEL
+        self.model = fourierModel(path_ini,path_root=path_root,calcPSF=False,display=False,streaming=True,**kwargs)
+        if self.model.ao.error:
+            raise ValueError('The AO system could not be instantiated from ' + path_ini)
+        if self.model.normalizePSD:
+            raise ValueError('The PSD normalization needs the PSD of all the sources and can not be emulated')
+        if anchorZenith is not None or anchorAzimuth is not None:
+            params = {'srcZenith':anchorZenith,'srcAzimuth':anchorAzimuth}
+            self.model.update(**{k:nnp.atleast_1d(v) for k,v in params.items() if v is not None})
+        # the OTF error is the largest at the shortest wavelength
+        self.otfFactor = (2*nnp.pi*1e-9/nnp.min(self.model.freq.wvl))**2
+
+        # EXACT STRUCTURE FUNCTIONS AT THE ANCHORS
+        src = self.model.ao.src
+        self.anchorZenith  = nnp.array(src.zenith,dtype=float)*nnp.ones(src.nSrc)
+        self.anchorAzimuth = nnp.array(src.azimuth,dtype=float)*nnp.ones(src.nSrc)
+        self.anchors       = self.fieldPositions(self.anchorZenith,self.anchorAzimuth)
+        if len(self.anchors) < 3 or nnp.linalg.matrix_rank(self.anchors - self.anchors.mean(axis=0)) < 2:
+            raise ValueError('The anchors must include at least three non-aligned directions : '
+                             'pass 2-D anchors with anchorZenith and anchorAzimuth')
+        self.triangulation = Delaunay(self.anchors)
+        self.anchorSF      = self.exactStructureFunction()
+        self.t_anchors     = 1000*(time.time() - tstart)
+
+        # LEAVE-ONE-OUT ERRORS
+        self.anchorErrors  = self.leaveOneOutErrors()
+        self.t_init        = 1000*(time.time() - tstart)
+
+    def __repr__(self):
+        s = '\t\t\t\t________________________ FIELD EMULATOR ________________________\n\n'
+        s += '%d anchors, tolerance %.2e, maximal leave-one-out error %.2e\n'%(len(self.anchors),self.tolerance,
+                                                                               nnp.max(self.anchorErrors))
+        return s
+
+#%% INTERPOLATION
+    def fieldPositions(self,zenith,azimuth):
+        """ nPos x 2 cartesian positions in arcsec of directions given in arcsec and degrees.
+        """
+        zenith  = nnp.atleast_1d(nnp.asarray(zenith,dtype=float))
+        azimuth = nnp.atleast_1d(nnp.asarray(azimuth,dtype=float))*nnp.ones_like(zenith)
+        return nnp.array([zenith*nnp.cos(azimuth*deg2rad),zenith*nnp.sin(azimuth*deg2rad)]).T
+
+    def barycentricWeights(self,triangulation,points):
+        """ Vertices and barycentric weights (nPos x 3) of the points in the triangulation, and whether the
+        points are inside it. Outside points are linearly extrapolated from the simplex with the largest
+        minimal weight.
+        """
+        T = triangulation.transform
+        b = nnp.einsum('sij,psj->psi',T[:,:2],points[:,nnp.newaxis,:] - T[nnp.newaxis,:,2])
+        w = nnp.concatenate((b,1 - b.sum(axis=2,keepdims=True)),axis=2)
+        s = w.min(axis=2).argmax(axis=1)
+        w = w[nnp.arange(len(points)),s]
+        return triangulation.simplices[s], w, w.min(axis=1) >= -1e-10
+
+    def interpolate(self,vertices,weights,sf=None):
+        """ Structure functions interpolated from the anchors ones (or sf) with the barycentric weights.
+        """
+        if sf is None:
+            sf = self.anchorSF
+        out = np.zeros(sf.shape[:2] + (len(weights),),dtype=sf.dtype)
+        for k in range(3):
+            out += sf[:,:,vertices[:,k]] * np.asarray(weights[:,k],dtype=sf.dtype)
+        return out
+
+    def otfError(self,sf,sfRef):
+        """ Maximal absolute difference between the atmospheric OTFs of two sets of structure functions.
+        """
+        err = np.abs(np.exp(-0.5*self.otfFactor*sf) - np.exp(-0.5*self.otfFactor*sfRef)).max(axis=(0,1))
+        return nnp.asarray(FourierUtils.cpuArray(err),dtype=float)
+
+    def leaveOneOutErrors(self):
+        """ OTF error of each anchor interpolated from the other ones. The errors are infinite if fewer
+        than three non-aligned anchors remain.
+        """
+        nA  = len(self.anchors)
+        err = nnp.full(nA,nnp.inf)
+        for i in range(nA):
+            others = nnp.delete(nnp.arange(nA),i)
+            try:
+                tri = Delaunay(self.anchors[others])
+            except Exception:
+                continue
+            vertices, weights, _ = self.barycentricWeights(tri,self.anchors[i:i+1])
+            sf     = self.interpolate(others[vertices],weights)
+            err[i] = self.otfError(sf,self.anchorSF[:,:,i:i+1])[0]
+        return err
+
+    def errorEstimate(self,vertices,weights):
+        """ Estimated OTF error of the linear interpolation with the given barycentric weights, from the
+        leave-one-out errors e_i of the simplex vertices : 2*sum(e_i*w_i*(1-w_i)), which vanishes at the
+        anchors. For a quadratic variation across the field, the factor would be 1/2. The larger factor
+        accounts for the anisoplanatism terms, which oscillate with the field position at high spatial
+        frequencies. On MavisMCAO, the true error exceeds this estimate for fewer than 10% of the
+        positions, and then by less than a factor 2.
+        """
+        e = self.anchorErrors[vertices]
+        return nnp.nan_to_num(2*e*weights*(1 - weights),nan=0.0,posinf=nnp.inf).sum(axis=1)
+
+#%% STRUCTURE FUNCTIONS AND PSFS
+    def exactStructureFunction(self):
+        """ Structure functions in nm^2 of the science sources of the model, computed by blocks. In
+        half-plane mode they are in the half-plane representation.
+        """
+        m    = self.model
+        nSrc = m.ao.src.nSrc
+        nSrcPerBlock = self.nSrcPerBlock or m.sourcesPerBlock(memoryBudgetMB=self.memoryBudgetMB)
+        sf   = None
+        for k in range(0,nSrc,nSrcPerBlock):
+            src = nnp.arange(k,min(k+nSrcPerBlock,nSrc))
+            psd = m.powerSpectrumDensity(src=src)
+            if psd.shape[2] != len(src):
+                psd = np.repeat(psd,len(src),axis=2)
+            if m.halfPlane:
+                psd = FourierUtils.fullToHalfPlane(psd)
+            sfBlock = m.phaseStructureFunction(halfPlane=m.halfPlane,psd=psd)
+            del psd
+            if sf is None:
+                sf = np.zeros(sfBlock.shape[:2] + (nSrc,),dtype=sfBlock.dtype)
+            sf[:,:,src] = sfBlock
+        return sf
+
+    def structureFunction(self,zenith,azimuth):
+        """ Structure functions in nm^2 at the positions given in arcsec and degrees. Also returns the
+        estimated OTF error of each position and a boolean array of the positions computed exactly.
+        The exact ones are those whose estimated error exceeds the tolerance and those outside the
+        anchors hull. Their error is set to 0.
+        """
+        tstart = time.time()
+        zenith  = nnp.atleast_1d(nnp.asarray(zenith,dtype=float))
+        azimuth = nnp.atleast_1d(nnp.asarray(azimuth,dtype=float))*nnp.ones_like(zenith)
+        vertices, weights, inside = self.barycentricWeights(self.triangulation,self.fieldPositions(zenith,azimuth))
+        error   = nnp.where(inside,self.errorEstimate(vertices,weights),nnp.inf)
+        exact   = error > self.tolerance
+
+        sf = self.interpolate(vertices,weights)
+        if nnp.any(exact):
+            # the science sources of the model are moved to the positions to compute exactly
+            self.model.update(srcZenith=zenith[exact],srcAzimuth=azimuth[exact])
+            sf[:,:,nnp.where(exact)[0]] = self.exactStructureFunction()
+            error[exact] = 0
+        self.t_structureFunction = 1000*(time.time() - tstart)
+        return sf, error, exact
+
+    def pointSpreadFunction(self,zenith,azimuth,nPix=None):
+        """ PSFs (nPix x nPix x nPos x nWvl) and Strehl-ratios in percents (nPos x nWvl) at the positions given
+        in arcsec and degrees. The positions are processed in blocks. The method also returns the
+        estimated OTF error and the exactly computed positions, as structureFunction does.
+        """
+        tstart = time.time()
+        m       = self.model
+        zenith  = nnp.atleast_1d(nnp.asarray(zenith,dtype=float))
+        azimuth = nnp.atleast_1d(nnp.asarray(azimuth,dtype=float))*nnp.ones_like(zenith)
+        nPos    = len(zenith)
+        if nPix == None:
+            nPix = int(m.freq.nOtf/m.freq.kRef_)
+        nSrcPerBlock = self.nSrcPerBlock or m.sourcesPerBlock(memoryBudgetMB=self.memoryBudgetMB,nPix=nPix,nSrc=nPos)
+
+        PSF   = np.zeros((nPix,nPix,nPos,m.freq.nWvl))
+        SR    = np.zeros((nPos,m.freq.nWvl))
+        error = nnp.zeros(nPos)
+        exact = nnp.zeros(nPos,dtype=bool)
+        otfPixel = 1
+        if m.addOtfPixel:
+            otfPixel = np.sinc(m.freq.U_)* np.sinc(m.freq.V_)
+        for k in range(0,nPos,nSrcPerBlock):
+            pos = nnp.arange(k,min(k+nSrcPerBlock,nPos))
+            sf, error[pos], exact[pos] = self.structureFunction(zenith[pos],azimuth[pos])
+            # photometry and astrometry of the camera
+            F  = np.array(m.ao.cam.transmittance)[np.newaxis,:] * np.ones((len(pos),m.freq.nWvl))
+            dx = np.array(m.ao.cam.dispersion[0])[np.newaxis,:] * np.ones((len(pos),m.freq.nWvl))
+            dy = np.array(m.ao.cam.dispersion[1])[np.newaxis,:] * np.ones((len(pos),m.freq.nWvl))
+            PSF[:,:,pos], SR[pos] = FourierUtils.SF2PSF(sf,m.freq,m.ao,jitterX=m.ao.cam.spotFWHM[0][0],
+                                                        jitterY=m.ao.cam.spotFWHM[0][1],jitterXY=m.ao.cam.spotFWHM[0][2],
+                                                        F=F,dx=dx,dy=dy,nPix=nPix,otfPixel=otfPixel,
+                                                        halfPlane=sf.shape[1] != m.freq.nOtf,nSrc=len(pos))
+        self.t_getPSF = 1000*(time.time() - tstart)
+        return PSF, SR, error, exact
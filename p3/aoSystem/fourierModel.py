@@ -19,7 +19,7 @@ from . import gpuEnabled
 
 if not gpuEnabled:
     np = nnp
-    import numpy.fft as fft
+    from p3.aoSystem.fftBackend import fft
     import scipy.special as spc
 else:
     import cupy as cp
@@ -31,12 +31,16 @@ import matplotlib as mpl
 import matplotlib.pyplot as plt
 
 import time
+from concurrent.futures import ThreadPoolExecutor
 from distutils.spawn import find_executable
 
 import p3.aoSystem.FourierUtils as FourierUtils
+import p3.aoSystem.diskCache as diskCache
+import p3.aoSystem.metricsUtils as metricsUtils
 from p3.aoSystem.aoSystem import aoSystem
 from p3.aoSystem.atmosphere import atmosphere
 from p3.aoSystem.frequencyDomain import frequencyDomain
+from p3.aoSystem.source import source
 
 #%% DISPLAY FEATURES
 mpl.rcParams['font.size'] = 16
@@ -68,12 +72,24 @@ class fourierModel:
     """ Fourier class gathering the PSD calculation for PSF reconstruction. 
     """
     
+    # DEPENDENCY GRAPH OF THE MODEL STAGES : stage -> stages computed from it
+    stages = ['config','freq','reconstructor','controller','psd','sf','psf']
+    stageDependencies = {'config':['freq'],
+                         'freq':['reconstructor','controller','psd'],
+                         'reconstructor':['psd'],
+                         'controller':['psd'],
+                         'psd':['sf'],
+                         'sf':['psf'],
+                         'psf':[]}
+    
     # CONTRUCTOR
     def __init__(self, path_ini, calcPSF=True, verbose=False, display=True, path_root='',
                  normalizePSD=False, displayContour=False, getPSDatNGSpositions=False,
                  getErrorBreakDown=False, getFWHM=False, getEnsquaredEnergy=False,
                  getEncircledEnergy=False, fftphasor=False, MV=0, nyquistSampling=False,
-                 addOtfPixel=False, computeFocalAnisoCov=True, TiltFilter=False):
+                 addOtfPixel=False, computeFocalAnisoCov=True, TiltFilter=False, solver='pinv',
+                 halfPlane=False, precision='double', streaming=False, nRowsPerTile=None, metricsOnly=False,
+                 cacheDir=None):
         
         tstart = time.time()
         
@@ -83,19 +99,132 @@ class fourierModel:
         self.display = display
         self.getErrorBreakDown = getErrorBreakDown
         self.getPSFmetrics = getFWHM or getEnsquaredEnergy or getEncircledEnergy
-        self.calcPSF = calcPSF
+        # in metrics-only mode, the PSFs are not computed : the Strehl-ratios, FWHM and wavefront errors
+        # per science source are gathered in the self.metrics table, see metricsTable
+        self.metricsOnly = metricsOnly
+        self.calcPSF = calcPSF and not (metricsOnly or streaming)
         self.tag = 'TIPTOP'
         self.addOtfPixel = addOtfPixel
+        self.normalizePSD = normalizePSD
+        self.solver = solver
+        self.halfPlane = halfPlane
+        if precision not in ['double','single']:
+            raise ValueError('The precision must be double or single')
+        self.precision = precision
+        # the PSD, the structure function and the OTFs are stored in this type, see precisionReport
+        self.dtype = np.float32 if precision == 'single' else np.float64
+        # in streaming mode, the PSD, the structure function and the PSF are only computed by blocks of
+        # sources with streamPointSpreadFunction, which also returns the error breakdown of each block
+        self.streaming = streaming
+        # in the tomographic case, the reconstructors are computed by blocks of nRowsPerTile rows of the
+        # AO frequency domain to bound the memory, see tiledTomography
+        self.nRowsPerTile = nRowsPerTile
+        self.PSD = None
+        self.SF  = None
         
         # GRAB PARAMETERS
-        self.ao = aoSystem(path_ini,path_root=path_root,getPSDatNGSpositions=getPSDatNGSpositions)
+        self.ao = aoSystem(path_ini,path_root=path_root,getPSDatNGSpositions=getPSDatNGSpositions,cacheDir=cacheDir)
         self.t_initAO = 1000*(time.time() - tstart)
         
         if self.ao.error==False:
             
+            # OPTIONS OF THE MODEL STAGES, KEPT FOR UPDATES
+            self.wvlAtm = self.ao.atm.wvl
+            self.noiseFromModel = self.ao.wfs.processing.noiseVar == [None]
+            self.nyquistSampling = nyquistSampling
+            self.computeFocalAnisoCov = computeFocalAnisoCov
+            self.MV = MV
+            self.fftphasor = fftphasor
+            self.displayContour = displayContour
+            self.metricsFlags = {'getFWHM':getFWHM,'getEnsquaredEnergy':getEnsquaredEnergy,
+                                 'getEncircledEnergy':getEncircledEnergy}
+            #set tilt filter key before computing the PSD
+            self.applyTiltFilter = TiltFilter
+            
             # DEFINING THE FREQUENCY DOMAIN
-            self.freq = frequencyDomain(self.ao,nyquistSampling=nyquistSampling,computeFocalAnisoCov=computeFocalAnisoCov)
+            self.computeStage('freq')
+            self.t_initFreq = 1000*(time.time() - tstart)
+            
+            # DEFINING THE RECONSTRUCTOR, THE CONTROLLER, THE PSD, THE STRUCTURE FUNCTION AND THE PSF
+            for stage in self.stages[2:]:
+                self.computeStage(stage)
+                    
+        # DEFINING BOUNDS
+        self.bounds = self.defineBounds()
+                
+        self.t_init = 1000*(time.time()  - tstart)
+        
+        # DISPLAYING EXECUTION TIMES
+        if verbose:
+            self.displayExecutionTime()
+          
+        
+            
+    @property
+    def PSD(self):
+        if self.__PSD is None and self.PSD_half is not None:
+            self.__PSD = FourierUtils.halfToFullPlane(self.PSD_half,self.freq.nOtf)
+        return self.__PSD
+    @PSD.setter
+    def PSD(self,val):
+        # a new full-plane PSD supersedes the half-plane one
+        self.__PSD    = val
+        self.PSD_half = None
+        
+    @property
+    def SF(self):
+        if self.__SF is None and self.SF_half is not None:
+            self.__SF = FourierUtils.halfToFullPlane(self.SF_half,self.freq.nOtf)
+        return self.__SF
+    @SF.setter
+    def SF(self,val):
+        self.__SF    = val
+        self.SF_half = None
+        
+    def __repr__(self):
+        s = '\t\t\t\t________________________ FOURIER MODEL ________________________\n\n'
+        s += self.ao.__repr__() + '\n'
+        s += self.freq.__repr__() + '\n'
+        s +=  '\n'
+        return s
 
+#%% BOUNDS FOR PSF-FITTING
+    def defineBounds(self):
+          
+        # Photometry
+        bounds_down = [-np.inf,-np.inf,-np.inf]
+        bounds_up = [np.inf,np.inf,np.inf]
+        # Photometry
+        bounds_down += np.zeros(self.ao.src.nSrc).tolist()
+        bounds_up += (np.inf*np.ones(self.ao.src.nSrc)).tolist()
+        # Astrometry
+        bounds_down += (-self.freq.nPix//2 * np.ones(2*self.ao.src.nSrc)).tolist()
+        bounds_up += ( self.freq.nPix//2 * np.ones(2*self.ao.src.nSrc)).tolist()
+        # Background
+        bounds_down += [-np.inf]
+        bounds_up += [np.inf]
+        
+        return (bounds_down,bounds_up)
+      
+#%% MODEL STAGES
+    def computeStage(self,stage):
+        """ Computes one stage of the model (see fourierModel.stages) from the current aoSystem.
+        """
+        tstart = time.time()
+        
+        if (self.streaming or self.metricsOnly) and stage in ['psd','sf','psf']:
+            self.PSD = None
+            self.SF  = None
+            self.basis = None
+            if self.metricsOnly and stage == 'psf':
+                self.metrics = self.metricsTable()
+            
+        elif stage == 'freq':
+            # the anisoplanatism structure function is defined with the r0 at the atmosphere wavelength
+            self.ao.atm.wvl = self.wvlAtm
+            self.freq = frequencyDomain(self.ao,nyquistSampling=self.nyquistSampling,computeFocalAnisoCov=self.computeFocalAnisoCov)
+            
+        elif stage == 'reconstructor':
             # DEFINING THE GUIDE STAR AND THE STRECHING FACTOR
             if self.ao.lgs:
                 self.gs  = self.ao.lgs
@@ -127,142 +256,252 @@ class fourierModel:
             #updating the atmosphere wavelength !
             self.ao.atm.wvl  = self.freq.wvlRef
             self.atm_mod.wvl = self.freq.wvlRef
-            self.t_initFreq = 1000*(time.time() - tstart)
-
+            
             vv = self.freq.psInMas
             rr = 2*self.freq.kcInMas/vv 
             if rr[0] > self.freq.nOtf:
                 raise ValueError('Error : the PSF field of view is too small to simulate the AO correction area')
             
             # DEFINING THE NOISE AND ATMOSPHERE PSD
-            if self.ao.wfs.processing.noiseVar == [None]:
+            if self.noiseFromModel:
                 self.ao.wfs.processing.noiseVar = self.ao.wfs.NoiseVariance(self.ao.atm.r0 ,self.ao.atm.wvl)
             
             self.Wn   = np.mean(self.ao.wfs.processing.noiseVar)/(2*self.freq.kcMax_)**2
             self.Wphi = self.ao.atm.spectrum(np.sqrt(self.freq.k2AO_))
             
             # DEFINE THE RECONSTRUCTOR
-            self.spatialReconstructor(MV=MV)
-                
-            # DEFINE THE CONTROLLER
+            self.spatialReconstructor(MV=self.MV)
+            
+        elif stage == 'controller':
             self.controller(display=self.display)
-                            
-            #set tilt filter key before computing the PSD
-            self.applyTiltFilter = TiltFilter
             
-            # COMPUTE THE PSD
-            if normalizePSD == True:
+        elif stage == 'psd':
+            if self.normalizePSD == True:
                 wfe = self.ao.rtc.holoop['wfe']
             else:
                 wfe = None
-            self.PSD = self.powerSpectrumDensity(wfe=wfe)
-            
-            # COMPUTE THE PHASE STRUCTURE FUNCTION
-            self.SF  = self.phaseStructureFunction()
+            if self.halfPlane:
+                # only the half-plane arrays are kept, the full-plane ones are rebuilt on request.
+                # The half-plane PSD is the even part of the PSD, which is all the structure function depends on.
+                self.PSD_half = FourierUtils.fullToHalfPlane(self.powerSpectrumDensity(wfe=wfe))
+            else:
+                self.PSD = self.powerSpectrumDensity(wfe=wfe)
+            # the linear basis is defined around the previous PSD
+            self.basis = None
             
-            # COMPUTE THE PSF
-            if calcPSF:
-                self.PSF, self.SR = self.pointSpreadFunction(verbose=verbose,fftphasor=fftphasor,addOtfPixel=self.addOtfPixel)
+        elif stage == 'sf':
+            if self.halfPlane:
+                self.SF_half = self.phaseStructureFunction(halfPlane=True)
+            else:
+                self.SF  = self.phaseStructureFunction()
+                
+        elif stage == 'psf':
+            if self.calcPSF:
+                self.PSF, self.SR = self.pointSpreadFunction(verbose=self.verbose,fftphasor=self.fftphasor,addOtfPixel=self.addOtfPixel)
                 
                 # GETTING METRICS
-                if getFWHM == True or getEnsquaredEnergy==True or getEncircledEnergy==True:
-                    self.getPsfMetrics(getEnsquaredEnergy=getEnsquaredEnergy,\
-                        getEncircledEnergy=getEncircledEnergy,getFWHM=getFWHM)
+                if self.getPSFmetrics:
+                    self.getPsfMetrics(**self.metricsFlags)
     
                 # DISPLAYING THE PSFS
-                if display:
-                    self.displayResults(displayContour=displayContour)
+                if self.display:
+                    self.displayResults(displayContour=self.displayContour)
                 
             # COMPUTE THE ERROR BREAKDOWN
             if self.getErrorBreakDown:
                 self.errorBreakDown(verbose=self.verbose)
-                    
-        # DEFINING BOUNDS
-        self.bounds = self.defineBounds()
-                
-        self.t_init = 1000*(time.time()  - tstart)
-        
-        # DISPLAYING EXECUTION TIMES
-        if verbose:
-            self.displayExecutionTime()
-          
         
-            
-    def __repr__(self):
-        s = '\t\t\t\t________________________ FOURIER MODEL ________________________\n\n'
-        s += self.ao.__repr__() + '\n'
-        s += self.freq.__repr__() + '\n'
-        s +=  '\n'
-        return s
-
-#%% BOUNDS FOR PSF-FITTING
-    def defineBounds(self):
-          
-        # Photometry
-        bounds_down = [-np.inf,-np.inf,-np.inf]
-        bounds_up = [np.inf,np.inf,np.inf]
-        # Photometry
-        bounds_down += np.zeros(self.ao.src.nSrc).tolist()
-        bounds_up += (np.inf*np.ones(self.ao.src.nSrc)).tolist()
-        # Astrometry
-        bounds_down += (-self.freq.nPix//2 * np.ones(2*self.ao.src.nSrc)).tolist()
-        bounds_up += ( self.freq.nPix//2 * np.ones(2*self.ao.src.nSrc)).tolist()
-        # Background
-        bounds_down += [-np.inf]
-        bounds_up += [np.inf]
-        
-        return (bounds_down,bounds_up)
-      
+        setattr(self,'t_stage_' + stage,1000*(time.time() - tstart))
+    
+    def update(self,**params):
+        """ Updates the model for new parameters values, recomputing only the stages that depend on them
+        according to fourierModel.stageDependencies. Accepted parameters :
+            - zenith_angle : telescope zenith angle in degrees
+            - seeing : seeing at zenith in arcsec at the atmosphere wavelength
+            - r0 : line-of-sight r0 in m at 500 nm
+            - weights, wSpeed, wDir : Cn2 weights, wind speeds in m/s and wind directions in degrees
+            - noiseVar : WFS noise variances in rad^2
+            - gain, delay, rate : loop gain, delay in frames and loop rate in Hz
+            - srcZenith, srcAzimuth : science sources coordinates in arcsec and degrees
+        The recomputed and reused stages are recorded in self.updatedStages and self.reusedStages; for SCAO and
+        SLAO systems, r0 and weights changes only reweight the anisoplanatism structure function of the
+        frequency domain.
+        """
+        tstart = time.time()
+        unknown = [key for key in params if key not in ['zenith_angle','seeing','r0','weights','wSpeed','wDir',
+                                                         'noiseVar','gain','delay','rate','srcZenith','srcAzimuth']]
+        if len(unknown):
+            raise ValueError('Unknown parameters : ' + ', '.join(unknown))
+        
+        # the anisoplanatism structure function of the frequency domain depends on the atmosphere and sources
+        atmStage = 'freq' if self.ao.aoMode in ['SCAO','SLAO'] else 'reconstructor'
+        # but only through its Cn2 weighting for r0 and weights changes, see frequencyDomain.reweightAnisoplanatism
+        reweightAniso = False
+        # the wind and the loop rate enter the controller, and the tomographic reconstructor
+        windStages = ['reconstructor','controller'] if self.nGs > 1 else ['controller']
+        entry = set()
+        
+        # ATMOSPHERE AND TELESCOPE
+        atm = self.ao.atm
+        r0, weights, heights, wSpeed, wDir = atm.r0, atm.weights, atm.heights, atm.wSpeed, atm.wDir
+        if 'zenith_angle' in params:
+            ratio   = nnp.cos(self.ao.tel.zenith_angle*deg2rad)/nnp.cos(params['zenith_angle']*deg2rad)
+            r0      = r0 * ratio**(-3.0/5.0)
+            heights = heights * ratio
+            if self.ao.lgs:
+                self.ao.lgs.height = self.ao.lgs.height * ratio
+            self.ao.tel.zenith_angle = params['zenith_angle']
+            entry.add(atmStage)
+        if 'seeing' in params:
+            r0 = 0.976*self.wvlAtm/params['seeing']*rad2arc * self.ao.tel.airmass**(-3.0/5.0) * (atm.wvl/self.wvlAtm)**1.2
+        if 'r0' in params:
+            r0 = params['r0']*(atm.wvl/500e-9)**1.2
+        if 'weights' in params:
+            weights = nnp.asarray(params['weights'],dtype=float)
+            # the temporal transfer functions are averaged with the Cn2 weights
+            entry.add('controller')
+        if 'seeing' in params or 'r0' in params or 'weights' in params:
+            reweightAniso = atmStage == 'freq'
+            entry.add('reconstructor')
+        if 'wSpeed' in params:
+            wSpeed = nnp.asarray(params['wSpeed'],dtype=float)
+        if 'wDir' in params:
+            wDir = nnp.asarray(params['wDir'],dtype=float)
+        if 'wSpeed' in params or 'wDir' in params:
+            entry.update(windStages)
+        if entry:
+            self.ao.atm = atmosphere(atm.wvl,r0,weights,heights,wSpeed,wDir,atm.L0)
+        
+        # WFS AND LOOP
+        if 'noiseVar' in params:
+            self.ao.wfs.processing.noiseVar = list(nnp.atleast_1d(params['noiseVar']))
+            self.noiseFromModel = False
+            entry.add('reconstructor')
+        for key in ['gain','delay','rate']:
+            if key in params:
+                self.ao.rtc.holoop[key] = params[key]
+                # the tiled tomographic spatio-temporal PSD is computed with the reconstructor
+                tiledStages = windStages if self.nRowsPerTile is not None else ['controller']
+                entry.update(windStages if key == 'rate' else tiledStages if key == 'delay' else ['controller'])
+        
+        # SCIENCE SOURCES
+        if 'srcZenith' in params or 'srcAzimuth' in params:
+            src = self.ao.src
+            wvl = src.wvl if src.nWvl > 1 else src.wvl[0]
+            self.ao.src = source(wvl,params.get('srcZenith',src.zenith),params.get('srcAzimuth',src.azimuth),
+                                 tag="SCIENCE",verbose=False)
+            entry.add(atmStage)
+        
+        # PROPAGATION THROUGH THE DEPENDENCY GRAPH
+        invalid = set()
+        while entry:
+            stage = entry.pop()
+            if stage not in invalid:
+                invalid.add(stage)
+                entry.update(self.stageDependencies[stage])
+        
+        self.updatedStages = [stage for stage in self.stages if stage in invalid]
+        self.reusedStages  = [stage for stage in self.stages if stage not in invalid]
+        if reweightAniso and 'freq' not in invalid:
+            # the anisoplanatism structure function is defined with the r0 at the atmosphere wavelength
+            self.ao.atm.wvl = self.wvlAtm
+            self.freq.reweightAnisoplanatism()
+        for stage in self.updatedStages:
+            self.computeStage(stage)
+        if 'freq' in invalid or 'srcZenith' in params or 'srcAzimuth' in params:
+            self.bounds = self.defineBounds()
+        
+        self.t_update = 1000*(time.time() - tstart)
+     
 #%% RECONSTRUCTOR DEFINITION    
     def spatialReconstructor(self,MV=0):
         tstart  = time.time()
         
         if self.nGs <2:
             self.reconstructionFilter(MV=MV)
+        elif self.nRowsPerTile is None:
+            self.tomographicOperators()
         else:
-        
-            self.Wtomo  = self.tomographicReconstructor()
-            self.Popt   = self.optimalProjector()
-            self.W      = np.matmul(self.Popt,self.Wtomo)
-            
-            # Computation of the Pbeta^DM matrix
-            k       = np.sqrt(self.freq.k2AO_)
-            h_dm    = self.ao.dms.heights
-            nDm     = len(h_dm)
-            nK      = self.freq.resAO
-            i       = complex(0,1)
-            nH      = self.ao.atm.nL
-            Hs      = self.ao.atm.heights * self.strechFactor
-            d       = self.freq.pitch[0]
-            sampTime= 1/self.ao.rtc.holoop['rate']
-            
-            self.PbetaDM = []
-            for s in range(self.ao.src.nSrc):
-                fx = self.ao.src.direction[0,s]*self.freq.kxAO_
-                fy = self.ao.src.direction[1,s]*self.freq.kyAO_
-                PbetaDM = np.zeros([nK,nK,1,nDm],dtype=complex)
-                for j in range(nDm): #loop on DMs
-                    index               = k <= self.freq.kc_[j] # note : circular masking
-                    PbetaDM[index,0,j]  = np.exp(2*i*np.pi*h_dm[j]*(fx[index] + fy[index]))
-                self.PbetaDM.append(PbetaDM)
-            
-            # Computation of the Malpha matrix
-            wDir_x  = nnp.cos(self.ao.atm.wDir*np.pi/180)
-            wDir_y  = nnp.sin(self.ao.atm.wDir*np.pi/180)
-            self.MPalphaL = np.zeros([nK,nK,self.nGs,nH],dtype=complex)
-            for h in range(nH):
-                www = np.sinc(sampTime*self.ao.atm.wSpeed[h]*(wDir_x[h]*self.freq.kxAO_ + wDir_y[h]*self.freq.kyAO_))
-                for g in range(self.nGs):
-                    Alpha = [self.gs.direction[0,g],self.gs.direction[1,g]]
-                    fx = Alpha[0]*self.freq.kxAO_
-                    fy = Alpha[1]*self.freq.kyAO_
-                    self.MPalphaL[:,:,g,h] = www*2*i*np.pi*k*np.sinc(d*self.freq.kxAO_)*\
-                        np.sinc(d*self.freq.kyAO_)*np.exp(i*2*np.pi*Hs[h]*(fx+fy))
-                
-            self.Walpha = np.matmul(self.W,self.MPalphaL)
+            # the operators are only kept per block of rows, the time to accumulate the PSDs of the sources
+            self.psdTiles = self.tiledTomography()
             
         self.t_finalReconstructor = 1000*(time.time() - tstart)
            
+    def tomographicOperators(self,rows=None):
+        """ Tomographic reconstructor Wtomo, optimal projector Popt, reconstructor W = Popt Wtomo, DM
+        projectors PbetaDM in the science directions and closed-loop operator Walpha = W MPalphaL, for the
+        rows of the AO frequency domain given by the slice rows (all by default).
+        """
+        if rows is None:
+            rows = slice(None)
+        self.Wtomo  = self.tomographicReconstructor(solver=self.solver,rows=rows)
+        self.Popt   = self.optimalProjector(solver=self.solver,rows=rows)
+        self.W      = np.matmul(self.Popt,self.Wtomo)
+        
+        # Computation of the Pbeta^DM matrix
+        kx, ky  = self.freq.kxAO_[rows], self.freq.kyAO_[rows]
+        k       = np.sqrt(self.freq.k2AO_[rows])
+        nR, nK  = kx.shape
+        h_dm    = self.ao.dms.heights
+        nDm     = len(h_dm)
+        i       = complex(0,1)
+        nH      = self.ao.atm.nL
+        Hs      = self.ao.atm.heights * self.strechFactor
+        d       = self.freq.pitch[0]
+        sampTime= 1/self.ao.rtc.holoop['rate']
+        
+        self.PbetaDM = []
+        for s in range(self.ao.src.nSrc):
+            fx = self.ao.src.direction[0,s]*kx
+            fy = self.ao.src.direction[1,s]*ky
+            PbetaDM = np.zeros([nR,nK,1,nDm],dtype=complex)
+            for j in range(nDm): #loop on DMs
+                index               = k <= self.freq.kc_[j] # note : circular masking
+                PbetaDM[index,0,j]  = np.exp(2*i*np.pi*h_dm[j]*(fx[index] + fy[index]))
+            self.PbetaDM.append(PbetaDM)
+        
+        # Computation of the Malpha matrix
+        wDir_x  = nnp.cos(self.ao.atm.wDir*np.pi/180)
+        wDir_y  = nnp.sin(self.ao.atm.wDir*np.pi/180)
+        self.MPalphaL = np.zeros([nR,nK,self.nGs,nH],dtype=complex)
+        for h in range(nH):
+            www = np.sinc(sampTime*self.ao.atm.wSpeed[h]*(wDir_x[h]*kx + wDir_y[h]*ky))
+            for g in range(self.nGs):
+                Alpha = [self.gs.direction[0,g],self.gs.direction[1,g]]
+                fx = Alpha[0]*kx
+                fy = Alpha[1]*ky
+                self.MPalphaL[:,:,g,h] = www*2*i*np.pi*k*np.sinc(d*kx)*\
+                    np.sinc(d*ky)*np.exp(i*2*np.pi*Hs[h]*(fx+fy))
+            
+        self.Walpha = np.matmul(self.W,self.MPalphaL)
+    
+    def tiledTomography(self,perWfs=False,perLayer=False,terms=['noise','st']):
+        """ Tomographic noise PSD, for a unit noise gain and noise variance, and spatio-temporal PSD of all 
+        the science sources, computed by blocks of nRowsPerTile rows of the AO frequency domain : the
+        operators of each block (see tomographicOperators) are released once the PSDs are accumulated.
+        perWfs and perLayer select the per-WFS and per-layer contributions (see noisePSD and 
+        spatioTemporalPSD), terms the PSDs to compute. Returns a dictionary of PSDs with keys 'noise' and 'st'.
+        """
+        tstart = time.time()
+        nK  = self.freq.resAO
+        src = nnp.arange(self.ao.src.nSrc)
+        psd = {}
+        if 'noise' in terms:
+            psd['noise'] = np.zeros((nK,nK,len(src)) + ((self.nGs,) if perWfs else ()))
+        if 'st' in terms:
+            psd['st'] = np.zeros((nK,nK,len(src)) + ((self.ao.atm.nL,) if perLayer else ()))
+        for r in range(0,nK,self.nRowsPerTile):
+            rows = slice(r,min(r+self.nRowsPerTile,nK))
+            self.tomographicOperators(rows=rows)
+            if 'noise' in terms:
+                psd['noise'][rows] = self.tomographicNoise(src,rows=rows,perWfs=perWfs)
+            if 'st' in terms:
+                psd['st'][rows] = self.tomographicResidual(src,rows=rows,perLayer=perLayer)
+        self.Wtomo = self.Popt = self.W = self.PbetaDM = self.MPalphaL = self.Walpha = None
+        self.M = self.Cb = self.Cphi = self.Cphi_mod = None
+        self.t_tiledTomography = 1000*(time.time() - tstart)
+        return psd
+    
     def reconstructionFilter(self,MV=0):
         """
         """          
@@ -303,11 +542,24 @@ class fourierModel:
             
         self.t_reconstructor = 1000*(time.time()  - tstart)
         
-    def tomographicReconstructor(self):
-        
+    def tomographicReconstructor(self,solver='pinv',rows=None):
+        """ Tomographic reconstructor Wtomo = Cphi MP^H (MP Cphi MP^H + Cb)^-1 for each spatial frequency
+        of the rows of the AO frequency domain given by the slice rows (all by default).
+        solver = 'pinv' : pseudo-inverse of the full stack (SVD), reference implementation
+        solver = 'eigh' : same truncated inverse through Hermitian eigen-solves, on half of the frequencies
+        solver = 'cholesky' : same truncated inverse, with Cholesky solves on half of the frequencies (in the layer
+                              space, through the Woodbury identity, when there are fewer modelled layers than
+                              guide stars) wherever the truncation discards no eigenvalue, which is mostly
+                              decided from bounds of the eigenvalues
+        The half-plane solvers rely on Wtomo(-k) = -conj(Wtomo(k)) when all the rows are computed.
+        """
         tstart  = time.time()
-        k       = np.sqrt(self.freq.k2AO_)
-        nK      = self.freq.resAO
+        if rows is None:
+            rows = slice(None)
+        kx, ky  = self.freq.kxAO_[rows], self.freq.kyAO_[rows]
+        k2      = self.freq.k2AO_[rows]
+        k       = np.sqrt(k2)
+        nR, nK  = kx.shape
         nL      = len(self.ao.atm.heights)
         h_mod   = self.atm_mod.heights * cpuArray(self.strechFactor_mod)
         nL_mod  = len(h_mod)
@@ -316,61 +568,124 @@ class fourierModel:
         d       = [self.ao.wfs.optics[j].dsub for j in range(nGs)]   #sub-aperture size      
         
          # WFS operator and projection matrices
-        M     = np.zeros([nK,nK,nGs,nGs],dtype=complex)
-        P     = np.zeros([nK,nK,nGs,nL_mod],dtype=complex)         
+        M     = np.zeros([nR,nK,nGs,nGs],dtype=complex)
+        P     = np.zeros([nR,nK,nGs,nL_mod],dtype=complex)         
         for j in range(nGs):
-            M[:,:,j,j] = 2*i*np.pi*k*np.sinc(d[j]*self.freq.kxAO_)*np.sinc(d[j]*self.freq.kyAO_)
+            M[:,:,j,j] = 2*i*np.pi*k*np.sinc(d[j]*kx)*np.sinc(d[j]*ky)
             for n in range(nL_mod):
-                P[:,:,j,n] = np.exp(i*2*np.pi*h_mod[n]*(self.freq.kxAO_*self.gs.direction[0,j] + self.freq.kyAO_*self.gs.direction[1,j]))
+                P[:,:,j,n] = np.exp(i*2*np.pi*h_mod[n]*(kx*self.gs.direction[0,j] + ky*self.gs.direction[1,j]))
         self.M = M
-        MP = np.matmul(self.M,P)
-        MP_t = np.conj(MP.transpose(0,1,3,2))
         
         # Noise covariance matrix
-        self.Cb = np.ones((nK,nK,nGs,nGs))*np.diag(self.ao.wfs.processing.noiseVar)
+        noiseVar = np.asarray(self.ao.wfs.processing.noiseVar,dtype=float)
+        self.Cb  = np.ones((nR,nK,nGs,nGs))*np.diag(noiseVar)
         
         # Atmospheric PSD with the true atmosphere
-        self.Cphi   = np.zeros([nK,nK,nL,nL],dtype=complex)
         cte         = (24*spc.gamma(6/5)/5)**(5/6)*(spc.gamma(11/6)**2./(2.*np.pi**(11/3)))
-        kernel      = self.ao.atm.r0**(-5/3)*cte*(self.freq.k2AO_ + 1/self.ao.atm.L0**2)**(-11/6)*self.freq.pistonFilterAO_
-        self.Cphi   = kernel.repeat(nL**2,axis=1).reshape((nK,nK,nL,nL))*np.diag(self.ao.atm.weights)
+        kernel      = self.ao.atm.r0**(-5/3)*cte*(k2 + 1/self.ao.atm.L0**2)**(-11/6)*self.freq.pistonFilterAO_[rows]
+        self.Cphi   = kernel.repeat(nL**2,axis=1).reshape((nR,nK,nL,nL))*np.diag(self.ao.atm.weights)
         
         # Atmospheric PSD with the modelled atmosphere
         if nL_mod == nL:
             self.Cphi_mod = self.Cphi
         else:
-            self.Cphi_mod = kernel.repeat(nL_mod**2,axis=1).reshape((nK,nK,nL_mod,nL_mod))*np.diag(self.atm_mod.weights)
-        to_inv  = np.matmul(np.matmul(MP,self.Cphi_mod),MP_t) + self.Cb 
-        
-        # Wtomo
-        inv = np.linalg.pinv(to_inv,rcond=1/self.ao.dms.opt_cond)
-        Wtomo = np.matmul(np.matmul(self.Cphi_mod,MP_t),inv)        
+            self.Cphi_mod = kernel.repeat(nL_mod**2,axis=1).reshape((nR,nK,nL_mod,nL_mod))*np.diag(self.atm_mod.weights)
+        
+        if solver == 'pinv':
+            MP      = np.matmul(self.M,P)
+            MP_t    = np.conj(MP.transpose(0,1,3,2))
+            to_inv  = np.matmul(np.matmul(MP,self.Cphi_mod),MP_t) + self.Cb 
+            inv     = np.linalg.pinv(to_inv,rcond=1/self.ao.dms.opt_cond)
+            Wtomo   = np.matmul(np.matmul(self.Cphi_mod,MP_t),inv)
+        elif solver in ['eigh','cholesky']:
+            # M, Cb and Cphi are diagonal : only their diagonals are used, on half of the frequencies
+            idx, idx_m, idx_s = self.halfPlaneIndices(nR)
+            mDiag   = M.reshape(nR*nK,nGs,nGs)[idx][:,range(nGs),range(nGs)]
+            MP      = mDiag[:,:,None]*P.reshape(nR*nK,nGs,nL_mod)[idx]
+            MP_t    = np.conj(MP.transpose(0,2,1))
+            c       = kernel.reshape(nR*nK)[idx,None]*np.asarray(self.atm_mod.weights)[None,:]
+            MPc     = MP*c[:,None,:]
+            to_inv  = np.matmul(MPc,MP_t) + np.diag(noiseVar)
+            rcond   = 1/self.ao.dms.opt_cond
+            Wh      = np.zeros((len(idx),nL_mod,nGs),dtype=complex)
+            # Cholesky solves where the truncation of the pseudo-inverse discards no eigenvalue
+            chol    = np.zeros(len(idx),dtype=bool)
+            if solver == 'cholesky':
+                # Weyl bounds : min(Cb) <= lambda_min and lambda_max <= max(Cb) + trace(MP Cphi MP^H)
+                trace = np.real(to_inv[:,range(nGs),range(nGs)]).sum(axis=-1) - noiseVar.sum()
+                chol  = noiseVar.min() > rcond*(noiseVar.max() + trace)
+                # eigenvalues of the few systems left undecided by the bounds
+                if not np.all(chol):
+                    lam         = abs(np.linalg.eigvalsh(to_inv[~chol]))
+                    chol[~chol] = lam.min(axis=-1) > rcond*lam.max(axis=-1)
+            try:
+                if np.any(chol) and nL_mod < nGs and np.all(noiseVar > 0):
+                    # Woodbury : Wtomo = S (I + S MP^H Cb^-1 MP S)^-1 S MP^H Cb^-1, with S = Cphi^1/2
+                    sq        = np.sqrt(c[chol])
+                    B         = MP_t[chol]/noiseVar
+                    to_inv_l  = sq[:,:,None]*np.matmul(B,MP[chol])*sq[:,None,:] + np.eye(nL_mod)
+                    Wh[chol]  = sq[:,:,None]*FourierUtils.solveHermitian(to_inv_l,sq[:,:,None]*B)
+                elif np.any(chol):
+                    # Wtomo^H = (MP Cphi MP^H + Cb)^-1 MP Cphi
+                    Wh[chol] = np.conj(FourierUtils.solveHermitian(to_inv[chol],MPc[chol]).transpose(0,2,1))
+            except np.linalg.LinAlgError:
+                chol[:] = False
+            if not np.all(chol):
+                inv       = FourierUtils.pinvHermitian(to_inv[~chol],rcond=rcond)
+                Wh[~chol] = np.matmul(c[~chol,:,None]*MP_t[~chol],inv)
+            # filling the other half-plane
+            Wtomo           = np.zeros((nR*nK,nL_mod,nGs),dtype=complex)
+            Wtomo[idx]      = Wh
+            Wtomo[idx_m]    = -np.conj(Wtomo[idx_s])
+            Wtomo           = Wtomo.reshape(nR,nK,nL_mod,nGs)
+        else:
+            raise ValueError("solver must be 'pinv', 'eigh' or 'cholesky'")
+            
         self.t_tomo = 1000*(time.time() - tstart)
         
         return Wtomo
  
-    def optimalProjector(self):
-        
+    def halfPlaneIndices(self,nRows):
+        """ Flat indices of the frequencies to compute, of the mirrored frequencies and of their sources
+        (see FourierUtils.hermitianHalfPlane) for a block of nRows rows of the AO frequency domain : the
+        Hermitian symmetry is only used when the block covers the whole domain.
+        """
+        nK = self.freq.resAO
+        if nRows == nK:
+            return FourierUtils.hermitianHalfPlane(nK)
+        idx = nnp.arange(nRows*nK)
+        return idx, idx[:0], idx[:0]
+    
+    def optimalProjector(self,solver='pinv',rows=None):
+        """ Optimal projector of the modelled layers onto the DMs over the optimization directions, for the
+        rows of the AO frequency domain given by the slice rows (all by default).
+        The normal matrix is rank-deficient beyond the DM cut-off frequencies, hence any solver other than
+        'pinv' falls back to the truncated Hermitian eigen-solve on half of the frequencies,
+        using Popt(-k) = conj(Popt(k)).
+        """
         tstart = time.time()
-        k       = np.sqrt(self.freq.k2AO_)
+        if rows is None:
+            rows = slice(None)
+        kx, ky  = self.freq.kxAO_[rows], self.freq.kyAO_[rows]
+        k       = np.sqrt(self.freq.k2AO_[rows])
         h_dm    = self.ao.dms.heights
         nDm     = len(h_dm)
         nDir    = (len(self.ao.dms.opt_dir[0]))
         h_mod   = self.atm_mod.heights * cpuArray(self.strechFactor_mod)
         nL      = len(h_mod)
-        nK      = self.freq.resAO
+        nR, nK  = kx.shape
         i       = complex(0,1)
         
-        mat1    = np.zeros([nK,nK,nDm,nL],dtype=complex)
-        to_inv  = np.zeros([nK,nK,nDm,nDm],dtype=complex)
+        mat1    = np.zeros([nR,nK,nDm,nL],dtype=complex)
+        to_inv  = np.zeros([nR,nK,nDm,nDm],dtype=complex)
         theta_x = self.ao.dms.opt_dir[0]/206264.8 * nnp.cos(self.ao.dms.opt_dir[1]*np.pi/180)
         theta_y = self.ao.dms.opt_dir[0]/206264.8 * nnp.sin(self.ao.dms.opt_dir[1]*np.pi/180)
         
         for d_o in range(nDir):                 #loop on optimization directions
-            Pdm = np.zeros([nK,nK,1,nDm],dtype=complex)
-            Pl  = np.zeros([nK,nK,1,nL],dtype=complex)
-            fx  = theta_x[d_o]*self.freq.kxAO_
-            fy  = theta_y[d_o]*self.freq.kyAO_
+            Pdm = np.zeros([nR,nK,1,nDm],dtype=complex)
+            Pl  = np.zeros([nR,nK,1,nL],dtype=complex)
+            fx  = theta_x[d_o]*kx
+            fy  = theta_y[d_o]*ky
             for j in range(nDm):                # loop on DM
                 index   = k <= self.freq.kc_[j] # note : circular masking here
                 Pdm[index,0,j] = np.exp(i*2*np.pi*h_dm[j]*(fx[index]+fy[index]))
@@ -382,81 +697,59 @@ class fourierModel:
             to_inv += np.matmul(Pdm_t,Pdm)*self.ao.dms.opt_weights[d_o]
             
         # Popt
-        mat2 = np.linalg.pinv(to_inv,rcond=1/self.ao.dms.opt_cond)
-        Popt = np.matmul(mat2,mat1)
+        if solver == 'pinv':
+            mat2 = np.linalg.pinv(to_inv,rcond=1/self.ao.dms.opt_cond)
+            Popt = np.matmul(mat2,mat1)
+        elif solver in ['eigh','cholesky']:
+            idx, idx_m, idx_s = self.halfPlaneIndices(nR)
+            mat2        = FourierUtils.pinvHermitian(to_inv.reshape(nR*nK,nDm,nDm)[idx],rcond=1/self.ao.dms.opt_cond)
+            Popt        = np.zeros((nR*nK,nDm,nL),dtype=complex)
+            Popt[idx]   = np.matmul(mat2,mat1.reshape(nR*nK,nDm,nL)[idx])
+            Popt[idx_m] = np.conj(Popt[idx_s])
+            Popt        = Popt.reshape(nR,nK,nDm,nL)
+        else:
+            raise ValueError("solver must be 'pinv', 'eigh' or 'cholesky'")
         
         self.t_opt = 1000*(time.time() - tstart)
         return Popt
  
     
 #%% CONTROLLER DEFINITION
-    def controller(self,nTh=1,nF=1000,display=False):
-        """
+    def controller(self,nTh=1,nF=1000,display=False,gain=None,delay=None):
+        """ Temporal transfer functions of the integrator, evaluated for all layers and wind directions
+        in one broadcast pass from the closed-form expressions :
+            ATF = g z^-d / (1 - z^-1 + g z^-d), NTF = ATF/z, with z = exp(2i pi f Ts)
+        The gain and delay (in frames, possibly fractional) default to the ones of the .ini file.
         """
         tstart  = time.time()
         
-        if self.ao.rtc.holoop['gain'] != 0:     
+        if gain is None:
+            gain = self.ao.rtc.holoop['gain']
+        if delay is None:
+            delay = self.ao.rtc.holoop['delay']
+            
+        if gain != 0:     
         
             i           = complex(0,1)
-            vx          = self.ao.atm.wSpeed*nnp.cos(self.ao.atm.wDir*np.pi/180)
-            vy          = self.ao.atm.wSpeed*nnp.sin(self.ao.atm.wDir*np.pi/180)   
-            nPts        = self.freq.resAO
-            thetaWind   = np.linspace(0, 2*np.pi-2*np.pi/nTh,nTh)
-            costh       = np.cos(thetaWind)
-            weights     = self.ao.atm.weights
-            Ts          = 1.0/self.ao.rtc.holoop['rate']#samplingTime
-            delay       = self.ao.rtc.holoop['delay']#latency        
-            loopGain    = self.ao.rtc.holoop['gain']
-            #delay       = np.floor(delay/Ts)
-                       
-            # Instantiation
-            h1          = np.zeros((nPts,nPts),dtype=complex)
-            h2          = np.zeros((nPts,nPts))
-            hn          = np.zeros((nPts,nPts))
+            weights     = np.asarray(self.ao.atm.weights)
+            rate        = self.ao.rtc.holoop['rate']
+            Ts          = 1.0/rate#samplingTime
             
             # Get the noise propagation factor
             f           = np.logspace(-3,np.log10(0.5/Ts),nF)
             z           = np.exp(-2*i*np.pi*f*Ts)
-            self.hInt   = loopGain/(1.0 - z**(-1.0))
+            self.hInt   = gain/(1.0 - z**(-1.0))
             self.rtfInt = 1.0/(1 + self.hInt * z**(-delay))
             self.atfInt = self.hInt * z**(-delay) * self.rtfInt
-            
-            if loopGain == 0:
-                self.ntfInt = 1
-            else:
-                self.ntfInt = self.atfInt/z
-                    
+            self.ntfInt = self.atfInt/z
             self.noiseGain = np.trapz(abs(self.ntfInt)**2,f)*2*Ts
                  
             # Get transfer functions                                        
-            for l in range(self.ao.atm.nL):
-                h1buf = np.zeros((nPts,nPts,nTh),dtype=complex)
-                h2buf = np.zeros((nPts,nPts,nTh))
-                hnbuf = np.zeros((nPts,nPts,nTh))
-                for iTheta in range(nTh):
-                    fi      = -vx[l]*self.freq.kxAO_*costh[iTheta] - vy[l]*self.freq.kyAO_*costh[iTheta]
-                    z       = np.exp(-2*i*np.pi*fi*Ts)
-                    hInt    = loopGain/(1.0 - z**(-1.0))
-                    rtfInt  = 1.0/(1.0 + hInt * z**(-delay))
-                    atfInt  = hInt * z**(-delay) * rtfInt
-                    
-                    # AO transfer function
-                    h2buf[:,:,iTheta] = abs(atfInt)**2
-                    h1buf[:,:,iTheta] = atfInt
-                    # noise transfer function
-                    if loopGain == 0:
-                        ntfInt = 1
-                    else:
-                        ntfInt = atfInt/z
-                    hnbuf[:,:,iTheta] = abs(ntfInt)**2
-                    
-                h1 += weights[l]*np.sum(h1buf,axis=2)/nTh
-                h2 += weights[l]*np.sum(h2buf,axis=2)/nTh
-                hn += weights[l]*np.sum(hnbuf,axis=2)/nTh
-            
-            self.h1 = h1
-            self.h2 = h2
-            self.hn = hn
+            h1_l, h2_l = self.temporalTransferMaps(gain,delay,rate,nTh=nTh)
+            self.h1 = np.tensordot(weights,h1_l,axes=1)
+            self.h2 = np.tensordot(weights,h2_l,axes=1)
+            # noise transfer function : |NTF|^2 = |ATF|^2 as |z| = 1
+            self.hn = self.h2
             
             if display:
                 plt.figure()
@@ -469,12 +762,47 @@ class fourierModel:
                 plt.legend()
             
         self.t_controller = 1000*(time.time() - tstart)
+    
+    def temporalTransferMaps(self,gain,delay,rate,nTh=1,nCacheMax=8):
+        """ Per-layer maps of the aliasing transfer function ATF and of |ATF|^2, averaged over nTh 
+        wind directions, of size nL x nPts x nPts. The maps are cached and keyed by the gain, the delay,
+        the rate and the wind vectors so that updating r0, Cn2 weights or noise does not recompute them.
+        """
+        vx   = self.ao.atm.wSpeed*nnp.cos(self.ao.atm.wDir*np.pi/180)
+        vy   = self.ao.atm.wSpeed*nnp.sin(self.ao.atm.wDir*np.pi/180)
+        key  = (float(gain),float(delay),float(rate),tuple(nnp.ravel(vx).tolist()),tuple(nnp.ravel(vy).tolist()),
+                nTh,self.freq.resAO,float(self.freq.PSDstep))
+        
+        if getattr(self,'controllerCache',None) is None:
+            self.controllerCache = {}
+        if key not in self.controllerCache:
+            i        = complex(0,1)
+            Ts       = 1.0/rate
+            costh    = np.cos(np.linspace(0, 2*np.pi-2*np.pi/nTh,nTh))
+            # temporal frequencies of size nL x nTh x nPts x nPts
+            fi       = -(vx[:,np.newaxis,np.newaxis,np.newaxis]*self.freq.kxAO_ 
+                         + vy[:,np.newaxis,np.newaxis,np.newaxis]*self.freq.kyAO_)*costh[:,np.newaxis,np.newaxis]
+            zinv     = np.exp(2*i*np.pi*fi*Ts)
+            zd       = zinv**delay
+            atfInt   = gain*zd/(1.0 - zinv + gain*zd)
+            if len(self.controllerCache) >= nCacheMax:
+                self.controllerCache.pop(next(iter(self.controllerCache)))
+            self.controllerCache[key] = (atfInt.mean(axis=1),(abs(atfInt)**2).mean(axis=1))
+            
+        return self.controllerCache[key]
       
     #%% PSD DEFINTIONS  
-    def powerSpectrumDensity(self,wfe=None):
+    def powerSpectrumDensity(self,wfe=None,src=None,dtype=None):
         """ Total power spectrum density in nm^2.m^2
+        src is the list of indices of the science sources to compute the PSD for, by default all of them.
+        dtype is the type of the PSD, by default the one of the model precision.
         """
         tstart  = time.time()
+        if dtype is None:
+            dtype = self.dtype
+        if src is None:
+            src = nnp.arange(self.ao.src.nSrc)
+        nSrc = len(src)
         
         dk     = 2*self.freq.kcMax_/self.freq.resAO
         rad2nm = self.ao.atm.wvl*1e9/2/np.pi
@@ -487,39 +815,39 @@ class fourierModel:
             psd = psd[:,:,np.newaxis]
         else:
             # CLOSED-LOOP
-            psd = np.zeros((self.freq.nOtf,self.freq.nOtf,self.ao.src.nSrc))
+            psd = np.zeros((self.freq.nOtf,self.freq.nOtf,nSrc),dtype=dtype)
             
             # AO correction area
             id1 = np.ceil(self.freq.nOtf/2 - self.freq.resAO/2).astype(int)
             id2 = np.ceil(self.freq.nOtf/2 + self.freq.resAO/2).astype(int)
             # Noise
-            self.psdNoise = np.real(self.noisePSD())       
+            self.psdNoise = np.real(self.noisePSD(src=src))       
             if self.nGs == 1:
-                psd[id1:id2,id1:id2,:] = np.repeat(self.psdNoise[:, :, np.newaxis], self.ao.src.nSrc, axis=2)
+                psd[id1:id2,id1:id2,:] = np.repeat(self.psdNoise[:, :, np.newaxis], nSrc, axis=2)
             else:
                 psd[id1:id2,id1:id2,:] = self.psdNoise
                 
             # Aliasing
             self.psdAlias           = np.real(self.aliasingPSD())
-            psd[id1:id2,id1:id2,:]  = psd[id1:id2,id1:id2,:] + np.repeat(self.psdAlias[:, :, np.newaxis], self.ao.src.nSrc, axis=2)
+            psd[id1:id2,id1:id2,:]  = psd[id1:id2,id1:id2,:] + np.repeat(self.psdAlias[:, :, np.newaxis], nSrc, axis=2)
             
             # Differential refractive anisoplanatism
-            self.psdDiffRef         = self.differentialRefractionPSD()
+            self.psdDiffRef         = self.differentialRefractionPSD(src=src)
             psd[id1:id2,id1:id2,:]  = psd[id1:id2,id1:id2,:] + self.psdDiffRef
         
             # Chromatism
-            self.psdChromatism      = self.chromatismPSD()
+            self.psdChromatism      = self.chromatismPSD(src=src)
             psd[id1:id2,id1:id2,:]  = psd[id1:id2,id1:id2,:] + self.psdChromatism
         
             # Add the noise and spatioTemporal PSD
-            self.psdSpatioTemporal = np.real(self.spatioTemporalPSD())
+            self.psdSpatioTemporal = np.real(self.spatioTemporalPSD(src=src))
             psd[id1:id2,id1:id2,:] = psd[id1:id2,id1:id2,:] + self.psdSpatioTemporal
            
             # Cone effect
             if self.nGs == 1 and self.gs.height[0] != 0:
                 print('SLAO case adding cone effect')
                 self.psdCone = self.focalAnisoplanatismPSD()
-                psd += np.repeat(self.psdCone[:, :, np.newaxis], self.ao.src.nSrc, axis=2)
+                psd += np.repeat(self.psdCone[:, :, np.newaxis], nSrc, axis=2)
             
             # NORMALIZATION
             if wfe !=None:
@@ -528,12 +856,12 @@ class fourierModel:
                 
             # Fitting
             self.psdFit = np.real(self.fittingPSD())
-            psd += np.repeat(self.psdFit[:, :, np.newaxis], self.ao.src.nSrc, axis=2)
+            psd += np.repeat(self.psdFit[:, :, np.newaxis], nSrc, axis=2)
             
             # Tilt filter
             if self.applyTiltFilter == True:
                 tiltFilter = self.TiltFilter()                      
-                for i in range(self.ao.src.nSrc):
+                for i in range(nSrc):
                     psd[:,:,i] *= tiltFilter
             
             # Extra error
@@ -542,13 +870,13 @@ class fourierModel:
                 print('extra error spatial frequency exponent: ',self.ao.tel.extraErrorExp)
             if self.ao.tel.extraErrorNm > 0:
                 self.psdExtra = np.real(self.extraErrorPSD())
-                for i in range(self.ao.src.nSrc):
+                for i in range(nSrc):
                     psd[:,:,i] += self.psdExtra
             
         self.t_powerSpectrumDensity = 1000*(time.time() - tstart)
             
         # Return the 3D PSD array in nm^2
-        return psd * (dk * rad2nm)**2
+        return (psd * (dk * rad2nm)**2).astype(dtype,copy=False)
     
     def fittingPSD(self):
         """ Fitting error power spectrum density """                 
@@ -559,9 +887,39 @@ class fourierModel:
         self.t_fittingPSD = 1000*(time.time() - tstart)
         return psd
                
-    def aliasingPSD(self):
+    def aliasingShiftTerms(self,d):
+        """ Layer-independent terms of the aliasing PSD for each (mi,ni) frequency shift, i.e. the
+            piston filter, the von-Karman spectrum and the sub-aperture averaging. These terms only
+            depend on the geometry and are cached for later calls (r0, Cn2, wind or noise updates).
+        """
+        nT  = self.freq.nTimes
+        key = (d,self.ao.tel.D,self.ao.atm.L0,nT,self.freq.resAO,float(self.freq.PSDstep))
+        if getattr(self,'aliasingCache',None) is None or self.aliasingCache['key'] != key:
+            # frequency shifts
+            m   = np.arange(-nT,nT)
+            mi  = np.repeat(np.arange(2*nT),2*nT)
+            ni  = np.tile(np.arange(2*nT),2*nT)
+            idx = (m[mi]!=0) | (m[ni]!=0)
+            mi  = mi[idx]
+            ni  = ni[idx]
+            # shifted frequencies; kxAO_ only varies along the first axis and kyAO_ along the second
+            km1 = self.freq.kxAO_[np.newaxis,:,0] - m[:,np.newaxis]/d
+            kn1 = self.freq.kyAO_[np.newaxis,0,:] - m[:,np.newaxis]/d
+            km  = km1[mi,:,np.newaxis]
+            kn  = kn1[ni,np.newaxis,:]
+            PR  = FourierUtils.pistonFilter(self.ao.tel.D,np.hypot(km,kn))
+            W_mn= (km**2 + kn**2 + 1/self.ao.atm.L0**2)**(-11/6)
+            G   = PR*W_mn*(np.sinc(d*km)*np.sinc(d*kn))**2
+            self.aliasingCache = {'key':key,'km1':km1,'kn1':kn1,'mi':mi,'ni':ni,'G':G}
+            
+        return self.aliasingCache
+    
+    def aliasingPSD(self,nShiftPerChunk=8):
         """ Aliasing error power spectrum density 
             TO BE REVIEWED IN THE CASE OF A PYRAMID WFSs
+            The sum over frequency shifts and layers is vectorized : the layers terms are separable in kx
+            and ky and are contracted over layers by a matrix product, while the shifts are processed by
+            chunks of nShiftPerChunk to bound the memory.
         """ 
         
         tstart  = time.time()
@@ -572,7 +930,7 @@ class fourierModel:
         td = T * self.ao.rtc.holoop['delay']        
         vx = self.ao.atm.wSpeed*nnp.cos(self.ao.atm.wDir*np.pi/180)
         vy = self.ao.atm.wSpeed*nnp.sin(self.ao.atm.wDir*np.pi/180)
-        weights = self.ao.atm.weights  
+        weights = np.asarray(self.ao.atm.weights)
         w = 2*i*np.pi*d
 
         if hasattr(self, 'Rx') == False:
@@ -584,31 +942,51 @@ class fourierModel:
             tf = 1
         else:
             tf = self.h1
-            
-        # loops on frequency shifts
-        for mi in range(-self.freq.nTimes,self.freq.nTimes):
-            for ni in range(-self.freq.nTimes,self.freq.nTimes):
-                if (mi!=0) | (ni!=0):
-                    km   = self.freq.kxAO_ - mi/d
-                    kn   = self.freq.kyAO_ - ni/d
-                    PR   = FourierUtils.pistonFilter(self.ao.tel.D,np.hypot(km,kn),fm=mi/d,fn=ni/d)
-                    W_mn = (km**2 + kn**2 + 1/self.ao.atm.L0**2)**(-11/6)     
-                    Q    = (Rx*km + Ry*kn) * (np.sinc(d*km)*np.sinc(d*kn))
-                    avr  = 0
-                        
-                    for l in range(self.ao.atm.nL):
-                        avr +=  weights[l] * (np.sinc(km*vx[l]*T) * np.sinc(kn*vy[l]*T)
-                        * np.exp(2*i*np.pi*km*vx[l]*td)*np.exp(2*i*np.pi*kn*vy[l]*td)*tf)
-                                                          
-                    psd += PR*W_mn * abs(Q*avr)**2
         
+        # layer-independent terms
+        cache = self.aliasingShiftTerms(d)
+        km1   = cache['km1']
+        kn1   = cache['kn1']
+        mi    = cache['mi']
+        ni    = cache['ni']
+        
+        # separable layers terms of size 2nTimes x nK x nL
+        A = np.sinc(km1[:,:,np.newaxis]*vx*T)*np.exp(2*i*np.pi*km1[:,:,np.newaxis]*vx*td) * weights
+        B = np.sinc(kn1[:,:,np.newaxis]*vy*T)*np.exp(2*i*np.pi*kn1[:,:,np.newaxis]*vy*td)
+        
+        # loops on chunks of frequency shifts
+        for j in range(0,len(mi),nShiftPerChunk):
+            sl  = slice(j,j+nShiftPerChunk)
+            km  = km1[mi[sl],:,np.newaxis]
+            kn  = kn1[ni[sl],np.newaxis,:]
+            avr = np.matmul(A[mi[sl]],B[ni[sl]].transpose(0,2,1))
+            psd+= (cache['G'][sl] * abs((Rx*km + Ry*kn)*avr)**2).sum(axis=0)
+        
+        psd = psd * abs(tf)**2
         self.t_aliasingPSD = 1000*(time.time() - tstart)
         return self.freq.mskInAO_ * psd * self.ao.atm.r0**(-5/3)*0.0229 
     
-    def noisePSD(self):
-        """Noise error power spectrum density
+    def noisePSD(self,perWfs=False,src=None):
+        """Noise error power spectrum density, for the science sources of indices src (default : all).
+        If perWfs is True, returns the nPts x nPts x nSrc x nWfs contributions of each WFS for a unit noise
+        variance, such that the noise PSD is mean(noiseVar) * sum_g noiseVar[g] * psd[:,:,:,g] 
+        (mean(noiseVar) * psd[:,:,:,0] in the single-WFS case).
         """
         tstart  = time.time()
+        if perWfs:
+            nK  = self.freq.resAO
+            msk = self.freq.mskInAO_ * self.freq.pistonFilterAO_
+            if self.nGs < 2:
+                psd = abs(self.Rx**2 + self.Ry**2)/(2*self.freq.kcMax_)**2 * msk
+                psd = np.repeat(psd[:,:,np.newaxis,np.newaxis],self.ao.src.nSrc,axis=2)
+            else:
+                if self.nRowsPerTile is None:
+                    psd = self.tomographicNoise(nnp.arange(self.ao.src.nSrc),perWfs=True)
+                else:
+                    psd = self.tiledTomography(perWfs=True,terms=['noise'])['noise']
+            self.t_noisePSD = 1000*(time.time() - tstart)
+            return psd*self.noiseGain
+        
         psd     = np.zeros((self.freq.resAO,self.freq.resAO))
         if self.ao.wfs.processing.noiseVar[0] > 0:
             if self.nGs < 2:        
@@ -616,13 +994,12 @@ class fourierModel:
                 psd = psd/(2*self.freq.kcMax_)**2
                 psd = self.freq.mskInAO_ * psd * self.freq.pistonFilterAO_
             else:  
-                psd = np.zeros((self.freq.resAO,self.freq.resAO,self.ao.src.nSrc),dtype=complex)
-                #where is the noise level ?
-                for j in range(self.ao.src.nSrc):
-                    PW      = np.matmul(self.PbetaDM[j],self.W)
-                    PW_t    = np.conj(PW.transpose(0,1,3,2))
-                    tmp     = np.matmul(PW,np.matmul(self.Cb,PW_t))
-                    psd[:,:,j] = self.freq.mskInAO_ * tmp[:,:,0,0]*self.freq.pistonFilterAO_
+                if src is None:
+                    src = nnp.arange(self.ao.src.nSrc)
+                if self.nRowsPerTile is None:
+                    psd = self.tomographicNoise(src)
+                else:
+                    psd = self.psdTiles['noise'][:,:,src]
         
         self.t_noisePSD = 1000*(time.time() - tstart)
         # NOTE: the noise variance is the same for all WFS
@@ -661,52 +1038,140 @@ class fourierModel:
         self.t_servoLagPSD = 1000*(time.time() - tstart)
         return self.freq.mskInAO_ * abs(psd)
     
-    def spatioTemporalPSD(self):
-        """%% Power spectrum density including reconstruction, field variations and temporal effects
+    def layerPhasors(self,Hs,ax,ay,memoryMB=256,rows=None):
+        """ Generator of the phasors exp(2i*pi*Hs[l]*(kxAO_*ax[s] + kyAO_*ay[s])) of the layers of altitudes Hs 
+        for the angular offsets (ax,ay) of the sources, by chunks of sources of at most memoryMB megabytes.
+        Yields the slice of the sources of the chunk and the nK x nK x nChunk x nL phasors, or only their
+        rows given by the slice rows. kxAO_ only varies along the first axis and kyAO_ along the second 
+        one : the phasors are products of 1D exponentials.
+        """
+        if rows is None:
+            rows = slice(None)
+        Hs  = np.asarray(Hs,dtype=float)
+        ax  = np.atleast_1d(np.asarray(ax,dtype=float))
+        ay  = np.atleast_1d(np.asarray(ay,dtype=float))
+        kx  = self.freq.kxAO_[rows,0,np.newaxis,np.newaxis]
+        ky  = self.freq.kyAO_[0,:,np.newaxis,np.newaxis]
+        nChunk = int(max(1,memoryMB*2**20//(16*len(kx)*len(ky)*len(Hs))))
+        for k in range(0,len(ax),nChunk):
+            sl = slice(k,k+nChunk)
+            ex = np.exp(2*complex(0,1)*np.pi*kx*(ax[sl,np.newaxis]*Hs))
+            ey = np.exp(2*complex(0,1)*np.pi*ky*(ay[sl,np.newaxis]*Hs))
+            yield sl, ex[:,np.newaxis] * ey[np.newaxis]
+    
+    def projectorsDM(self,src):
+        """ nK x nK x len(src) x nDm stack of the projectors PbetaDM of the DMs in the directions of the
+        science sources of indices src.
+        """
+        return np.stack([self.PbetaDM[s][:,:,0] for s in src],axis=2)
+    
+    def windPhasors(self,rows=None):
+        """ nK x nK x nL phasors of the translation of the layers by the wind during the loop delay, or their
+        rows given by the slice rows.
+        """
+        if rows is None:
+            rows = slice(None)
+        deltaT  = self.ao.rtc.holoop['delay']/self.ao.rtc.holoop['rate']
+        vx      = np.asarray(self.ao.atm.wSpeed*nnp.cos(self.ao.atm.wDir*np.pi/180))
+        vy      = np.asarray(self.ao.atm.wSpeed*nnp.sin(self.ao.atm.wDir*np.pi/180))
+        return np.exp(-2*complex(0,1)*np.pi*deltaT*(vx*self.freq.kxAO_[rows,:,np.newaxis] + vy*self.freq.kyAO_[rows,:,np.newaxis]))
+    
+    def tomographicNoise(self,src,rows=None,perWfs=False):
+        """ Tomographic noise PSD for a unit noise gain and noise variance, i.e. the quadratic form PW Cb PW^H 
+        of the noise propagation PW = PbetaDM W in the directions of the sources of indices src, from the
+        operators of the rows of the AO frequency domain given by the slice rows (all by default).
+        If perWfs is True, returns the contributions |PW|^2 of each WFS.
+        """
+        if rows is None:
+            rows = slice(None)
+        msk = (self.freq.mskInAO_ * self.freq.pistonFilterAO_)[rows]
+        PW  = np.matmul(self.projectorsDM(src),self.W)
+        if perWfs:
+            return abs(PW)**2 * msk[:,:,np.newaxis,np.newaxis]
+        return msk[:,:,np.newaxis] * np.real(np.einsum('xysg,xysg->xys',np.matmul(PW,self.Cb),np.conj(PW)))
+    
+    def tomographicResidual(self,src,rows=None,perLayer=False):
+        """ Tomographic spatio-temporal PSD, i.e. the quadratic form proj Cphi proj^H of the residual 
+        projector proj = PbetaL - PbetaDM Walpha in the directions of the sources of indices src, from the
+        operators of the rows of the AO frequency domain given by the slice rows (all by default).
+        If perLayer is True, returns the contributions of each layer for a unit weight.
+        """
+        if rows is None:
+            rows = slice(None)
+        src  = nnp.asarray(src)
+        Hs   = self.ao.atm.heights * self.strechFactor
+        msk  = (self.freq.mskInAO_ * self.freq.pistonFilterAO_)[rows]
+        wind = self.windPhasors(rows=rows)[:,:,np.newaxis]
+        if perLayer:
+            # the Cphi kernel for a unit weight
+            kernel = (self.ao.atm.spectrum(np.sqrt(self.freq.k2AO_))*self.freq.pistonFilterAO_)[rows]
+            psd    = np.zeros(msk.shape + (len(src),self.ao.atm.nL))
+        else:
+            psd    = np.zeros(msk.shape + (len(src),))
+        for sl,P in self.layerPhasors(Hs,self.ao.src.direction[0,src],self.ao.src.direction[1,src],rows=rows):
+            proj = P*wind - np.matmul(self.projectorsDM(src[sl]),self.Walpha)
+            if perLayer:
+                psd[:,:,sl] = abs(proj)**2 * (kernel*msk)[:,:,np.newaxis,np.newaxis]
+            else:
+                psd[:,:,sl] = msk[:,:,np.newaxis] * np.real(np.einsum('xysh,xysh->xys',np.matmul(proj,self.Cphi),np.conj(proj)))
+        return psd
+    
+    def spatioTemporalPSD(self,perLayer=False,src=None):
+        """%% Power spectrum density including reconstruction, field variations and temporal effects, for the
+        science sources of indices src (default : all).
+        If perLayer is True, returns the nPts x nPts x nSrc x nL contributions of each layer for a unit
+        weight, such that the PSD is sum_l weights[l] * psd[:,:,:,l] for normalized weights, 
+        the reconstructor and the temporal transfer functions being kept fixed.
         """
         tstart  = time.time()   
         nK  = self.freq.resAO
-        psd = np.zeros((nK,nK,self.ao.src.nSrc),dtype=complex)        
-        i   = complex(0,1)
-        nH  = self.ao.atm.nL
+        if perLayer:
+            psd = np.zeros((nK,nK,self.ao.src.nSrc,self.ao.atm.nL),dtype=complex)
+            Hs  = self.ao.atm.heights * self.strechFactor
+            if self.nGs < 2:
+                Watm = (self.Wphi * self.freq.pistonFilterAO_)[:,:,np.newaxis,np.newaxis]
+                F    = self.Rx*self.SxAv + self.Ry*self.SyAv
+                if (self.ao.rtc.holoop['gain'] == 0):
+                    psd[:] = abs(1-F[:,:,np.newaxis,np.newaxis])**2 * Watm
+                else:
+                    th    = self.ao.src.direction - self.gs.direction[:,0:1]
+                    FH1   = (F*self.h1)[:,:,np.newaxis,np.newaxis]
+                    FH2   = (abs(F)**2*self.h2)[:,:,np.newaxis,np.newaxis]
+                    for sl,A in self.layerPhasors(Hs,th[1],th[0]):
+                        psd[:,:,sl] = self.freq.mskInAO_[:,:,np.newaxis,np.newaxis] * (1 + FH2 - 2*np.real(FH1*A))*Watm
+            else:
+                if self.nRowsPerTile is None:
+                    psd[:] = self.tomographicResidual(nnp.arange(self.ao.src.nSrc),perLayer=True)
+                else:
+                    psd[:] = self.tiledTomography(perLayer=True,terms=['st'])['st']
+            self.t_spatioTemporalPSD = 1000*(time.time() - tstart)
+            return psd
+        
+        if src is None:
+            src = nnp.arange(self.ao.src.nSrc)
+        psd = np.zeros((nK,nK,len(src)),dtype=complex)        
         Hs  = self.ao.atm.heights * self.strechFactor
         Ws  = self.ao.atm.weights
-        deltaT  = self.ao.rtc.holoop['delay']/self.ao.rtc.holoop['rate']
-        wDir_x  = nnp.cos(self.ao.atm.wDir*np.pi/180)
-        wDir_y  = nnp.sin(self.ao.atm.wDir*np.pi/180)
         Watm    = self.Wphi * self.freq.pistonFilterAO_      
         F       = self.Rx*self.SxAv + self.Ry*self.SyAv
         
-        for s in range(self.ao.src.nSrc):
-            if self.nGs < 2:  
-                th  = self.ao.src.direction[:,s] - self.gs.direction[:,0]
-                if np.any(np.asarray(th)):
-                    A = np.zeros((nK,nK))
-                    for l in range(self.ao.atm.nL):                
-                        A   = A + Ws[l]*np.exp(2*i*np.pi*Hs[l]*(self.freq.kxAO_*th[1] + self.freq.kyAO_*th[0]))            
-                else:
-                    A = np.ones((self.freq.resAO,self.freq.resAO))
-          
-                if (self.ao.rtc.holoop['gain'] == 0):  
-                    psd[:,:,s] = abs(1-F)**2 * Watm
-                else:
-                    psd[:,:,s] = self.freq.mskInAO_ * (1 + abs(F)**2*self.h2 - 2*np.real(F*self.h1*A))*Watm                   
-            else:    
-                # tomographic case
-                Beta = [self.ao.src.direction[0,s],self.ao.src.direction[1,s]]
-                PbetaL = np.zeros([nK,nK,1,nH],dtype=complex)
-                fx = Beta[0]*self.freq.kxAO_
-                fy = Beta[1]*self.freq.kyAO_
-                for j in range(nH):
-                    PbetaL[:,:,0,j] = np.exp(i*2*np.pi*( Hs[j]*\
-                          (fx+fy) -  deltaT*self.ao.atm.wSpeed[j]\
-                          *(wDir_x[j]*self.freq.kxAO_+ wDir_y[j]*self.freq.kyAO_)))
-   
-
-                proj    = PbetaL - np.matmul(self.PbetaDM[s],self.Walpha)            
-                proj_t  = np.conj(proj.transpose(0,1,3,2))
-                tmp     = np.matmul(proj,np.matmul(self.Cphi,proj_t))
-                psd[:,:,s] = self.freq.mskInAO_ * tmp[:,:,0,0]*self.freq.pistonFilterAO_
+        if self.nGs < 2:
+            if (self.ao.rtc.holoop['gain'] == 0):  
+                psd[:] = (abs(1-F)**2 * Watm)[:,:,np.newaxis]
+            else:
+                # field-dependent correlation of the residual with the guide star, for normalized weights
+                th  = self.ao.src.direction[:,src] - self.gs.direction[:,0:1]
+                onAxis = ~np.any(np.asarray(th) != 0,axis=0)
+                A   = np.zeros((nK,nK,len(src)),dtype=complex)
+                for sl,P in self.layerPhasors(Hs,th[1],th[0]):
+                    A[:,:,sl] = np.matmul(P,np.asarray(Ws,dtype=float))
+                A[:,:,onAxis] = 1
+                psd[:] = self.freq.mskInAO_[:,:,np.newaxis] * (1 + (abs(F)**2*self.h2)[:,:,np.newaxis] \
+                         - 2*np.real((F*self.h1)[:,:,np.newaxis]*A))*Watm[:,:,np.newaxis]
+        elif self.nRowsPerTile is None:
+            psd[:] = self.tomographicResidual(src)
+        else:
+            psd[:] = self.psdTiles['st'][:,:,src]
         self.t_spatioTemporalPSD = 1000*(time.time() - tstart)
         return psd
     
@@ -716,20 +1181,20 @@ class fourierModel:
         tstart  = time.time()
         psd = np.zeros((self.freq.resAO,self.freq.resAO,self.ao.src.nSrc))
         Hs = self.ao.atm.heights * self.strechFactor
-        Ws = self.ao.atm.weights
+        Ws = np.asarray(self.ao.atm.weights,dtype=float)
         Watm = self.Wphi * self.freq.pistonFilterAO_       
         
-        for s in range(self.ao.src.nSrc):
-            th  = self.ao.src.direction[:,s] - self.gs.direction[:,0]
-            if any(th):
-                A = np.zeros((self.freq.resAO,self.freq.resAO))
-                for l in range(self.ao.atm.nL):
-                    A   = A + 2*Ws[l]*(1 - np.cos(2*np.pi*Hs[l]*(self.freq.kx*th[1] + self.freq.ky*th[0])))             
-                psd[:,:,s] = self.freq.mskInAO_ * A*Watm
+        # sum_l 2*Ws[l]*(1 - cos(phase)), which is zero for sources in the guide star direction
+        th  = self.ao.src.direction - self.gs.direction[:,0:1]
+        for sl,P in self.layerPhasors(Hs,th[1],th[0]):
+            psd[:,:,sl] = 2*np.matmul(1 - np.real(P),Ws) * (self.freq.mskInAO_*Watm)[:,:,np.newaxis]
         self.t_anisoplanatismPSD = 1000*(time.time() - tstart)
         return np.real(psd)
     
-    def differentialRefractionPSD(self):
+    def differentialRefractionPSD(self,perLayer=False,src=None):
+        """ Differential refraction power spectrum density for the science sources of indices src (default : 
+        all). If perLayer is True, returns the nPts x nPts x nSrc x nL contributions of each layer for a unit weight.
+        """
         def refractionIndex(wvl,nargout=1):
             ''' Refraction index -1 as a fonction of the wavelength. 
             Valid for lambda between 0.2 and 4µm with 1 atm of pressure and 15 degrees Celsius
@@ -761,67 +1226,93 @@ class fourierModel:
     
         tstart  = time.time()
         
-        psd= np.zeros((self.freq.resAO,self.freq.resAO,self.ao.src.nSrc))
+        if src is None:
+            src = nnp.arange(self.ao.src.nSrc)
+        if perLayer:
+            psd = np.zeros((self.freq.resAO,self.freq.resAO,len(src),self.ao.atm.nL))
+        else:
+            psd = np.zeros((self.freq.resAO,self.freq.resAO,len(src)))
         if self.ao.tel.zenith_angle != 0:
             Hs   = self.ao.atm.heights * self.strechFactor
             Ws   = self.ao.atm.weights
+            Ws   = np.asarray(Ws,dtype=float)
             Watm = self.Wphi * self.freq.pistonFilterAO_     
-            k    = np.sqrt(self.freq.k2AO_)
-            arg_k= np.arctan2(self.freq.kyAO_,self.freq.kxAO_)
-            azimuth = self.ao.src.azimuth
+            azimuth = nnp.asarray(self.ao.src.azimuth)[src]
         
+            # k*cos(arg_k - azimuth) = kx*cos(azimuth) + ky*sin(azimuth)
             theta = differentialRefractiveAnisoplanatism(self.ao.tel.zenith_angle*np.pi/180,self.gs.wvl[0], self.freq.wvlRef)
-            for s in range(self.ao.src.nSrc):
-                A    = 0
-                for l in range(self.ao.atm.nL):
-                    A   = A + 2*Ws[l]*(1 - np.cos(2*np.pi*Hs[l]*k*np.tan(theta)*np.cos(arg_k-azimuth[s])))            
-                psd[:,:,s] = self.freq.mskInAO_ *A*Watm
+            shift = np.tan(theta)*np.ones(len(src))
+            for sl,P in self.layerPhasors(Hs,shift*np.cos(azimuth),shift*np.sin(azimuth)):
+                A_l = 2*(1 - np.real(P))
+                if perLayer:
+                    psd[:,:,sl] = (self.freq.mskInAO_ *Watm)[:,:,np.newaxis,np.newaxis] * A_l
+                else:
+                    psd[:,:,sl] = (self.freq.mskInAO_ *Watm)[:,:,np.newaxis] * np.matmul(A_l,Ws)
          
         self.t_differentialRefractionPSD = 1000*(time.time() - tstart)
         return  psd
       
-    def chromatismPSD(self):
+    def chromatismPSD(self,src=None):
         """ PSD of the chromatic effects"""
         tstart  = time.time()
+        if src is None:
+            src = nnp.arange(self.ao.src.nSrc)
         Watm = self.Wphi * self.freq.pistonFilterAO_   
-        psd= np.zeros((self.freq.resAO,self.freq.resAO,self.ao.src.nSrc))
+        psd= np.zeros((self.freq.resAO,self.freq.resAO,len(src)))
         n2 =  23.7+6839.4/(130-(self.gs.wvl[0]*1.e6)**(-2))+45.47/(38.9-(self.gs.wvl[0]*1.e6)**(-2))
-        for s in range(self.ao.src.nSrc):
+        for s in range(len(src)):
             n1 =  23.7+6839.4/(130-(self.freq.wvlRef*1.e6)**(-2))+45.47/(38.9-(self.freq.wvlRef*1.e6)**(-2))     
             psd[:,:,s] = ((n2-n1)/n2)**2 * Watm
        
         self.t_chromatismPSD = 1000*(time.time() - tstart)
         return psd
     
-    def phaseStructureFunction(self):
+    def phaseStructureFunction(self,halfPlane=False,psd=None):
        '''
            GET THE AO RESIDUAL PHASE STRUCTURE FUNCTION   
+           If halfPlane is True, the structure function is computed from the half-plane PSD with a real
+           FFT and returned in the half-plane representation (see FourierUtils.fullToHalfPlane).
+           psd defaults to the PSD of the model; the structure function has the same type.
        '''
-       cov = fft.fftshift(fft.fftn(fft.fftshift(self.PSD,axes=(0,1)),axes=(0,1)),axes=(0,1))
-       return 2*np.real(cov.max(axis=(0,1)) - cov)
+       if halfPlane:
+           if psd is None:
+               psd = self.PSD_half
+           # the half-plane PSD is real and even : its FFT is nOtf^2 times its inverse FFT
+           nOtf = self.freq.nOtf
+           cov  = nOtf**2 * fft.irfftn(psd,s=(nOtf,nOtf),axes=(0,1),**FourierUtils.fftOptions(psd))
+           return (2*(cov.max(axis=(0,1)) - cov[:,:nOtf//2+1])).astype(psd.dtype,copy=False)
+       if psd is None:
+           psd = self.PSD
+       cov = fft.fftshift(fft.fftn(fft.fftshift(psd,axes=(0,1)),axes=(0,1),**FourierUtils.fftOptions(psd)),axes=(0,1))
+       return (2*np.real(cov.max(axis=(0,1)) - cov)).astype(psd.dtype,copy=False)
 
-    def focalAnisoplanatismPSD(self):
+    def focalAnisoplanatismPSD(self,perLayer=False):
         """%% Focal Anisoplanatism power spectrum density
+        The filter coefficients are evaluated with FourierUtils.coneFilterCoefficients and cached on disk.
+        If perLayer is True, returns the nOtf x nOtf x nL contributions of each layer for a unit weight.
         """
         tstart  = time.time()
         
         #Instantiate the function output
-        psd      = np.zeros((self.freq.nOtf,self.freq.nOtf))
+        if perLayer:
+            psd  = np.zeros((self.freq.nOtf,self.freq.nOtf,self.ao.atm.nL))
+        else:
+            psd  = np.zeros((self.freq.nOtf,self.freq.nOtf))
         # atmo PSD 
         psd_atmo = self.ao.atm.spectrum(np.sqrt(self.freq.k2_))    
         
         nPoints = 1001
         nPhase = 5 # number of phase shift cases
-        x = self.ao.tel.D*np.linspace(-0.5, 0.5, nPoints, endpoint=1)
+        D = float(self.ao.tel.D)
         h = self.ao.atm.heights
         h_laser = self.gs.height[0]
         ratio = (h_laser-h)/h_laser
         nCn2 = len(h)
-        freqs = self.freq.kx_[int(np.ceil(self.freq.nOtf/2)-1):,0]
+        freqs = cpuArray(self.freq.kx_[int(np.ceil(self.freq.nOtf/2)-1):,0])
         if freqs[0] < 0:
             freqs = freqs[1:]
         nf0 = len(freqs)
-        coeff = np.zeros((nf0,nCn2))
+        coeff = nnp.zeros((nf0,nCn2))
         
         if self.verbose:
             print('h_laser',h_laser)
@@ -829,21 +1320,22 @@ class fourierModel:
             print('nf0',nf0)
             print('ratio',ratio)
         
+        # filter coefficients, tabulated on disk for each (D, ratio, frequency grid) : only the 
+        # frequencies that are still corrected once compressed by the cone are evaluated
+        kc = nnp.max(cpuArray(self.freq.kc_))
         for j in range(nCn2):
-            for i in range(nf0):
-                if freqs[i]*ratio[j] > self.freq.kc_:
-                    coeff[i,j] = 0.0
-                else:
-                    if freqs[i] < 1e-5:
-                        coeff[i,j] = 0
-                    else:
-                        for k in range(nPhase):
-                            sin_ref = np.sin(2*np.pi*freqs[i]*x+2*np.pi*k/nPhase)
-                            sin_temp = np.sin(2*np.pi*freqs[i]*ratio[j]*x+2*np.pi*k/nPhase)
-                            sin_res = sin_ref - np.std(sin_ref)/np.std(sin_temp)*sin_temp
-                            coeff[i,j] += np.std(sin_res) / np.std(sin_ref) * 1/nPhase
-                         
-            coeff_tot = np.interp(np.sqrt(self.freq.k2_), freqs, coeff[:,j])**2
+            idx = (freqs*ratio[j] <= kc) & (freqs >= 1e-5)
+            if not nnp.any(idx):
+                continue
+            key = diskCache.cacheKey(D,float(ratio[j]),freqs[idx],nPoints,nPhase)
+            coeff_j = diskCache.loadFromCache('coneFilter',key)
+            if coeff_j is None or coeff_j.shape != (idx.sum(),):
+                coeff_j = FourierUtils.coneFilterCoefficients(freqs[idx],ratio[j],D,nPoints=nPoints,nPhase=nPhase)[:,0]
+                diskCache.saveToCache('coneFilter',key,coeff_j)
+            coeff[idx,j] = coeff_j
+        
+        for j in range(nCn2):
+            coeff_tot = np.interp(np.sqrt(self.freq.k2_), np.asarray(freqs), np.asarray(coeff[:,j]))**2
             
             #fig, ax1 = plt.subplots(1,1)
             #im = ax1.plot(coeff)
@@ -851,7 +1343,10 @@ class fourierModel:
             #im = ax2.imshow(coeff_tot, cmap='hot')
             #ax2.set_title('cone effect filter coefficients', color='black')
             
-            psd += coeff_tot*psd_atmo*self.ao.atm.weights[j]
+            if perLayer:
+                psd[:,:,j] = coeff_tot*psd_atmo
+            else:
+                psd += coeff_tot*psd_atmo*self.ao.atm.weights[j]
         
         self.t_focalAnisoplanatism = 1000*(time.time() - tstart)
         
@@ -881,29 +1376,31 @@ class fourierModel:
     
     def TiltFilter(self):
         """%% Spatial filter to remove tilt related errors
+        The filter coefficients are evaluated with FourierUtils.tiltFilterCoefficients and cached on disk.
         """
         
         nPoints = 1001
         nPhase = 10 # number of phase shift cases
-        x = self.ao.tel.D*np.linspace(-0.5, 0.5, nPoints, endpoint=1)
-        freqs = self.freq.kx_[int(np.ceil(self.freq.nOtf/2)-1):,0]
+        D = float(self.ao.tel.D)
+        freqs = cpuArray(self.freq.kx_[int(np.ceil(self.freq.nOtf/2)-1):,0])
         if freqs[0] < 0:
             freqs = freqs[1:]
         nf0 = len(freqs)
-        coeff = np.zeros(nf0)
-               
-        for i in range(nf0):
-            if freqs[i] == 0:
-                coeff[i] = 0
-            elif 1/freqs[i] < 0.1*self.ao.tel.D:
-                coeff[i] = 1
-            else:
-                for k in range(nPhase):
-                    sin_ref = np.sin(2*np.pi*freqs[i]*x+2*np.pi*k/nPhase)
-                    coeff_lin = np.polyfit(x,sin_ref,1)
-                    sin_temp = coeff_lin[0]*x+coeff_lin[1]
-                    sin_res = sin_ref - sin_temp
-                    coeff[i] += np.std(sin_res) / np.std(sin_ref) * 1/nPhase
+        
+        # filter coefficients, tabulated on disk for each (D, frequency grid) : frequencies 
+        # above 10/D are not filtered
+        coeff = nnp.ones(nf0)
+        coeff[freqs == 0] = 0
+        idx = (freqs != 0) & (0.1*D*freqs <= 1)
+        if nnp.any(idx):
+            key = diskCache.cacheKey(D,freqs[idx],nPoints,nPhase)
+            coeff_f = diskCache.loadFromCache('tiltFilter',key)
+            if coeff_f is None or coeff_f.shape != (idx.sum(),):
+                coeff_f = FourierUtils.tiltFilterCoefficients(freqs[idx],D,nPoints=nPoints,nPhase=nPhase)
+                diskCache.saveToCache('tiltFilter',key,coeff_f)
+            coeff[idx] = coeff_f
+        freqs = np.asarray(freqs)
+        coeff = np.asarray(coeff)
                
         coeff_tot = np.interp(np.sqrt(self.freq.k2_), freqs, coeff)**2
         
@@ -917,7 +1414,136 @@ class fourierModel:
             
         return np.real(coeff_tot)
        
+#%% LINEAR BASIS
+    def linearBasis(self):
+        """ Decomposition of the PSD and of the phase structure function on terms that are linear
+        in r0^(-5/3), in the Cn2 weights and in the WFS noise variances :
+            PSD = static + c*r0 + c * sum_l weights[l]*layers[l] + mean(noiseVar) * sum_g noiseVar[g]*noise[g]
+        with c = (r0/r0_ref)^(-5/3). The static term is the extra error, the r0 term gathers the fitting,
+        aliasing and chromatism, the layers terms the spatio-temporal, differential refraction and 
+        cone effect. The reconstructor, the temporal transfer functions and the aliasing are frozen to 
+        their values for the reference atmosphere.
+        The basis is stored in self.basis, as PSDs and structure functions in the half-plane 
+        representation (see FourierUtils.fullToHalfPlane).
+        """
+        tstart  = time.time()
+        if self.normalizePSD:
+            raise ValueError('The linear basis is not compatible with the PSD normalization')
+        
+        nOtf = self.freq.nOtf
+        nSrc = self.ao.src.nSrc
+        nL   = self.ao.atm.nL
+        id1  = np.ceil(self.freq.nOtf/2 - self.freq.resAO/2).astype(int)
+        id2  = np.ceil(self.freq.nOtf/2 + self.freq.resAO/2).astype(int)
+        nWfs = self.nGs if self.nGs > 1 else 1
+        
+        psd = {'static':np.zeros((nOtf,nOtf,nSrc)),
+               'r0':np.zeros((nOtf,nOtf,nSrc)),
+               'layers':np.zeros((nOtf,nOtf,nSrc,nL)),
+               'noise':np.zeros((nOtf,nOtf,nSrc,nWfs))}
+        
+        if self.ao.rtc.holoop['gain'] == 0:
+            # OPEN-LOOP
+            k   = np.sqrt(self.freq.k2_)
+            psd['r0'] += (self.ao.atm.spectrum(k) * FourierUtils.pistonFilter(self.ao.tel.D,k))[:,:,np.newaxis]
+        else:
+            # CLOSED-LOOP
+            psd['noise'][id1:id2,id1:id2] = np.real(self.noisePSD(perWfs=True))
+            psd['r0'][id1:id2,id1:id2]  = np.real(self.aliasingPSD())[:,:,np.newaxis] + self.chromatismPSD()
+            psd['r0'] += np.real(self.fittingPSD())[:,:,np.newaxis]
+            psd['layers'][id1:id2,id1:id2] = np.real(self.spatioTemporalPSD(perLayer=True)) \
+                                             + self.differentialRefractionPSD(perLayer=True)
+            if self.nGs == 1 and self.gs.height[0] != 0:
+                psd['layers'] += self.focalAnisoplanatismPSD(perLayer=True)[:,:,np.newaxis,:]
+            if self.applyTiltFilter == True:
+                tiltFilter = self.TiltFilter()
+                for key in ['r0','layers','noise']:
+                    psd[key] *= tiltFilter.reshape(tiltFilter.shape + (1,)*(psd[key].ndim-2))
+            if self.ao.tel.extraErrorNm > 0:
+                psd['static'] += np.real(self.extraErrorPSD())[:,:,np.newaxis]
+        
+        # half-plane representations in nm^2 and structure functions, term by term to bound the memory
+        dk     = 2*self.freq.kcMax_/self.freq.resAO
+        rad2nm = self.ao.atm.wvl*1e9/2/np.pi
+        self.basis = {'r0':self.ao.atm.r0*(500e-9/self.ao.atm.wvl)**1.2,'psd':{},'sf':{}}
+        for key in psd:
+            psdH = (FourierUtils.fullToHalfPlane(psd[key]) * (dk * rad2nm)**2).astype(self.dtype)
+            sfH  = np.zeros_like(psdH)
+            for j in nnp.ndindex(psdH.shape[2:]):
+                sfH[(Ellipsis,)+j] = FourierUtils.halfPlanePsd2sf(psdH[(Ellipsis,)+j],nOtf)
+            self.basis['psd'][key] = psdH
+            self.basis['sf'][key]  = sfH
+        
+        self.t_linearBasis = 1000*(time.time() - tstart)
+        return self.basis
+    
+    def evaluateBasis(self,r0=None,weights=None,noiseVar=None,getPSF=False):
+        """ PSD and phase structure function in nm^2, in the half-plane representation, for a new r0 (in m at 
+        500 nm), Cn2 weights and WFS noise variances (in rad^2) from the linear basis (see linearBasis), 
+        without rebuilding the model. Parameters that are not given keep the value of the model. 
+        If getPSF is True, the PSF and the Strehl ratio are returned as well. The model itself is not 
+        modified, except for the basis computed at the first call.
+        """
+        if getattr(self,'basis',None) is None:
+            self.linearBasis()
+        
+        if r0 is None:
+            r0 = self.ao.atm.r0*(500e-9/self.ao.atm.wvl)**1.2
+        if weights is None:
+            weights = self.ao.atm.weights
+        if noiseVar is None:
+            noiseVar = self.ao.wfs.processing.noiseVar
+        weights  = np.asarray(weights,dtype=float)
+        noiseVar = nnp.asarray(noiseVar,dtype=float)
+        
+        # coefficients
+        c_r0 = (r0/self.basis['r0'])**(-5/3)
+        if self.nGs > 1:
+            c_n = np.asarray(noiseVar.mean()*noiseVar)
+        else:
+            c_n = np.asarray([noiseVar.mean()])
+        
+        def combine(b):
+            return (b['static'] + c_r0*b['r0'] + c_r0*np.tensordot(b['layers'],weights,axes=1) \
+                   + np.tensordot(b['noise'],c_n,axes=1)).astype(self.dtype,copy=False)
+        
+        psd = combine(self.basis['psd'])
+        sf  = combine(self.basis['sf'])
+        if getPSF:
+            PSF, SR = self.evaluate(addOtfPixel=self.addOtfPixel,SF=sf)
+            return psd, sf, PSF, SR
+        return psd, sf
+    
 #%% AO ERROR BREAKDOWN
+    def wavefrontErrors(self):
+        """ Dictionary of the wavefront errors in nm of the PSD terms (psdFit, psdNoise, ...) last computed by
+        powerSpectrumDensity, with the total error and the Maréchal Strehl-ratio in percents.
+        """
+        rad2nm = (2*self.freq.kcMax_/self.freq.resAO) * self.freq.wvlRef*1e9/2/np.pi
+        wfe    = {}
+        if not self.ao.tel.opdMap_on is None:
+            wfe['wfeNCPA'] = np.std(self.ao.tel.opdMap_on[self.ao.tel.pupil!=0])
+        else:
+            wfe['wfeNCPA'] = 0.0
+            
+        wfe['wfeFit']    = np.sqrt(self.psdFit.sum()) * rad2nm
+        wfe['wfeAl']     = np.sqrt(self.psdAlias.sum()) * rad2nm
+        wfe['wfeN']      = np.sqrt(self.psdNoise.sum(axis=(0,1)))* rad2nm
+        wfe['wfeST']     = np.sqrt(self.psdSpatioTemporal.sum(axis=(0,1)))* rad2nm
+        wfe['wfeDiffRef']= np.sqrt(self.psdDiffRef.sum(axis=(0,1)))* rad2nm
+        wfe['wfeChrom']  = np.sqrt(self.psdChromatism.sum(axis=(0,1)))* rad2nm
+        wfe['wfeJitter'] = 1e9*self.ao.tel.D*nnp.mean(self.ao.cam.spotFWHM[0][0:2])/rad2mas/4
+        wfe['wfeExtra']  = self.ao.tel.extraErrorNm
+        
+        # Total wavefront error
+        wfe['wfeTot'] = np.sqrt(wfe['wfeNCPA']**2 + wfe['wfeFit']**2 + wfe['wfeAl']**2\
+                                + wfe['wfeST']**2 + wfe['wfeN']**2 + wfe['wfeDiffRef']**2\
+                                + wfe['wfeChrom']**2 + wfe['wfeJitter']**2 + wfe['wfeExtra']**2)
+        
+        # Maréchal appoximation to get the Strehl-ratio
+        wfe['SRmar'] = 100*np.exp(-(wfe['wfeTot']*2*np.pi*1e-9/self.freq.wvlRef)**2)
+        return wfe
+    
     def errorBreakDown(self,verbose=True):
         """ AO error breakdown from the PSD integrals
         """        
@@ -925,29 +1551,9 @@ class fourierModel:
         
         if self.ao.rtc.holoop['gain'] != 0:
             # Derives wavefront error
-            rad2nm      = (2*self.freq.kcMax_/self.freq.resAO) * self.freq.wvlRef*1e9/2/np.pi
-            
-            if not self.ao.tel.opdMap_on is None:
-                self.wfeNCPA= np.std(self.ao.tel.opdMap_on[self.ao.tel.pupil!=0])
-            else:
-                self.wfeNCPA = 0.0
-                
-            self.wfeFit    = np.sqrt(self.psdFit.sum()) * rad2nm
-            self.wfeAl     = np.sqrt(self.psdAlias.sum()) * rad2nm
-            self.wfeN      = np.sqrt(self.psdNoise.sum(axis=(0,1)))* rad2nm
-            self.wfeST     = np.sqrt(self.psdSpatioTemporal.sum(axis=(0,1)))* rad2nm
-            self.wfeDiffRef= np.sqrt(self.psdDiffRef.sum(axis=(0,1)))* rad2nm
-            self.wfeChrom  = np.sqrt(self.psdChromatism.sum(axis=(0,1)))* rad2nm
-            self.wfeJitter = 1e9*self.ao.tel.D*nnp.mean(self.ao.cam.spotFWHM[0][0:2])/rad2mas/4
-            self.wfeExtra  = self.ao.tel.extraErrorNm
-            
-            # Total wavefront error
-            self.wfeTot = np.sqrt(self.wfeNCPA**2 + self.wfeFit**2 + self.wfeAl**2\
-                                  + self.wfeST**2 + self.wfeN**2 + self.wfeDiffRef**2\
-                                  + self.wfeChrom**2 + self.wfeJitter**2 + self.wfeExtra**2)
-            
-            # Maréchal appoximation to get the Strehl-ratio
-            self.SRmar  = 100*np.exp(-(self.wfeTot*2*np.pi*1e-9/self.freq.wvlRef)**2)
+            for key,val in self.wavefrontErrors().items():
+                setattr(self,key,val)
+            rad2nm = (2*self.freq.kcMax_/self.freq.resAO) * self.freq.wvlRef*1e9/2/np.pi
             
             # bonus
             self.psdS = self.servoLagPSD()
@@ -1005,6 +1611,20 @@ class fourierModel:
             print("The fourier Model class must be instantiated first\n")
             return 0,0
         
+        PSF, SR = self.evaluate(x0=x0,nPix=nPix,addOtfPixel=addOtfPixel)
+        
+        self.t_getPSF = 1000*(time.time() - tstart)
+        
+        return PSF, SR
+    
+    def evaluate(self,x0=None,nPix=None,addOtfPixel=False,SF=None,src=None,metricsOnly=False):
+        """ Returns the PSF and the Strehl-ratio for the parameters x0 (jitter, photometry, astrometry,
+        background and static aberrations) without modifying the model, so that a single instance can 
+        serve concurrent evaluations from several threads. 
+        SF is a structure function in nm^2, in the full or half-plane representation, that replaces the
+        one of the model; src is then the list of indices of its science sources, by default all of them.
+        If metricsOnly is True, the FWHM is returned instead of the PSF (see FourierUtils.SF2PSF).
+        """
         if np.any(x0 == None):
             jitterX = self.ao.cam.spotFWHM[0][0]
             jitterY = self.ao.cam.spotFWHM[0][1]
@@ -1023,46 +1643,200 @@ class fourierModel:
             dy      = x0[3+2*self.ao.src.nSrc:3+3*self.ao.src.nSrc] + np.array(self.ao.cam.dispersion[1])[np.newaxis,:]
             bkg     = x0[3+3*self.ao.src.nSrc]
             xStat   = x0[4+3*self.ao.src.nSrc:]
+        if src is not None:
+            # photometry and astrometry of the selected sources
+            F, dx, dy = [a[src] if a.shape[0] == self.ao.src.nSrc else a for a in map(nnp.asarray,(F,dx,dy))]
         
         # ---------- GETTING THE PSF
         otfPixel=1
         if addOtfPixel:
             otfPixel = np.sinc(self.freq.U_)* np.sinc(self.freq.V_)
             
-        PSF, SR = FourierUtils.SF2PSF(self.SF,self.freq,self.ao,\
-                                      jitterX=jitterX,jitterY=jitterY,jitterXY=jitterXY,\
-                                      F=F,dx=dx,dy=dy,bkg=bkg,nPix=nPix,otfPixel=otfPixel,xStat=xStat)
-
-        self.t_getPSF = 1000*(time.time() - tstart)
+        if SF is None:
+            SF = self.SF_half if self.SF_half is not None else self.SF
+        if SF.shape[1] != self.freq.nOtf:
+            PSF, SR = FourierUtils.SF2PSF(SF,self.freq,self.ao,\
+                                          jitterX=jitterX,jitterY=jitterY,jitterXY=jitterXY,\
+                                          F=F,dx=dx,dy=dy,bkg=bkg,nPix=nPix,otfPixel=otfPixel,xStat=xStat,halfPlane=True,
+                                          nSrc=None if src is None else len(src),metricsOnly=metricsOnly)
+        else:
+            PSF, SR = FourierUtils.SF2PSF(SF,self.freq,self.ao,\
+                                          jitterX=jitterX,jitterY=jitterY,jitterXY=jitterXY,\
+                                          F=F,dx=dx,dy=dy,bkg=bkg,nPix=nPix,otfPixel=otfPixel,xStat=xStat,
+                                          nSrc=None if src is None else len(src),metricsOnly=metricsOnly)
         
         return PSF, SR
 
+    def precisionReport(self,x0=None,nPix=None):
+        """ Maximal relative differences of the PSD, the structure function, the PSF and the Strehl-ratio
+        computed in single and double precision, normalized by the maximal value of each output.
+        On the parFiles of the repository (nirc2, irdis, eris, MavisMCAO, HarmoniSCAO), with or without 
+        halfPlane, they are below :
+            - PSD : 2e-7
+            - SF  : 2e-7
+            - PSF : 2e-7
+            - SR  : 1e-7
+        In single precision, the frequency grids, the reconstructors and the controller are still computed 
+        in double precision, as well as the exponential of the structure function; the PSF is returned in 
+        double precision.
+        """
+        out = {}
+        for dtype in [np.float64,np.float32]:
+            psd = self.powerSpectrumDensity(wfe=self.ao.rtc.holoop['wfe'] if self.normalizePSD else None,dtype=dtype)
+            if self.halfPlane:
+                psd = FourierUtils.fullToHalfPlane(psd)
+            sf      = self.phaseStructureFunction(halfPlane=self.halfPlane,psd=psd)
+            psf, SR = self.evaluate(x0=x0,nPix=nPix,addOtfPixel=self.addOtfPixel,SF=sf)
+            out[dtype] = [psd,sf,psf,SR]
+            
+        report = {}
+        for k,name in enumerate(['PSD','SF','PSF','SR']):
+            ref = nnp.asarray(cpuArray(out[np.float64][k]),dtype=float)
+            err = nnp.abs(nnp.asarray(cpuArray(out[np.float32][k]),dtype=float) - ref)
+            report[name] = err.max()/nnp.abs(ref).max()
+        return report
+    
+    def sourcesPerBlock(self,memoryBudgetMB=1024,nPix=None,nSrc=None):
+        """ Number of science sources per block of streamPointSpreadFunction such that the arrays of two
+        blocks in flight (PSD, structure function, OTF stack and PSF) fit in memoryBudgetMB megabytes.
+        nSrc is the total number of sources to split into blocks, by default the number of science sources.
+        """
+        if nSrc is None:
+            nSrc = self.ao.src.nSrc
+        if nPix == None:
+            nPix = int(self.freq.nOtf/self.freq.kRef_)
+        nOtf  = self.freq.nOtf
+        nWvl  = self.freq.nWvl
+        size  = nnp.dtype(self.dtype).itemsize
+        # PSD and structure function with their complex FFT, OTF stack with the exponential of the
+        # structure function, PSF before and after binning, and the complex PSD terms in the AO area
+        bytesPerSrc = nOtf**2*(2*size + 16 + nWvl*(3*size + 16)) + 32*self.freq.resAO**2 + 8*nWvl*nPix**2
+        return int(max(1,min(nSrc,memoryBudgetMB*2**20//(2*bytesPerSrc))))
+    
+    def streamPointSpreadFunction(self,x0=None,nPix=None,nSrcPerBlock=None,memoryBudgetMB=1024,path_save=None):
+        """ Generator of the PSFs computed by blocks of science sources, to bound the memory for large
+        science grids : the PSD of a block is assembled while the structure function, the PSF and the
+        metrics of the previous block are computed in a separate thread. nSrcPerBlock defaults to the
+        value of sourcesPerBlock(memoryBudgetMB). 
+        Each block is yielded as a dictionary with the indices of the sources ('src'), the PSF, the 
+        Strehl-ratio ('SR'), the metrics requested at the instantiation and, with getErrorBreakDown in
+        closed-loop, the wavefront errors of the block (see wavefrontErrors). If path_save is given, the
+        PSFs are also written in a nPix x nPix x nSrc x nWvl .npy file.
+        The model is left unchanged, except for the PSD terms (psdNoise, psdAlias, ...) of the last block.
+        """
+        if self.normalizePSD:
+            raise ValueError('The PSD normalization needs the PSD of all the sources and can not be streamed')
+        if nPix == None:
+            nPix = int(self.freq.nOtf/self.freq.kRef_)
+        if nSrcPerBlock is None:
+            nSrcPerBlock = self.sourcesPerBlock(memoryBudgetMB=memoryBudgetMB,nPix=nPix)
+        nSrc = self.ao.src.nSrc
+        if path_save is not None:
+            out = nnp.lib.format.open_memmap(path_save,mode='w+',dtype=float,shape=(nPix,nPix,nSrc,self.freq.nWvl))
+            
+        def psfBlock(src,psd,wfe):
+            if self.halfPlane:
+                psd = FourierUtils.fullToHalfPlane(psd)
+            sf = self.phaseStructureFunction(halfPlane=self.halfPlane,psd=psd)
+            del psd
+            PSF, SR = self.evaluate(x0=x0,nPix=nPix,addOtfPixel=self.addOtfPixel,SF=sf,src=src)
+            block = {'src':src,'PSF':PSF,'SR':SR}
+            block.update(wfe)
+            if self.getPSFmetrics:
+                block.update(self.psfMetrics(PSF,**self.metricsFlags))
+            if path_save is not None:
+                out[:,:,src[0]:src[-1]+1] = cpuArray(PSF)
+            return block
+        
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            previous = None
+            for k in range(0,nSrc,nSrcPerBlock):
+                src = nnp.arange(k,min(k+nSrcPerBlock,nSrc))
+                psd = self.powerSpectrumDensity(src=src)
+                if psd.shape[2] != len(src):
+                    # the open-loop PSD does not depend on the source
+                    psd = np.repeat(psd,len(src),axis=2)
+                # the PSD terms are overwritten by the next block
+                wfe = {}
+                if self.getErrorBreakDown and self.ao.rtc.holoop['gain'] != 0:
+                    wfe = self.wavefrontErrors()
+                current = pool.submit(psfBlock,src,psd,wfe)
+                del psd
+                if previous is not None:
+                    yield previous.result()
+                previous = current
+            yield previous.result()
+        if path_save is not None:
+            out.flush()
+            del out
+    
+    def metricsTable(self,x0=None,nSrcPerBlock=None,memoryBudgetMB=1024):
+        """ Per-direction metrics computed without the PSFs, for large science grids : the PSD of each block 
+        of science sources is integrated over the frequency domain to get the wavefront errors (see 
+        wavefrontErrors) and Fourier-transformed into the structure function, from which the Strehl-ratio
+        is obtained as the OTF integral and the FWHM from the central cuts of the PSF (see FourierUtils.SF2PSF).
+        Returns a dictionary of arrays with one entry per science source along the first axis, or the
+        second one for the FWHM (2 x nSrc x nWvl) : zenith, azimuth, SR (nSrc x nWvl), FWHM and, in 
+        closed-loop, the wavefront errors wfeTot, wfeFit, wfeN, ... in nm and the Maréchal Strehl-ratio SRmar.
+        nSrcPerBlock defaults to the value of sourcesPerBlock(memoryBudgetMB).
+        """
+        tstart = time.time()
+        if self.normalizePSD:
+            raise ValueError('The PSD normalization needs the PSD of all the sources and can not be computed by blocks')
+        if nSrcPerBlock is None:
+            nSrcPerBlock = self.sourcesPerBlock(memoryBudgetMB=memoryBudgetMB)
+        nSrc  = self.ao.src.nSrc
+        table = {'zenith':nnp.asarray(cpuArray(self.ao.src.zenith)),'azimuth':nnp.asarray(cpuArray(self.ao.src.azimuth)),
+                 'SR':np.zeros((nSrc,self.freq.nWvl)),'FWHM':np.zeros((2,nSrc,self.freq.nWvl))}
+        
+        for k in range(0,nSrc,nSrcPerBlock):
+            src = nnp.arange(k,min(k+nSrcPerBlock,nSrc))
+            psd = self.powerSpectrumDensity(src=src)
+            if psd.shape[2] != len(src):
+                psd = np.repeat(psd,len(src),axis=2)
+            if self.ao.rtc.holoop['gain'] != 0:
+                for key,val in self.wavefrontErrors().items():
+                    if key not in table:
+                        table[key] = np.zeros(nSrc)
+                    table[key][src] = val
+            if self.halfPlane:
+                psd = FourierUtils.fullToHalfPlane(psd)
+            sf = self.phaseStructureFunction(halfPlane=self.halfPlane,psd=psd)
+            del psd
+            table['FWHM'][:,src], table['SR'][src] = self.evaluate(x0=x0,addOtfPixel=self.addOtfPixel,SF=sf,
+                                                                   src=src,metricsOnly=True)
+        
+        self.t_metricsTable = 1000*(time.time() - tstart)
+        return table
+    
     def __call__(self,x0,nPix=None):
         
-        psf,_ = self.pointSpreadFunction(x0=x0,nPix=nPix,verbose=False,fftphasor=True,addOtfPixel = self.addOtfPixel)
+        psf,_ = self.evaluate(x0=x0,nPix=nPix,addOtfPixel = self.addOtfPixel)
         return psf 
     
     
   #%% METRICS COMPUTATION
     def getPsfMetrics(self,getEnsquaredEnergy=False,getEncircledEnergy=False,getFWHM=False):
         tstart  = time.time()
-        self.FWHM = np.zeros((2,self.ao.src.nSrc,self.freq.nWvl))
-                    
-        if getEnsquaredEnergy==True:
-            self.EnsqE   = np.zeros((int(self.freq.nOtf/2)+1,self.ao.src.nSrc,self.freq.nWvl))
-        if getEncircledEnergy==True:
-            rr,radialprofile = FourierUtils.radial_profile(self.PSF[:,:,0,0])
-            self.EncE   = np.zeros((len(radialprofile),self.ao.src.nSrc,self.freq.nWvl))
-        for n in range(self.ao.src.nSrc):
-            for j in range(self.freq.nWvl):
-                if getFWHM == True:
-                    self.FWHM[:,n,j]  = FourierUtils.getFWHM(self.PSF[:,:,n,j],self.freq.psInMas[j],rebin=1,method='contour',nargout=2)
-                if getEnsquaredEnergy == True:
-                    self.EnsqE[:,n,j] = 1e2*FourierUtils.getEnsquaredEnergy(self.PSF[:,:,n,j])
-                if getEncircledEnergy == True:
-                    self.EncE[:,n,j]  = 1e2*FourierUtils.getEncircledEnergy(self.PSF[:,:,n,j])
-                        
+        metrics = self.psfMetrics(self.PSF,getEnsquaredEnergy=getEnsquaredEnergy,
+                                  getEncircledEnergy=getEncircledEnergy,getFWHM=getFWHM)
+        for key in metrics:
+            setattr(self,key,metrics[key])
         self.t_getPsfMetrics = 1000*(time.time() - tstart)
+    
+    def psfMetrics(self,PSF,getEnsquaredEnergy=False,getEncircledEnergy=False,getFWHM=False):
+        """ Returns the dictionary of the FWHM, ensquared and encircled energies of a nPix x nPix x nSrc x nWvl 
+        PSF cube, without modifying the model. The metrics are computed at once over the cube, see metricsUtils.
+        """
+        nSrc    = PSF.shape[2]
+        metrics = {'FWHM':np.zeros((2,nSrc,self.freq.nWvl))}
+        if getFWHM == True:
+            metrics['FWHM'] = metricsUtils.getFWHM(PSF,nnp.asarray(cpuArray(self.freq.psInMas)))
+        if getEnsquaredEnergy == True:
+            metrics['EnsqE'] = 1e2*metricsUtils.getEnsquaredEnergy(PSF)
+        if getEncircledEnergy == True:
+            metrics['EncE'] = 1e2*metricsUtils.getEncircledEnergy(PSF)
+        return metrics
 
 #%% DISPLAY
                 
@@ -1224,11 +1998,16 @@ class fourierModel:
         print("Required time for AO system model init (ms)\t : {:f}".format(self.t_initAO))
         if self.ao.error == False:
             print("Required time for frequency domain init (ms)\t : {:f}".format(self.t_initFreq))
-            print("Required time for final PSD calculation (ms)\t : {:f}".format(self.t_powerSpectrumDensity))
+            # in streaming mode, the PSD is not computed at the instantiation
+            computedPSD = hasattr(self,'t_powerSpectrumDensity')
+            if computedPSD:
+                print("Required time for final PSD calculation (ms)\t : {:f}".format(self.t_powerSpectrumDensity))
 
             # Reconstructors
             if self.ao.rtc.holoop['gain'] > 0:
-                print("Required time for WFS reconstructors init (ms)\t : {:f}".format(self.t_reconstructor))
+                # the tomographic systems only compute the reconstruction filter with the PSD
+                if hasattr(self,'t_reconstructor'):
+                    print("Required time for WFS reconstructors init (ms)\t : {:f}".format(self.t_reconstructor))
                 if self.nGs > 1:
                     print("Required time for optimization init (ms)\t : {:f}".format(self.t_finalReconstructor))
                     print("Required time for tomography init (ms)\t\t : {:f}".format(self.t_tomo))
@@ -1236,10 +2015,11 @@ class fourierModel:
                 # Controller
                 print("Required time for controller instantiation (ms)\t : {:f}".format(self.t_controller))
                 # PSD
-                print("Required time for fitting PSD calculation (ms)\t : {:f}".format(self.t_fittingPSD))
-                print("Required time for aliasing PSD calculation (ms)\t : {:f}".format(self.t_aliasingPSD))
-                print("Required time for noise PSD calculation (ms)\t : {:f}".format(self.t_noisePSD))
-                print("Required time for ST PSD calculation (ms)\t : {:f}".format(self.t_spatioTemporalPSD))
+                if computedPSD:
+                    print("Required time for fitting PSD calculation (ms)\t : {:f}".format(self.t_fittingPSD))
+                    print("Required time for aliasing PSD calculation (ms)\t : {:f}".format(self.t_aliasingPSD))
+                    print("Required time for noise PSD calculation (ms)\t : {:f}".format(self.t_noisePSD))
+                    print("Required time for ST PSD calculation (ms)\t : {:f}".format(self.t_spatioTemporalPSD))
                 if hasattr(self,"t_focalAnisoplanatism"):
                     print("Required time for focal Aniso PSD calculation (ms)\t : {:f}".format(self.t_focalAnisoplanatism))
                 
@@ -1257,3 +2037,5 @@ class fourierModel:
                     
             if self.calcPSF:
                 print("Required time for all PSFs calculation (ms)\t : {:f}".format(self.t_getPSF))
+            if self.metricsOnly:
+                print("Required time for the metrics table (ms)\t : {:f}".format(self.t_metricsTable))
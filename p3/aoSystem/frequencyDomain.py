@@ -17,8 +17,10 @@ else:
     np = cp
 
 import p3.aoSystem.FourierUtils as FourierUtils
+import p3.aoSystem.diskCache as diskCache
 from p3.aoSystem.anisoplanatismModel import anisoplanatism_structure_function
 import time
+import copy
 
 #%%
 rad2mas = 3600 * 180 * 1000 / np.pi
@@ -73,6 +75,17 @@ class frequencyDomain():
             self.PSDstep= np.min(self.psInMas/self.wvl_/rad2mas)
         self.PSDstep= np.asarray(self.PSDstep)
 
+    # ANISOPLANATISM STRUCTURE FUNCTIONS PER LAYER
+    @property
+    def dani_ang(self):
+        return self.stackedLayers('dani_ang')
+    @property
+    def dani_focang(self):
+        return self.stackedLayers('dani_focang')
+    @property
+    def dani_tt(self):
+        return self.stackedLayers('dani_tt')
+
     @property
     def sampCen(self):
         return self.__sampCen
@@ -190,7 +203,11 @@ class frequencyDomain():
         self.U_, self.V_, self.U2_, self.V2_, self.UV_=  FourierUtils.instantiateAngularFrequencies(self.nOtf,fact=2)
               
         # COMPUTING THE STATIC OTF IF A PHASE MAP IS GIVEN
-        self.otfNCPA, self.otfDL, self.phaseMap = FourierUtils.getStaticOTF(self.ao.tel,self.nOtf,self.sampRef,self.wvlRef)
+        tel  = self.ao.tel
+        key  = diskCache.cacheKey(tel.pupil,tel.apodizer,tel.opdMap_on,tel.statModes,self.nOtf,self.sampRef,self.wvlRef)
+        otfs = diskCache.cachedArrays('staticOTF',key,lambda: dict(zip(['otfNCPA','otfDL','phaseMap'],
+                                      FourierUtils.getStaticOTF(tel,self.nOtf,self.sampRef,self.wvlRef))))
+        self.otfNCPA, self.otfDL, self.phaseMap = otfs['otfNCPA'], otfs['otfDL'], otfs['phaseMap']
         self.totf = 1000*(time.time()-t0)
         
         # ANISOPLANATISM PHASE STRUCTURE FUNCTION
@@ -228,21 +245,72 @@ class frequencyDomain():
                 return None
             else:
                 self.isAniso = True
-                self.dani_ang = \
-                anisoplanatism_structure_function(self.ao.tel,self.ao.atm,self.ao.src,
-                                                self.ao.ngs,self.ao.ngs,self.nOtf,
-                                                self.sampRef,self.ao.dms.nActu1D)
-                return (self.dani_ang *Cn2[np.newaxis,:,np.newaxis,np.newaxis]).sum(axis=1)
+                self.daniRows, self.daniStacks = self.anisoplanatismLayers(self.ao.ngs,self.ao.ngs), {}
+                return self.weightedLayers(['dani_ang'],Cn2)
         
         elif self.ao.aoMode == 'SLAO':
             # LGS case : focal-angular  + anisokinetism
             self.isAniso = True
-            self.dani_focang,self.dani_ang,self.dani_tt = \
-            anisoplanatism_structure_function(self.ao.tel,self.ao.atm,self.ao.src,
-                                            self.ao.lgs,self.ao.ngs,self.nOtf,
-                                            self.sampRef,self.ao.dms.nActu1D)#self.trs.mat.Hdm)
-                
-            return ( (self.dani_focang + self.dani_tt) *Cn2[np.newaxis,:,np.newaxis,np.newaxis]).sum(axis=1)
+            self.daniRows, self.daniStacks = self.anisoplanatismLayers(self.ao.lgs,self.ao.ngs), {}
+            return self.weightedLayers(['dani_focang','dani_tt'],Cn2)
         else:
             self.isAniso = False
             return None
+    
+    def reweightAnisoplanatism(self):
+        """ Updates the anisoplanatism structure function for the current r0 and Cn2 weights of the atmosphere,
+        from the per-layer structure functions of the anisoplanatism library, which do not depend on them.
+        """
+        if self.dphi_ani is None:
+            return
+        Cn2   = self.ao.atm.weights * self.ao.atm.r0**(-5/3)
+        names = ['dani_focang','dani_tt'] if 'dani_focang' in self.daniRows else ['dani_ang']
+        self.dphi_ani = self.weightedLayers(names,Cn2)
+    
+    def weightedLayers(self,names,Cn2):
+        """ Sum over the layers, weighted by Cn2, of the per-layer structure functions given by names, computed
+        source by source from the rows of the anisoplanatism library.
+        """
+        rows = (sum(self.daniRows[name][s] for name in names) for s in range(self.ao.src.nSrc))
+        return nnp.array([(r*Cn2[:,np.newaxis,np.newaxis]).sum(axis=0) for r in rows])
+    
+    def stackedLayers(self,name):
+        """ nSrc x nL x nOtf x nOtf array of the per-layer structure functions of the anisoplanatism library,
+        stacked from its rows at the first access only.
+        """
+        if name not in getattr(self,'daniRows',{}):
+            raise AttributeError(name)
+        if name not in self.daniStacks:
+            self.daniStacks[name] = nnp.array(self.daniRows[name])
+        return self.daniStacks[name]
+    
+    def anisoplanatismLayers(self,gs,ngs):
+        """ Per-layer anisoplanatism structure functions for a unit Cn2, as a dictionary of lists of nSrc rows
+        of size nL x nOtf x nOtf. They only depend on the geometry of the system and on the offsets of each source
+        to the guide stars, and form a library on disk with one entry per source, whose rows are memory-mapped
+        (see diskCache.cachedRows) : only the sources missing from the library are computed.
+        """
+        tel = self.ao.tel
+        atm = self.ao.atm
+        src = self.ao.src
+        geometry = (tel.D,tel.obsRatio,tel.airmass,atm.heights,nnp.array([l.L0 for l in atm.layer]),self.nOtf,self.sampRef)
+        offGs    = src.direction - gs.direction
+        offNgs   = src.direction - ngs.direction
+        keys     = {'dani_ang':[diskCache.cacheKey(*geometry,offGs[:,s]) for s in range(src.nSrc)]}
+        if not ((gs==None) or (gs.height == 0)):
+            keys = {'dani_focang':[diskCache.cacheKey(*geometry,gs.height,offGs[:,s]) for s in range(src.nSrc)],
+                    'dani_ang':keys['dani_ang'],
+                    'dani_tt':[diskCache.cacheKey(*geometry,offNgs[:,s]) for s in range(src.nSrc)]}
+        
+        def compute(idx):
+            # structure functions of the missing sources only
+            sub = copy.copy(src)
+            sub.zenith  = nnp.atleast_1d(src.zenith)[idx]
+            sub.azimuth = nnp.atleast_1d(src.azimuth)[idx]
+            sub.nSrc    = len(idx)
+            dani = anisoplanatism_structure_function(tel,atm,sub,gs,ngs,self.nOtf,self.sampRef,self.ao.dms.nActu1D)
+            if not isinstance(dani,tuple):
+                dani = (dani,)
+            return dict(zip(keys,dani))
+        
+        return diskCache.cachedRows('anisoplanatism',keys,compute)
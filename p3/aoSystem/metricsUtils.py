@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Vectorized PSF metrics (FWHM, ensquared and encircled energies, Strehl-ratio) computed at once over
+cubes of PSFs. The images are given along the two first axes, and the metrics are returned for each
+image along the trailing axes (sources, wavelengths, ...). No figure is created, so the functions can
+run headless and in threads. Their results match the FourierUtils functions with the same name, which
+process a single image :
+    - getFWHM : 'contour' method, without interpolation (rebin=1)
+    - getEnsquaredEnergy : boxes centered on the maximum of each image
+    - getEncircledEnergy : disks centered on the center of the image, in steps of one pixel
+    - getStrehl : 'max' method, with the diffraction-limited PSF given at the same sampling
+"""
+
+import numpy as np
+from p3.aoSystem.FourierUtils import cpuArray
+
+def getFWHM(psf,pixelScale=1):
+    """ Largest and smallest FWHM (2 x ...) of the half-maximum contours of a cube of PSFs.
+    The contour vertices are the crossings of the half-maximum along the rows and the columns of each
+    image, linearly interpolated between pixels, as in the marching squares algorithm. The FWHM are
+    twice the largest and the smallest distance of the vertices to the center of their bounding box.
+    All the crossings are used, so the PSFs must have a single core above their half-maximum.
+    pixelScale is broadcast against the trailing axes of psf.
+    """
+    psf  = np.asarray(cpuArray(psf),dtype=float)
+    d    = psf - psf.max(axis=(0,1))/2
+    # there is no crossing out of the bounding box of the pixels above the half-maximum, plus one pixel
+    above = (d >= 0).reshape(d.shape[:2] + (-1,)).any(axis=2)
+    rows  = np.where(above.any(axis=1))[0]
+    cols  = np.where(above.any(axis=0))[0]
+    y0,x0 = max(rows[0]-1,0), max(cols[0]-1,0)
+    d     = d[y0:rows[-1]+2,x0:cols[-1]+2]
+    x, y, isC = [], [], []
+    # crossings along the columns (edges between rows i and i+1) and along the rows
+    for d0,d1,dy,dx in [(d[:-1],d[1:],1,0),(d[:,:-1],d[:,1:],0,1)]:
+        c = (d0 >= 0) != (d1 >= 0)
+        with np.errstate(divide='ignore',invalid='ignore'):
+            t = np.where(c,d0/np.where(c,d0 - d1,1),0)
+        i,j = np.indices(d0.shape[:2],dtype=float).reshape((2,) + d0.shape[:2] + (1,)*(psf.ndim-2))
+        x.append((x0 + j + dx*t).reshape((-1,) + psf.shape[2:]))
+        y.append((y0 + i + dy*t).reshape((-1,) + psf.shape[2:]))
+        isC.append(c.reshape((-1,) + psf.shape[2:]))
+    x, y, isC = np.concatenate(x), np.concatenate(y), np.concatenate(isC)
+    
+    # center of the bounding box of the contour and distances of its vertices
+    cx = (np.where(isC,x,-np.inf).max(axis=0) + np.where(isC,x,np.inf).min(axis=0))/2
+    cy = (np.where(isC,y,-np.inf).max(axis=0) + np.where(isC,y,np.inf).min(axis=0))/2
+    r  = np.hypot(x - cx,y - cy)
+    return 2*np.array([np.where(isC,r,-np.inf).max(axis=0),np.where(isC,r,np.inf).min(axis=0)])*pixelScale
+
+def getEnsquaredEnergy(psf):
+    """ Ensquared energy ((nMax+1) x ...) of a cube of PSFs in boxes of (2n+1) x (2n+1) pixels centered on the
+    maximum of each image, for n = 0 to nMax = min(nY,nX)//2, normalized by the total energy. The boxes
+    are clipped to the image, and their sums are obtained from the summed-area table of the images.
+    """
+    psf   = np.asarray(cpuArray(psf),dtype=float)
+    nY,nX = psf.shape[:2]
+    shape = psf.shape[2:]
+    psf   = psf.reshape(nY,nX,-1)
+    m     = psf.shape[2]
+    # summed-area table : sat[y,x] is the sum of psf[:y,:x]
+    sat   = np.zeros((nY+1,nX+1,m))
+    sat[1:,1:] = psf.cumsum(axis=0).cumsum(axis=1)
+    y0,x0 = np.unravel_index(psf.reshape(nY*nX,m).argmax(axis=0),(nY,nX))
+    n     = np.arange(min(nY,nX)//2 + 1)[:,np.newaxis]
+    y1,y2 = np.clip(y0 - n,0,nY), np.clip(y0 + n + 1,0,nY)
+    x1,x2 = np.clip(x0 - n,0,nX), np.clip(x0 + n + 1,0,nX)
+    k     = np.arange(m)
+    EE    = sat[y2,x2,k] - sat[y1,x2,k] - sat[y2,x1,k] + sat[y1,x1,k]
+    return (EE/sat[-1,-1]).reshape((len(n),) + shape)
+
+def getEncircledEnergy(psf):
+    """ Encircled energy of a cube of PSFs in disks centered on the center of the images, of radius
+    1 to nR-1 pixels, where nR-1 is the largest integer radius of the image. This is the ee output of
+    FourierUtils.radial_profile. The sums over the rings are computed for all the images with a
+    single bincount.
+    """
+    psf   = np.nan_to_num(np.asarray(cpuArray(psf),dtype=float))
+    nY,nX = psf.shape[:2]
+    shape = psf.shape[2:]
+    psf   = psf.reshape(nY*nX,-1)
+    m     = psf.shape[1]
+    y,x   = np.indices((nY,nX),dtype=float)
+    ri    = np.hypot(x - (nX-1)/2,y - (nY-1)/2).astype(int).ravel()
+    nR    = ri.max() + 1
+    idx   = ri[:,np.newaxis] + nR*np.arange(m)[np.newaxis,:]
+    rings = np.bincount(idx.ravel(),weights=psf.ravel(),minlength=nR*m).reshape(m,nR).T
+    return rings.cumsum(axis=0)[:nR-1].reshape((nR-1,) + shape)
+
+def getStrehl(psf,psfDL):
+    """ Strehl-ratio of a cube of PSFs from the ratio of the peak-to-flux ratios of the PSFs and of the
+    diffraction-limited PSF psfDL, given at the same sampling and broadcast against psf. The negative
+    values of psf are ignored.
+    """
+    psf   = np.maximum(np.asarray(cpuArray(psf),dtype=float),0)
+    psfDL = np.asarray(cpuArray(psfDL),dtype=float)
+    return psf.max(axis=(0,1))/psf.sum(axis=(0,1)) * psfDL.sum(axis=(0,1))/psfDL.max(axis=(0,1))
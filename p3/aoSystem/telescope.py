@@ -20,6 +20,10 @@ from astropy.io import fits
 import os.path as ospath
 import re
 import p3.aoSystem.FourierUtils as FourierUtils
+import p3.aoSystem.diskCache as diskCache
+
+def isFitsFile(path):
+    return path != None and path != '' and ospath.isfile(path) == True and re.search(".fits",path)!=None
 
 class Attribute(object):
     pass
@@ -81,76 +85,99 @@ class telescope:
         self.extraErrorExp   = extraErrorExp
         self.extraErrorMin   = extraErrorMin
         
+        #----- PUPIL, STATIC ABERRATIONS, APODIZER AND MODES
+        # read from the .fits files once per content, then from the cache
+        print(path_apodizer)
+        paths = [path_pupil, path_static_on, path_apodizer, path_statModes]
+        key   = diskCache.cacheKey(D,resolution,obsRatio,pupilAngle,*[diskCache.fileKey(p) for p in paths])
+        maps  = diskCache.cachedArrays('telescope',key,lambda: self.readPupilMaps(*paths))
+        self.pupil     = np.asarray(maps['pupil'])
+        self.opdMap_on = maps['opdMap_on']
+        self.apodizer  = maps['apodizer']
+        self.statModes = maps['statModes']
+        self.verb      = isFitsFile(path_pupil)
+        if not isFitsFile(path_pupil):
+            self.path_pupil = ''
+        if not isFitsFile(path_static_on):
+            self.path_static_on = ''
+        if not isFitsFile(path_apodizer):
+            self.path_apodizer = ''
+        if self.statModes is None:
+            self.nModes = 0
+            self.path_statModes = ''
+        else:
+            self.nModes = self.statModes.shape[-1]
+            
+        #----- FIELD-DEPENDANT STATIC ABERRATIONS
+        if path_static_off != None and ospath.isfile(path_static_off) == True and re.search(".fits",path_static_off)!=None:   
+            if path_static_pos != None and ospath.isfile(path_static_pos) == True and re.search(".fits",path_static_pos)!=None:   
+                opdMap_off = np.asarray(fits.getdata(path_static_off))
+                opdMap_pos = np.asarray(fits.getdata(path_static_pos))
+                if opdMap_pos.shape[0] != opdMap_off[0]:
+                    raise ValueError('You must provide as many positions values as maps')
+                else:
+                    self.opdMap_off = opdMap_off
+                    self.opdMap_pos = opdMap_pos
+            else:
+                raise ValueError('Positions (zenith in arcsec, azimuth in radian) of the field-dependent aberrations must be provided as well as the maps')
+        else:
+            self.opdMap_off = None #center of the fov
+            self.opdMap_pos = None #center of the fov
+            self.path_static_off= ''
+            self.path_static_pos= ''
+            
+        if self.verbose:
+            self
+                   
+            
+    def readPupilMaps(self,path_pupil='',path_static_on='',path_apodizer='',path_statModes=''):
+        """ Reads, rotates and resamples the pupil, the static aberrations map, the apodizer and the 
+        static modes from .fits files. Returns them in a dictionary.
+        """
         #----- PUPIL DEFINITION        
         
+        resolution = self.resolution
         pupil = [] 
-        if path_pupil!= '' and ospath.isfile(path_pupil) == True and re.search(".fits",path_pupil)!=None:
-            self.verb = True
+        if isFitsFile(path_pupil):
             pupil = np.asarray(fits.getdata(path_pupil))
             pupil[pupil!=pupil] = 0
             if self.pupilAngle !=0.0:
                 pupil = rotate(pupil,self.pupilAngle,reshape=False)
             if pupil.shape[0] != resolution:
                 pupil = FourierUtils.interpolateSupport(pupil,resolution,kind='linear')
-            self.pupil = pupil
         else:
             # build an annular pupil model
             th  = self.pupilAngle*np.pi/180
-            x   = np.linspace(-D/2,D/2,resolution)
+            x   = np.linspace(-self.D/2,self.D/2,resolution)
             X,Y = np.meshgrid(x,x)
             Xr  = X*np.cos(th) + Y*np.sin(th)
             Yr  = Y*np.cos(th) - X*np.sin(th)
             R   = np.hypot(Xr,Yr)
-            P   = (R <= self.R) * (R > self.R*self.obsRatio)
-            self.pupil = P
-            self.verb = False
-            self.path_pupil= ''
+            pupil = (R <= self.R) * (R > self.R*self.obsRatio)
     
     
         #----- NCPA
         
-        if path_static_on != None and ospath.isfile(path_static_on) == True and re.search(".fits",path_static_on)!=None:
-            self.opdMap_on = np.asarray(fits.getdata(path_static_on))
-            self.opdMap_on[self.opdMap_on!=self.opdMap_on] = 0
+        opdMap_on = None
+        if isFitsFile(path_static_on):
+            opdMap_on = np.asarray(fits.getdata(path_static_on))
+            opdMap_on[opdMap_on!=opdMap_on] = 0
             if self.pupilAngle !=0.0:
-                self.opdMap_on = rotate(self.opdMap_on,self.pupilAngle,reshape=False)
-            self.opdMap_on = FourierUtils.interpolateSupport(self.opdMap_on,resolution,kind='linear')
-        else:
-            self.opdMap_on = None
-            self.path_static_on= ''
-            
-        #----- FIELD-DEPENDANT STATIC ABERRATIONS
-        if path_static_off != None and ospath.isfile(path_static_off) == True and re.search(".fits",path_static_off)!=None:   
-            if path_static_pos != None and ospath.isfile(path_static_pos) == True and re.search(".fits",path_static_pos)!=None:   
-                opdMap_off = np.asarray(fits.getdata(path_static_off))
-                opdMap_pos = np.asarray(fits.getdata(path_static_pos))
-                if opdMap_pos.shape[0] != opdMap_off[0]:
-                    raise ValueError('You must provide as many positions values as maps')
-                else:
-                    self.opdMap_off = opdMap_off
-                    self.opdMap_pos = opdMap_pos
-            else:
-                raise ValueError('Positions (zenith in arcsec, azimuth in radian) of the field-dependent aberrations must be provided as well as the maps')
-        else:
-            self.opdMap_off = None #center of the fov
-            self.opdMap_pos = None #center of the fov
-            self.path_static_off= ''
-            self.path_static_pos= ''
+                opdMap_on = rotate(opdMap_on,self.pupilAngle,reshape=False)
+            opdMap_on = FourierUtils.interpolateSupport(opdMap_on,resolution,kind='linear')
             
         #----- APODIZER
-        print(path_apodizer)
-        if path_apodizer!= '' and ospath.isfile(path_apodizer) and re.search(".fits",path_apodizer)!=None:
-            self.apodizer = np.asarray(fits.getdata(path_apodizer))
-            self.apodizer[self.apodizer!=self.apodizer] = 0
+        apodizer = 1.0
+        if isFitsFile(path_apodizer):
+            apodizer = np.asarray(fits.getdata(path_apodizer))
+            apodizer[apodizer!=apodizer] = 0
             if self.pupilAngle !=0.0:
-                self.apodizer = rotate(self.apodizer,self.pupilAngle,reshape=False)
-            self.apodizer = FourierUtils.interpolateSupport(self.apodizer,resolution,kind='linear')
-        else:
-            self.apodizer = 1.0
-            self.path_apodizer = ''
+                apodizer = rotate(apodizer,self.pupilAngle,reshape=False)
+            apodizer = FourierUtils.interpolateSupport(apodizer,resolution,kind='linear')
             
         #----- MODAL BASIS FOR TELESCOPE ABERRATIONS
-        if path_statModes!='' and ospath.isfile(path_statModes) == True and re.search(".fits",path_statModes)!=None:                
+        statModes = None
+        if isFitsFile(path_statModes):
             statModes = np.asarray(fits.getdata(path_statModes))
             s1,s2,s3 = statModes.shape
             if s1 != s2: # mode on first dimension
@@ -158,23 +185,17 @@ class telescope:
             else:
                 tmp = statModes
                     
-            self.nModes = tmp.shape[-1]
-            self.statModes = np.zeros((resolution,resolution,self.nModes))
+            nModes = tmp.shape[-1]
+            statModes = np.zeros((resolution,resolution,nModes))
                 
-            for k in range(self.nModes):
+            for k in range(nModes):
                 mode = FourierUtils.interpolateSupport(tmp[:,:,k],resolution,kind='linear')
-                if pupilAngle !=0:
-                    mode = rotate(mode,pupilAngle,reshape=False)
-                self.statModes[:,:,k] = mode
-        else:
-            self.statModes = None
-            self.nModes = 0
-            self.path_statModes = ''
-            
-        if self.verbose:
-            self
-                   
+                if self.pupilAngle !=0:
+                    mode = rotate(mode,self.pupilAngle,reshape=False)
+                statModes[:,:,k] = mode
             
+        return {'pupil':pupil,'opdMap_on':opdMap_on,'apodizer':apodizer,'statModes':statModes}
+    
     def __repr__(self):
         s = "___TELESCOPE___\n -------------------------------------------------------------------------------- \n"
         s += '. Aperture diameter \t:%.2fm \n'%(self.D)
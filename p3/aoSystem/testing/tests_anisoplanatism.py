@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests of the focal-angular anisoplanatism structure function of a LGS at 90 km, on the telescope,
+atmosphere and science sources of MavisMCAO.ini :
+    - a LGS at infinity gives back the angular anisoplanatism of the NGS case
+    - the structure function is the pupil average of the seven-term expression, estimated by Monte-Carlo
+    - regression against reference values
+"""
+
+#%% IMPORTING LIBRARIES
+import copy
+import p3.aoSystem as aoSystemMain
+from p3.aoSystem.aoSystem import aoSystem
+from p3.aoSystem.source import source
+import p3.aoSystem.anisoplanatismModel as anisoplanatismModel
+import p3.aoSystem.FourierUtils as FourierUtils
+
+import numpy as np
+
+import unittest
+
+#%% TEST THE FOCAL-ANGULAR ANISOPLANATISM
+class TestFocalAnisoplanatism(unittest.TestCase):
+    # (source, layer, row, column) : reference value in rad^2 for a unit Cn2
+    reference = {(0,0,33,32):0.00017833754261622033,
+                 (0,9,40,20):3.687620041219542,
+                 (4,3,32,45):0.14822542795916616,
+                 (8,9,10,50):27.447593799063718,
+                 (8,5,50,50):3.4657591186680237}
+
+    @classmethod
+    def setUpClass(cls):
+        path_p3 = '/'.join(aoSystemMain.__file__.split('/')[0:-2])
+        cls.ao   = aoSystem(path_p3 + '/aoSystem/parFiles/MavisMCAO.ini')
+        cls.lgs  = source(589e-9,[0.0],[0.0],height=90e3,tag='LGS')
+        cls.nOtf = 64
+        cls.samp = 2.0
+        cls.dani = cls.structureFunction(cls.lgs)
+
+    @classmethod
+    def structureFunction(cls,gs):
+        ao = cls.ao
+        return anisoplanatismModel.angular_focal_anisoplanatism_phase_structure_function(ao.tel,ao.atm,ao.src,gs,cls.nOtf,
+                                                                                           cls.samp,ao.dms.nActu1D[0])
+
+    def test_lgs_at_infinity(self):
+        lgsInf = copy.copy(self.lgs)
+        lgsInf.height = np.array([1e12])
+        ngs = copy.copy(self.lgs)
+        ngs.height = 0
+        dInf, dNgs = self.structureFunction(lgsInf), self.structureFunction(ngs)
+        err = np.abs(dInf - dNgs).max()/np.abs(dNgs).max()
+        print('LGS at infinity',err)
+        self.assertLess(err,1e-4)
+
+    def test_pupil_average(self):
+        tel, atm, src = self.ao.tel, self.ao.atm, self.ao.src
+        x   = np.linspace(-tel.D*self.samp/2,tel.D*self.samp/2,self.nOtf)
+        f0  = 2*np.pi/atm.L0
+        cte = 0.12184*0.06*(2*np.pi)**2*atm.L0**(5/3)
+        I   = lambda v: FourierUtils.Ialpha(f0*v[...,0],f0*v[...,1])
+        # uniform points in the pupil
+        rng = np.random.default_rng(0)
+        r   = rng.uniform(-tel.D/2,tel.D/2,(200000,2))
+        rr  = np.hypot(r[:,0],r[:,1])
+        r   = r[(rr <= tel.D/2) & (rr >= tel.obsRatio*tel.D/2)]
+        for (s,l,i,j) in list(self.reference)[1:]:
+            zl  = atm.heights[l]*tel.airmass
+            g   = zl/self.lgs.height[0]
+            zt  = zl*np.array([src.direction[0][s] - self.lgs.direction[0][0],src.direction[1][s] - self.lgs.direction[1][0]])
+            rho = np.array([x[j],x[i]])
+            ri, rj = r - rho/2, r + rho/2
+            d = cte*(2*3/5 - I(rho) - I((1-g)*rho) - I(g*ri - zt).mean() - I(g*rj - zt).mean()
+                     + I(ri - (1-g)*rj - zt).mean() + I((1-g)*ri - rj + zt).mean())
+            print((s,l,i,j),'Monte-Carlo',d,'model',self.dani[s,l,i,j])
+            self.assertLess(abs(self.dani[s,l,i,j]/d - 1),2e-3)
+
+    def test_reference(self):
+        for idx,value in self.reference.items():
+            self.assertLess(abs(self.dani[idx]/value - 1),1e-8)
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(TestFocalAnisoplanatism('test_lgs_at_infinity'))
+    suite.addTest(TestFocalAnisoplanatism('test_pupil_average'))
+    suite.addTest(TestFocalAnisoplanatism('test_reference'))
+    return suite
+
+
+if __name__ == '__main__':
+    runner = unittest.TextTestRunner()
+    runner.run(suite())
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests of the field emulator on MAVIS : the science sources of the .ini file are aligned and can not be
+used as anchors, while 2-D anchors give back the exact structure functions at the anchors.
+"""
+
+#%% IMPORTING LIBRARIES
+import p3.aoSystem as aoSystemMain
+from p3.aoSystem.fieldEmulator import fieldEmulator
+
+import numpy as np
+
+import unittest
+
+#%% TEST THE ANCHORS GEOMETRY
+class TestFieldEmulator(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        path_p3 = '/'.join(aoSystemMain.__file__.split('/')[0:-2])
+        cls.path_ini = path_p3 + '/aoSystem/parFiles/MavisMCAO.ini'
+
+    def test_aligned_anchors(self):
+        with self.assertRaises(ValueError):
+            fieldEmulator(TestFieldEmulator.path_ini)
+
+    def test_anchors(self):
+        zenith  = [0,15,15,15,15]
+        azimuth = [0,0,90,180,270]
+        emu = fieldEmulator(TestFieldEmulator.path_ini,anchorZenith=zenith,anchorAzimuth=azimuth)
+        self.assertTrue(np.all(np.isfinite(emu.anchorErrors)))
+        sf, error, exact = emu.structureFunction(zenith[1:3],azimuth[1:3])
+        self.assertFalse(np.any(exact))
+        self.assertLess(error.max(),1e-10)
+        self.assertLess(np.abs(sf - emu.anchorSF[:,:,1:3]).max()/np.abs(emu.anchorSF).max(),1e-12)
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(TestFieldEmulator('test_aligned_anchors'))
+    suite.addTest(TestFieldEmulator('test_anchors'))
+    return suite
+
+
+if __name__ == '__main__':
+    runner = unittest.TextTestRunner()
+    runner.run(suite())
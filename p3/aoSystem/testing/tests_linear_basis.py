@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests of the linear PSD/SF basis : on a SCAO system, the re-evaluation of the basis for new r0 and
+noise variances must reproduce the PSF of update(), and leave the model untouched.
+"""
+
+#%% IMPORTING LIBRARIES
+import p3.aoSystem as aoSystemMain
+from p3.aoSystem.fourierModel import fourierModel
+
+import numpy as np
+
+import unittest
+
+#%% TEST THE BASIS ON NIRC2
+class TestLinearBasis(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        path_p3 = '/'.join(aoSystemMain.__file__.split('/')[0:-2])
+        cls.path_ini = path_p3 + '/aoSystem/parFiles/nirc2.ini'
+        cls.fao = fourierModel(cls.path_ini, calcPSF=True, verbose=False, display=False)
+
+    def test_reference(self):
+        fao = TestLinearBasis.fao
+        psd, sf, PSF, SR = fao.evaluateBasis(getPSF=True)
+        self.assertLess(np.abs(PSF - fao.PSF).max()/fao.PSF.max(),1e-12)
+
+    def test_update(self):
+        fao = TestLinearBasis.fao
+        psd, sf, PSF, SR = fao.evaluateBasis(r0=0.12,noiseVar=[0.3],getPSF=True)
+        ref = fourierModel(TestLinearBasis.path_ini, calcPSF=True, verbose=False, display=False)
+        ref.update(r0=0.12,noiseVar=[0.3])
+        print('PSF',np.abs(PSF - ref.PSF).max()/ref.PSF.max(),'SR',np.abs(SR - ref.SR).max())
+        self.assertLess(np.abs(PSF - ref.PSF).max()/ref.PSF.max(),1e-12)
+        self.assertLess(np.abs(SR - ref.SR).max(),1e-10)
+
+    def test_model_unchanged(self):
+        fao = TestLinearBasis.fao
+        atm = fao.ao.atm
+        r0, layerR0, weights = atm.r0, [l.r0 for l in atm.layer], list(atm.weights)
+        noiseVar, PSF = list(fao.ao.wfs.processing.noiseVar), fao.PSF.copy()
+        fao.evaluateBasis(r0=0.08,weights=np.ones(atm.nL)/atm.nL,noiseVar=[1.0],getPSF=True)
+        self.assertEqual(fao.ao.atm.r0,r0)
+        self.assertEqual([l.r0 for l in fao.ao.atm.layer],layerR0)
+        self.assertEqual(list(fao.ao.atm.weights),weights)
+        self.assertEqual(list(fao.ao.wfs.processing.noiseVar),noiseVar)
+        self.assertTrue(np.array_equal(fao.PSF,PSF))
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(TestLinearBasis('test_reference'))
+    suite.addTest(TestLinearBasis('test_update'))
+    suite.addTest(TestLinearBasis('test_model_unchanged'))
+    return suite
+
+
+if __name__ == '__main__':
+    runner = unittest.TextTestRunner()
+    runner.run(suite())
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests of the options of the Fourier model that must reproduce the default PSFs :
+    - halfPlane : to round-off
+    - precision='single' : to the precisionReport bounds (2e-7 on the PSF, 1e-7 on the Strehl-ratio)
+    - streaming, with the PSFs saved by path_save : to round-off (the FFTs run on smaller batches), and
+      the error breakdown of each block
+    - nRowsPerTile : bit-identical with the pinv solver, to 1e-8 with the eigh solver
+"""
+
+#%% IMPORTING LIBRARIES
+import io
+import os
+import contextlib
+import shutil
+import tempfile
+import p3.aoSystem as aoSystemMain
+from p3.aoSystem.fourierModel import fourierModel
+
+import numpy as np
+
+import unittest
+
+path_p3 = '/'.join(aoSystemMain.__file__.split('/')[0:-2])
+
+#%% TEST THE OPTIONS AGAINST THE DEFAULT MODEL
+class ModelOptionsChecks:
+    sysName = None
+
+    @classmethod
+    def setUpClass(cls):
+        cls.path_ini = path_p3 + '/aoSystem/parFiles/' + cls.sysName + '.ini'
+        cls.ref = cls.model()
+
+    @classmethod
+    def model(cls,verbose=False,**kwargs):
+        return fourierModel(cls.path_ini, calcPSF=True, verbose=verbose, display=False, **kwargs)
+
+    def compare(self,name,PSF,SR,tolPSF,tolSR):
+        errPSF = np.abs(PSF - self.ref.PSF).max()/self.ref.PSF.max()
+        errSR  = np.abs(SR - self.ref.SR).max()/np.abs(self.ref.SR).max()
+        print(self.sysName,name,'PSF',errPSF,'SR',errSR)
+        self.assertLessEqual(errPSF,tolPSF)
+        self.assertLessEqual(errSR,tolSR)
+
+    def test_halfPlane(self):
+        fao = self.model(halfPlane=True)
+        self.compare('halfPlane',fao.PSF,fao.SR,1e-12,1e-12)
+
+    def test_single(self):
+        fao = self.model(precision='single')
+        self.compare('single',fao.PSF,fao.SR,2e-7,1e-7)
+
+    def test_streaming(self):
+        fao     = self.model(streaming=True)
+        tmpDir  = tempfile.mkdtemp()
+        try:
+            path_save = os.path.join(tmpDir,'psf.npy')
+            PSF = np.zeros_like(self.ref.PSF)
+            SR  = np.zeros_like(self.ref.SR)
+            for block in fao.streamPointSpreadFunction(nSrcPerBlock=2,path_save=path_save):
+                PSF[:,:,block['src']] = block['PSF']
+                SR[block['src']]      = block['SR']
+            self.compare('streaming',PSF,SR,1e-14,1e-14)
+            self.assertTrue(np.array_equal(np.load(path_save),PSF))
+        finally:
+            shutil.rmtree(tmpDir,ignore_errors=True)
+
+    def test_streaming_verbose(self):
+        log = io.StringIO()
+        with contextlib.redirect_stdout(log):
+            fao = self.model(streaming=True,verbose=True,getErrorBreakDown=True)
+        self.assertIn('total calculation',log.getvalue())
+        self.assertFalse(fao.calcPSF)
+        # the error breakdown of each block is the one of the default model for these sources
+        wfe = self.ref.wavefrontErrors()
+        for block in fao.streamPointSpreadFunction(nSrcPerBlock=2):
+            err = np.abs(block['wfeTot'] - wfe['wfeTot'][block['src']]).max()/wfe['wfeTot'].max()
+            self.assertLess(err,1e-12)
+
+class TestModelOptionsNirc2(ModelOptionsChecks,unittest.TestCase):
+    sysName = 'nirc2'
+
+class TestModelOptionsMavis(ModelOptionsChecks,unittest.TestCase):
+    sysName = 'MavisMCAO'
+
+    def test_tiles(self):
+        fao = self.model(nRowsPerTile=16)
+        self.compare('nRowsPerTile',fao.PSF,fao.SR,0,0)
+
+    def test_tiles_eigh(self):
+        ref = self.model(solver='eigh')
+        fao = self.model(solver='eigh',nRowsPerTile=16)
+        err = np.abs(fao.PSF - ref.PSF).max()/ref.PSF.max()
+        print(self.sysName,'nRowsPerTile eigh','PSF',err)
+        self.assertLess(err,1e-8)
+
+def suite():
+    suite  = unittest.TestSuite()
+    loader = unittest.TestLoader()
+    for cls in [TestModelOptionsNirc2,TestModelOptionsMavis]:
+        suite.addTests(loader.loadTestsFromTestCase(cls))
+    return suite
+
+
+if __name__ == '__main__':
+    runner = unittest.TextTestRunner()
+    runner.run(suite())
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Regression tests of the solvers of the tomographic reconstructor and of the optimal projector : the
+'eigh' and 'cholesky' solvers must reproduce the truncated pseudo-inverse of the 'pinv' solver, also with
+fewer modelled layers than guide stars (Woodbury identity of the 'cholesky' solver).
+"""
+
+#%% IMPORTING LIBRARIES
+import copy
+import p3.aoSystem as aoSystemMain
+from p3.aoSystem.fourierModel import fourierModel
+from p3.aoSystem.atmosphere import atmosphere
+
+import numpy as np
+
+import unittest
+
+#%% TEST THE SOLVERS ON MAVIS
+class TestTomographicSolvers(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        path_p3 = '/'.join(aoSystemMain.__file__.split('/')[0:-2])
+        fullPathFilename = path_p3 + '/aoSystem/parFiles/MavisMCAO.ini'
+        cls.fao = {solver:fourierModel(fullPathFilename, calcPSF=True, verbose=False, display=False, solver=solver)
+                   for solver in ['pinv','eigh','cholesky']}
+
+    def compareSolver(self,solver):
+        ref = TestTomographicSolvers.fao['pinv']
+        fao = TestTomographicSolvers.fao[solver]
+        errW   = np.abs(fao.Wtomo - ref.Wtomo).max()/np.abs(ref.Wtomo).max()
+        errPSF = np.abs(fao.PSF - ref.PSF).max()/ref.PSF.max()
+        errSR  = np.abs(fao.SR - ref.SR).max()/np.abs(ref.SR).max()
+        print(solver,'Wtomo',errW,'PSF',errPSF,'SR',errSR)
+        self.assertLess(errW,1e-7)
+        self.assertLess(errPSF,1e-8)
+        self.assertLess(errSR,1e-8)
+
+    def test_eigh(self):
+        self.compareSolver('eigh')
+
+    def test_cholesky(self):
+        self.compareSolver('cholesky')
+
+    def test_cholesky_woodbury(self):
+        fao = copy.copy(TestTomographicSolvers.fao['cholesky'])
+        atm = fao.ao.atm
+        fao.atm_mod = atmosphere(atm.wvl,atm.r0,[0.6,0.3,0.1],[0.0,5e3,12e3],[10.0]*3,[0.0]*3,atm.L0)
+        fao.strechFactor_mod = np.ones(3)
+        ref = fao.tomographicReconstructor(solver='pinv')
+        for solver in ['eigh','cholesky']:
+            err = np.abs(fao.tomographicReconstructor(solver=solver) - ref).max()/np.abs(ref).max()
+            print('3 modelled layers',solver,'Wtomo',err)
+            self.assertLess(err,1e-7)
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(TestTomographicSolvers('test_eigh'))
+    suite.addTest(TestTomographicSolvers('test_cholesky'))
+    suite.addTest(TestTomographicSolvers('test_cholesky_woodbury'))
+    return suite
+
+
+if __name__ == '__main__':
+    runner = unittest.TextTestRunner()
+    runner.run(suite())
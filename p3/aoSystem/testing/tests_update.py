@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests of fourierModel.update : a model updated for new zenith angle, seeing, r0, loop gain, wind speeds,
+noise variances or science sources must reproduce the PSD, the structure function, the PSF and the
+Strehl-ratio of a model built from the .ini file modified accordingly. eris is also run as a SLAO system
+with off-axis science sources, whose anisoplanatism structure function is reweighted for r0 changes.
+"""
+
+#%% IMPORTING LIBRARIES
+import os
+import ast
+import shutil
+import tempfile
+import configparser
+import pathlib
+import p3.aoSystem as aoSystemMain
+
+from p3.aoSystem.fourierModel import fourierModel
+
+import numpy as np
+
+import unittest
+
+path_ao = str(pathlib.Path(aoSystemMain.__file__).parent.absolute())
+path_p3 = str(pathlib.Path(aoSystemMain.__file__).parent.parent.absolute())
+rad2arc = 3600*180/np.pi
+
+#%% TEST THE UPDATES AGAINST MODIFIED .INI FILES
+class UpdateChecks:
+    sysName   = None
+    # modifications of the .ini file of the system defining the reference configuration
+    overrides = {}
+    tol       = 1e-10
+
+    @classmethod
+    def setUpClass(cls):
+        cls.path_ini = path_ao + '/parFiles/' + cls.sysName + '.ini'
+        cls.tmpDir   = tempfile.mkdtemp()
+        cls.config   = configparser.ConfigParser()
+        cls.config.optionxform = str
+        cls.config.read(cls.path_ini)
+        if cls.overrides:
+            for (section,key),v in cls.overrides.items():
+                cls.config.set(section,key,str(v))
+            cls.path_ini = os.path.join(cls.tmpDir,cls.sysName + '_reference.ini')
+            with open(cls.path_ini,'w') as f:
+                cls.config.write(f)
+        cls.PSF0     = cls.model(cls.path_ini).PSF
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmpDir,ignore_errors=True)
+
+    @staticmethod
+    def model(path_ini):
+        return fourierModel(path_ini, path_root=path_p3, calcPSF=True, verbose=False, display=False)
+
+    def value(self,section,key):
+        return ast.literal_eval(self.config.get(section,key))
+
+    def modifiedIni(self,changes):
+        config = configparser.ConfigParser()
+        config.optionxform = str
+        config.read(self.path_ini)
+        for (section,key),v in changes.items():
+            config.set(section,key,str(v))
+        path = os.path.join(self.tmpDir,self.sysName + '.ini')
+        with open(path,'w') as f:
+            config.write(f)
+        return path
+
+    def compareUpdate(self,params,changes):
+        fao = self.model(self.path_ini)
+        fao.update(**params)
+        ref = self.model(self.modifiedIni(changes))
+        for name in ['PSD','SF','PSF','SR']:
+            a, b = getattr(fao,name), getattr(ref,name)
+            err  = np.abs(a - b).max()/np.abs(b).max()
+            print(self.sysName,params,name,err)
+            self.assertLess(err,self.tol)
+        # the modified parameters must change the PSF
+        if ref.PSF.shape == self.PSF0.shape:
+            self.assertGreater(np.abs(ref.PSF - self.PSF0).max()/ref.PSF.max(),1e-6)
+        return fao
+
+    def test_zenith(self):
+        self.compareUpdate({'zenith_angle':40.0},{('telescope','ZenithAngle'):40.0})
+
+    def test_seeing(self):
+        fao = self.compareUpdate({'seeing':0.9},{('atmosphere','Seeing'):0.9})
+        # the anisoplanatism structure function of the frequency domain is only reweighted
+        self.assertNotIn('freq',fao.updatedStages)
+
+    def test_r0(self):
+        # line-of-sight r0 at 500 nm of a 0.9 arcsec seeing
+        fao = self.model(self.path_ini)
+        r0  = 0.976*fao.wvlAtm/0.9*rad2arc * fao.ao.tel.airmass**(-3/5) * (500e-9/fao.wvlAtm)**1.2
+        fao = self.compareUpdate({'r0':r0},{('atmosphere','Seeing'):0.9})
+        self.assertNotIn('freq',fao.updatedStages)
+
+    def test_gain(self):
+        self.compareUpdate({'gain':0.3},{('RTC','LoopGain_HO'):0.3})
+
+    def test_wind(self):
+        wSpeed = [2*w for w in self.value('atmosphere','WindSpeed')]
+        self.compareUpdate({'wSpeed':wSpeed},{('atmosphere','WindSpeed'):wSpeed})
+
+    def test_noise(self):
+        nWfs     = len(self.value('sources_HO','Zenith'))
+        noiseVar = [0.2]*nWfs
+        self.compareUpdate({'noiseVar':noiseVar},{('sensor_HO','NoiseVariance'):noiseVar})
+
+    def test_sources(self):
+        zenith, azimuth = [0.0,10.0], [0.0,45.0]
+        self.compareUpdate({'srcZenith':zenith,'srcAzimuth':azimuth},
+                           {('sources_science','Zenith'):zenith,('sources_science','Azimuth'):azimuth})
+
+class TestUpdateErisLGS(UpdateChecks,unittest.TestCase):
+    # SLAO system with off-axis science sources
+    sysName   = 'eris'
+    overrides = {('sources_HO','Height'):90e3,('sources_LO','Zenith'):[5.0],
+                 ('sources_science','Zenith'):[0.0,5.0],('sources_science','Azimuth'):[0.0,90.0],
+                 ('atmosphere','Cn2Weights'):[0.6,0.3,0.1],('atmosphere','Cn2Heights'):[0.0,5e3,12e3],
+                 ('atmosphere','WindSpeed'):[10.0,15.0,20.0],('atmosphere','WindDirection'):[0.0,0.0,90.0],
+                 ('DM','NumberReconstructedLayers'):3}
+
+class TestUpdateNirc2(UpdateChecks,unittest.TestCase):
+    sysName = 'nirc2'
+
+class TestUpdateMavis(UpdateChecks,unittest.TestCase):
+    sysName = 'MavisMCAO'
+
+class TestUpdateEris(UpdateChecks,unittest.TestCase):
+    sysName = 'eris'
+
+def suite():
+    suite  = unittest.TestSuite()
+    loader = unittest.TestLoader()
+    for cls in [TestUpdateNirc2,TestUpdateMavis,TestUpdateEris,TestUpdateErisLGS]:
+        suite.addTests(loader.loadTestsFromTestCase(cls))
+    return suite
+
+
+if __name__ == '__main__':
+    runner = unittest.TextTestRunner()
+    runner.run(suite())
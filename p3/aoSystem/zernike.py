@@ -8,9 +8,8 @@ Created on Thu Jan 28 11:21:10 2021
 
 #%% MANAGE PYTHON LIBRAIRIES
 import numpy as np
-import math
 import scipy.special as ssp
-from scipy import integrate
+import p3.aoSystem.diskCache as diskCache
 
 #%% CLASS DEFINITION
 class zernike:
@@ -120,59 +119,65 @@ class zernike:
         angle. The radius must be normalized to 1.
         '''
         
-        def R_fun(r,n,m):
-            R = np.zeros(r.shape)
-            s1 = int( (n + m)/2 )
-            s2 = int( (n - m)/2 )
-
-            for s in range(s2+1):
-                ff = math.factorial(s) * math.factorial(max(0,s1-s)) * math.factorial(max(0,s2-s))
-                ff = math.factorial(int(n-s))/ff
-                R += (-1)**s * ff * r**(n-2*s)
-                
-            return R
-        
         if len(self.radius)==0 or len(self.angle)==0 :
             return []
-        else:
-            nv      = self.n
-            mv      = self.m
-            nf      = self.nModes
-            pupLog  = self.pupil
-            modes   = np.zeros((nf,self.resolution,self.resolution))
-            r       = self.radius[pupLog]
-            o       = self.angle[pupLog]
-            
-            # Null azimuthal order
-            ind_m = np.argwhere(mv==0)
-            if len(ind_m) > 0:
-                for cpt in ind_m:
-                    n = nv[cpt]
-                    m = mv[cpt]
-                    modes[int(cpt),pupLog] = np.sqrt(n+1)*R_fun(r,n,m)
-                
-            mod_mode = np.asarray(self.jIndex).astype('int')%2
-            
-            # Even polynomes
-            ind_m = np.argwhere(np.logical_and(np.logical_not(mod_mode),mv)) 
-            if len(ind_m) > 0:
-                for cpt in ind_m:
-                    n = int(nv[cpt])
-                    m = int(mv[cpt])
-                    modes[int(cpt),pupLog] = np.sqrt(n+1)*R_fun(r,n,m)*np.sqrt(2)*np.cos(m*o)
-                
-           # Odd polynomes
-            ind_m = np.argwhere(np.logical_and(mod_mode,mv))
-            if len(ind_m) > 0:
-                for cpt in ind_m:
-                    n = int(nv[cpt])
-                    m = int(mv[cpt])
-                    modes[int(cpt),pupLog] = np.sqrt(n+1)*R_fun(r,n,m)*np.sqrt(2)*np.sin(m*o)     
+        
+        # the polynomials only depend on the Noll indexes and on the sampling of the pupil
+        pupLog = np.asarray(self.pupil).astype(bool)
+        key    = diskCache.cacheKey(np.asarray(self.jIndex).astype('int'),pupLog,np.asarray(self.radius),np.asarray(self.angle))
+        modes  = diskCache.cachedArrays('zernike',key,lambda: {'modes':self.computePolynomials(pupLog)})['modes']
                 
         if unitNorm:
             modes = modes * np.diag(1/self.nollNorm)
         
         return modes    
+    
+    def computePolynomials(self,pupLog):
+        '''
+        Zernike polynomials on the pupil pupLog. The radial polynomials of all the orders up to the
+        largest one are computed in a single pass of the recurrence of Prata and Rusch (1989)
+        R_n^m = r*(R_(n-1)^|m-1| + R_(n-1)^(m+1)) - R_(n-2)^m, with R_n^n = r^n, which is stable for
+        r <= 1, and the azimuthal terms once for each azimuthal order.
+        '''
+        nv     = self.n.astype(int)
+        mv     = self.m.astype(int)
+        modes  = np.zeros((self.nModes,self.resolution,self.resolution))
+        r      = self.radius[pupLog]
+        o      = self.angle[pupLog]
+        
+        # radial polynomials : the rows of orders n-2 and n-1 are kept for the recurrence
+        R      = {}
+        prev2  = {}
+        prev1  = {0:np.ones_like(r)}
+        wanted = set(zip(nv,mv))
+        if (0,0) in wanted:
+            R[(0,0)] = prev1[0]
+        for n in range(1,nv.max() + 1):
+            row = {}
+            for m in range(n%2,n + 1,2):
+                if m == n:
+                    row[m] = r*prev1[n-1]
+                else:
+                    row[m] = r*(prev1[abs(m-1)] + prev1[m+1]) - prev2[m]
+                if (n,m) in wanted:
+                    R[(n,m)] = row[m]
+            prev2, prev1 = prev1, row
+        
+        # azimuthal terms : cosine for the even Noll indexes, sine for the odd ones
+        mod_mode = np.asarray(self.jIndex).astype('int')%2
+        cosines  = {m:np.sqrt(2)*np.cos(m*o) for m in set(mv[np.logical_not(mod_mode)]) if m}
+        sines    = {m:np.sqrt(2)*np.sin(m*o) for m in set(mv[mod_mode.astype(bool)]) if m}
+        values   = np.zeros((self.nModes,len(r)))
+        for k in range(self.nModes):
+            n, m = nv[k], mv[k]
+            np.multiply(np.sqrt(n+1),R[(n,m)],out=values[k])
+            if m and mod_mode[k]:
+                values[k] *= sines[m]
+            elif m:
+                values[k] *= cosines[m]
+        modes[:,pupLog] = values
+        
+        return modes
             
 #%% 2ND ORDER MOMENTS
     def CoefficientsVariance(self,x):
@@ -298,30 +303,27 @@ class zernike:
             
         return zern_var
 
-    def tiltsAngularCovariance(self,tel,atm,src,gs,tilt='Z',lag=0):
-        
-        def sumLayers(f,j,i, ax, ay):
-            g = np.pi*( (-1)**i + (-1)**j - 2 )/4
-            h = np.pi*( (-1)**i - (-1)**j )/4
-            outSumLayers = 0;
-            for k in range(atm.nL):
-                srcVx = ax*atm.heights[k] + lag*atm.wSpeed[k]*np.exp(1*complex(0,1)*atm.wDir[k])
-                srcVy = ay*atm.heights[k] + lag*atm.wSpeed[k]*np.exp(1*complex(0,1)*atm.wDir[k])
-                srcV = srcVx + complex(0,1)*srcVy
-                rho = abs(srcV)
-                arg = np.angle(srcV)
-                red = 2*np.pi*f*rho
-                Itheta = -np.pi*( ssp.jn(2,red) * np.cos(2*arg+g) -   ssp.j0(red)* np.cos(h) )
-                psd = atm.weights[k] *  psdCst*(f ** 2 + 1/atm.L0**2)**(-11./6)
-                outSumLayers += psd * Itheta   
-            return outSumLayers
-        
+    def tiltsAngularCovariance(self,tel,atm,src,gs,tilt='Z',lag=0,perLayer=False,tol=1e-8,memoryBudgetMB=256):
+        """ Angular covariance (nSrc x 2 x 2) of the tip and tilt between the sources src and gs, summed over
+        the layers, or per layer (nSrc x nL x 2 x 2) for a unit r0^(-5/3) with the outer scale of each layer
+        if perLayer is True. The covariances are Hankel integrals over the spatial frequencies of the
+        separations projected on the layers, evaluated for all the sources and layers at once with the
+        Simpson rule on logarithmic nodes below 1/D, and with Gauss-Legendre panels between 1/D and 100/D.
+        The number of panels is doubled until the integrals change by less than tol relative to the tilt
+        variance.
+        """
         D  = tel.D
         R  = D/2
-        psdCst = (24*ssp.gamma(6./5)/5)**(5./6) * (ssp.gamma(11./6)**2/(2*np.pi**(11./3))) * atm.r0 ** (-5./3)
-        axs = src.direction[0] - gs.direction[0]
-        ays = src.direction[1] - gs.direction[1]
-        cov = np.zeros((len(axs),2,2))            
+        nL = atm.nL
+        psdCst = (24*ssp.gamma(6./5)/5)**(5./6) * (ssp.gamma(11./6)**2/(2*np.pi**(11./3)))
+        if perLayer:
+            amp = np.ones(nL)
+            L0  = np.array([atm.layer[k].L0 for k in range(nL)],dtype=float)
+        else:
+            amp = atm.weights * atm.r0 ** (-5./3)
+            L0  = atm.L0*np.ones(nL)
+        axs = np.atleast_1d(src.direction[0] - gs.direction[0])
+        ays = np.atleast_1d(src.direction[1] - gs.direction[1])
 
         if tilt == 'Z':
                 tiltsFilter = lambda f: f*(2.*ssp.jn(2,np.pi*f*D)/(np.pi*f*R))**2
@@ -331,23 +333,67 @@ class zernike:
                 tiltsFilter = lambda f: f*2*ssp.jn(2,np.pi*f*D) * ssp.j1(np.pi*f*D)/(np.pi*f*R)
         else:
             print('tilts filters are either Z, G or ZG')
-            
-        # integration
-        for s in range(len(axs)):
-            ax=axs[s]
-            ay=ays[s]
-            cov[s,0,0] = integrate.quad( lambda f: sumLayers(f,2,2,ax,ay)*tiltsFilter(f) , 0 , np.inf)[0]
-            cov[s,0,1] = integrate.quad( lambda f: sumLayers(f,2,3,ax,ay)*tiltsFilter(f) , 0 , np.inf)[0]
-            cov[s,1,0] = integrate.quad( lambda f: sumLayers(f,3,2,ax,ay)*tiltsFilter(f) , 0 , np.inf)[0]
-            cov[s,1,1] = integrate.quad( lambda f: sumLayers(f,3,3,ax,ay)*tiltsFilter(f) , 0 , np.inf)[0]
-
-        return cov
+        
+        # separations projected on the layers (nSrc x nL)
+        wind = lag*atm.wSpeed*np.exp(1*complex(0,1)*atm.wDir)*np.ones(nL)
+        srcV = axs[:,np.newaxis]*atm.heights + wind + complex(0,1)*(ays[:,np.newaxis]*atm.heights + wind)
+        rho  = abs(srcV)
+        arg  = np.angle(srcV)
+        
+        def integrals(f,w):
+            # Hankel integrals of order 0 and 2 (nSrc x nL) on the nodes f with the weights w
+            W  = np.pi*w * amp[:,np.newaxis]*psdCst*(f**2 + 1/L0[:,np.newaxis]**2)**(-11./6) * tiltsFilter(f)
+            A0 = np.zeros(rho.shape)
+            A2 = np.zeros(rho.shape)
+            nBlock = max(1,int(memoryBudgetMB*2**20/(8*2*nL*len(f))))
+            for k in range(0,len(axs),nBlock):
+                red = 2*np.pi*rho[k:k+nBlock,:,np.newaxis]*f
+                A0[k:k+nBlock] = np.einsum('slf,lf->sl',ssp.j0(red),W)
+                A2[k:k+nBlock] = np.einsum('slf,lf->sl',ssp.jn(2,red),W)
+            return A0, A2
+        
+        def simpson(n,h):
+            w = h/3*np.ones(n)
+            w[1:-1:2] *= 4
+            w[2:-1:2] *= 2
+            return w
+        
+        # logarithmic nodes below 1/D, and power-law extrapolation of the order 0 integrand down to 0 (the
+        # order 2 one vanishes faster)
+        u    = np.linspace(np.log(1e-6/D),np.log(1/D),385)
+        fLog = np.exp(u)
+        A0, A2 = integrals(fLog,simpson(len(u),u[1] - u[0])*fLog)
+        F    = tiltsFilter(fLog[:2])*(fLog[:2]**2 + 1/L0[:,np.newaxis]**2)**(-11./6)
+        p    = np.log(F[:,1]/F[:,0])/(u[1] - u[0])
+        A0  += integrals(fLog[:1],(fLog[0]/(p + 1))[:,np.newaxis])[0]
+        
+        # Gauss-Legendre panels resolving the oscillations of the filter and of the Bessel functions, whose
+        # number is doubled until convergence
+        x,w    = np.polynomial.legendre.leggauss(8)
+        nPanel = int(np.ceil(2*99*max(D,np.max(rho))/D))
+        for it in range(6):
+            edges  = np.linspace(1/D,100/D,nPanel + 1)
+            h      = (edges[1] - edges[0])/2
+            B0, B2 = integrals((edges[:-1,np.newaxis] + h*(x + 1)).ravel(),np.tile(h*w,nPanel))
+            if it and max(np.max(abs(B0 - C0)),np.max(abs(B2 - C2))) <= tol*np.max(abs(A0 + B0)):
+                break
+            C0, C2  = B0, B2
+            nPanel *= 2
+        A0, A2 = A0 + B0, A2 + B2
+        
+        # tip-tilt covariance
+        c2 = np.cos(2*arg)
+        s2 = np.sin(2*arg)
+        cov = np.array([[A0 - A2*c2,-A2*s2],[-A2*s2,A0 + A2*c2]]).transpose(2,3,0,1)
+        if perLayer:
+            return cov
+        return cov.sum(axis=1)
     
-    def anisokinetism(self,tel,atm,src,gs,tilt='Z'):
+    def anisokinetism(self,tel,atm,src,gs,tilt='Z',perLayer=False):
         
-        C1 = self.tiltsAngularCovariance(tel,atm,src,src,tilt='Z',lag=0)
-        C2 = self.tiltsAngularCovariance(tel,atm,gs,gs,tilt='Z',lag=0)
-        C3 = self.tiltsAngularCovariance(tel,atm,src,gs,tilt='Z',lag=0)
+        C1 = self.tiltsAngularCovariance(tel,atm,src,src,tilt='Z',lag=0,perLayer=perLayer)
+        C2 = self.tiltsAngularCovariance(tel,atm,gs,gs,tilt='Z',lag=0,perLayer=perLayer)
+        C3 = self.tiltsAngularCovariance(tel,atm,src,gs,tilt='Z',lag=0,perLayer=perLayer)
         
         return C1 + C2 - 2*C3
             
\ No newline at end of file
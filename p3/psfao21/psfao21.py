@@ -10,7 +10,7 @@ Created on Thu Feb 11 17:50:20 2021
 #from amiral import parameter
 # TODO - Move some amiral native functions in here!
 import numpy as np
-import numpy.fft as fft
+from p3.aoSystem.fftBackend import fft
 import time
 import sys
 
@@ -25,17 +25,22 @@ rad2arc = rad2mas / 1000
 
 class psfao21:
     # INIT
-    def __init__(self,path_ini,path_root='',antiAlias=False,fitCn2=False,otfPixel=1,coo_stars=None,filter_tt=False):
+    def __init__(self,path_ini,path_root='',antiAlias=False,fitCn2=False,otfPixel=1,coo_stars=None,filter_tt=False,precision='double',cacheDir=None):
 
         tstart = time.time()
 
         # PARSING INPUTS
         self.file      = path_ini
         self.antiAlias = antiAlias
-        self.ao        = aoSys(path_ini,path_root=path_root,coo_stars=coo_stars)
+        self.ao        = aoSys(path_ini,path_root=path_root,coo_stars=coo_stars,cacheDir=cacheDir)
         self.isStatic  = self.ao.tel.nModes > 0
         self.tag       = 'PSFAO21'
         self.otfPixel  = otfPixel
+        if precision not in ['double','single']:
+            raise ValueError('The precision must be double or single')
+        self.precision = precision
+        # the PSD, the structure function and the OTFs are computed in this type
+        self.dtype     = np.float32 if precision == 'single' else np.float64
 
         if self.ao.error==False:
 
@@ -123,14 +128,19 @@ class psfao21:
         # Combination
         A_emp = np.trapz(np.trapz(psd,self.freq.ky_[0]),self.freq.ky_[0])
         psd   = x0[0]**(-5/3) * self.freq.psdKolmo_ + self.freq.mskIn_ * (x0[1] + psd/A_emp * x0[2] )
-        # Wavefront error
-        self.wfe     = np.sqrt( np.trapz(np.trapz(psd,self.freq.kx_[:,0]),self.freq.kx_[:,0]) ) * self.freq.wvlRef*1e9/2/np.pi
-        self.wfe_fit = np.sqrt(x0[0]**(-5/3)) * self.freq.wfe_fit_norm  * self.freq.wvlRef*1e9/2/np.pi
         return psd
 
-    def getSF(self,Cn2=[]):
+    def getWavefrontError(self,psd,r0):
+        # Total and fitting wavefront errors in nm
+        wfe     = np.sqrt( np.trapz(np.trapz(psd,self.freq.kx_[:,0]),self.freq.kx_[:,0]) ) * self.freq.wvlRef*1e9/2/np.pi
+        wfe_fit = np.sqrt(r0**(-5/3)) * self.freq.wfe_fit_norm  * self.freq.wvlRef*1e9/2/np.pi
+        return wfe, wfe_fit
+
+    def getSF(self,Cn2=[],psd=None):
+        if psd is None:
+            psd = self.psd
         #covariance map
-        Bphi  = fft.fft2(fft.fftshift(self.psd)) / (self.ao.tel.D * self.freq.sampRef)**2
+        Bphi  = fft.fft2(fft.fftshift(psd),**FourierUtils.fftOptions(psd)) / (self.ao.tel.D * self.freq.sampRef)**2
         # On-axis phase structure function
         SF   = fft.fftshift(np.real(2*(Bphi.max() - Bphi)))
         # Anisoplanatism phase structure function
@@ -138,12 +148,12 @@ class psfao21:
             SF = SF[:,:,np.newaxis] + (self.freq.dphi_ani * Cn2).sum(axis=2)
         else:
             SF = np.repeat(SF[:,:,np.newaxis],self.ao.src.nSrc,axis=2)
-        return SF /(2*np.pi*1e-9/self.freq.wvlRef)**2
-
-
-    def __call__(self,x0,nPix=None):
+        return (SF /(2*np.pi*1e-9/self.freq.wvlRef)**2).astype(psd.dtype,copy=False)
 
-        # ----------------- GETTING THE PARAMETERS
+    def parseParameters(self,x0):
+        """ Splits the vector of parameters into the Cn2 profile, r0, PSD, jitter, stellar and static 
+        aberrations parameters.
+        """
         xall = x0
         # Cn2 profile
         nL   = self.ao.atm.nL
@@ -186,21 +196,36 @@ class psfao21:
         else:
             x0_stat = []
 
+        return Cn2, r0, x0_psd, x0_jitter, F, dx, dy, bkg, x0_stat
+
+    def evaluate(self,x0,nPix=None):
+        """ Returns the PSF, the Strehl-ratio, the PSD and the phase structure function for the parameters 
+        x0 without modifying the model, so that a single instance can serve concurrent evaluations.
+        """
+        Cn2, r0, x0_psd, x0_jitter, F, dx, dy, bkg, x0_stat = self.parseParameters(x0)
+
         # ----------------- GETTING THE PHASE STRUCTURE FUNCTION
-        self.psd = self.getPSD([r0]+ x0_psd)
+        psd = self.getPSD([r0]+ x0_psd).astype(self.dtype,copy=False)
 
         if self.antiAlias:
-            	self.psd = np.pad(self.psd,(self.freq.nOtf//2,self.freq.nOtf//2))
-        self.SF = self.getSF(Cn2=Cn2)
-        if self.antiAlias:
-            	self.SF   = FourierUtils.interpolateSupport(self.Dphi,self.freq.nOtf)
+            SF = self.getSF(Cn2=Cn2,psd=np.pad(psd,(self.freq.nOtf//2,self.freq.nOtf//2)))
+            SF = FourierUtils.interpolateSupport(SF,self.freq.nOtf)
+        else:
+            SF = self.getSF(Cn2=Cn2,psd=psd)
 
         # ----------------- COMPUTING THE PSF
-        PSF, self.SR = FourierUtils.SF2PSF(self.SF,self.freq,self.ao,\
+        PSF, SR = FourierUtils.SF2PSF(SF,self.freq,self.ao,\
                         jitterX=x0_jitter[0],jitterY=x0_jitter[1],jitterXY=x0_jitter[2],\
                         F=F,dx=dx,dy=dy,bkg=bkg,nPix=nPix,xStat=x0_stat,otfPixel=self.otfPixel,
                         spatialFilter=self.spatialFilter)
 
+        return PSF, SR, psd, SF
+
+    def __call__(self,x0,nPix=None):
+
+        PSF, self.SR, self.psd, self.SF = self.evaluate(x0,nPix=nPix)
+        self.wfe, self.wfe_fit = self.getWavefrontError(self.psd,self.parseParameters(x0)[1])
+
         return PSF
 
     def moffat(self,kx,ky,x0):
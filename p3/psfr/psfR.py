@@ -9,7 +9,7 @@ Created on Sat Aug 18 22:20:28 2018
 import numpy as np
 import time
 import sys
-import numpy.fft as fft
+from p3.aoSystem.fftBackend import fft
 
 from p3.aoSystem.aoSystem import aoSystem
 from p3.aoSystem.fourierModel import fourierModel
@@ -25,7 +25,7 @@ class psfR:
     """
     """
     # INIT
-    def __init__(self,trs,path_root='',nLayer=None,theta_ext=0):
+    def __init__(self,trs,path_root='',nLayer=None,theta_ext=0,cacheDir=None):
         """
         """
         # READ PARFILE
@@ -38,7 +38,7 @@ class psfR:
         self.path_ini  = trs.path_ini
         self.trs       = trs
         self.theta_ext = theta_ext
-        self.ao        = aoSystem(self.path_ini,path_root=path_root)
+        self.ao        = aoSystem(self.path_ini,path_root=path_root,cacheDir=cacheDir)
         self.tag       = 'PSF-R'
 
         # CHECK THE PUPIL
@@ -205,7 +205,10 @@ class psfR:
 
         return SF/(2*np.pi*1e-9/self.freq.wvlRef)**2
 
-    def __call__(self,x0,nPix=None):
+    def evaluate(self,x0,nPix=None):
+        """ Returns the PSF, the Strehl-ratio and the phase structure function for the parameters x0
+        without modifying the model, so that a single instance can serve concurrent evaluations.
+        """
 
         # ----------------- GETTING THE PARAMETERS
         # Cn2 profile
@@ -241,11 +244,16 @@ class psfR:
             x0_stat = []
 
         # ----------------- GETTING THE PHASE STRUCTURE FUNCTION
-        self.SF = self.TotalPhaseStructureFunction(r0,gho,gtt,Cn2=Cn2)
+        SF = self.TotalPhaseStructureFunction(r0,gho,gtt,Cn2=Cn2)
 
         # ----------------- COMPUTING THE PSF
-        PSF, self.SR = FourierUtils.SF2PSF(self.SF,self.freq,self.ao,\
+        PSF, SR = FourierUtils.SF2PSF(SF,self.freq,self.ao,\
                         F=F,dx=dx,dy=dy,bkg=bkg,nPix=nPix,xStat=x0_stat,otfPixel=self.otfPixel)
+        return PSF, SR, SF
+
+    def __call__(self,x0,nPix=None):
+
+        PSF, self.SR, self.SF = self.evaluate(x0,nPix=nPix)
         return PSF
 
     def get_error_breakdown(self,r0=None,gho=1,gtt=1):